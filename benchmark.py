@@ -0,0 +1,375 @@
+#!/usr/bin/python
+
+'''
+This script times parts of the keyword extraction pipeline on synthetic data and prints the results to standard out.
+
+Command line usage:
+./benchmark.py distances [--tokens N] [--dates N]
+./benchmark.py workers [--patients N] [--notes-per-patient N] [--tokens-per-note N] [--date-density F] [--max-workers N] [--seed N]
+./benchmark.py stages [--patients N] [--notes-per-patient N] [--tokens-per-note N] [--date-density F] [--shapes SHAPES] [--seed N]
+./benchmark.py window [--patients N] [--notes-per-patient N] [--tokens-per-note N] [--date-density F] [--windows W1,W2,...] [--top K] [--seed N]
+./benchmark.py inference [--patients N] [--notes-per-patient N] [--tokens-per-note N] [--date-density F] [--window C] [--top K] [--seed N]
+
+The distances, workers and inference benchmarks also check that the faster method they time returns exactly what the slower one does, and the script exits with status 1 if it doesn't. (See parity_check.py for the full checks of the distance backends, distance windows, n-grams and worker processes.)
+'''
+
+import argparse
+import logging
+import random
+import re
+import resource
+import sys
+import time
+from extract_keywords import *
+from infer_dates import DateInferrer, get_num_correct, DEFAULT_WINDOW, WORD_REGEX
+from synthetic_data import generate_patients, parse_shape_weights, DATE_SHAPES
+
+LOG = logging.getLogger(__name__)
+LOG.setLevel(logging.WARNING)
+
+
+def main():
+    logging.basicConfig()
+
+    parser = argparse.ArgumentParser(description="Time parts of the keyword extraction pipeline on synthetic data.")
+    subparsers = parser.add_subparsers(dest='benchmark')
+
+    distances_parser = subparsers.add_parser('distances', help="compare per-token date distance scans with the one-pass sweep and the NumPy backend on one long note")
+    distances_parser.add_argument('--tokens', type=int, default=5000, help="number of tokens in the note (default: 5000)")
+    distances_parser.add_argument('--dates', type=int, default=50, help="number of dates in the note (default: 50)")
+
+    workers_parser = subparsers.add_parser('workers', help="time keyword scoring of synthetic notes (see synthetic_data.py) with 1 to N worker processes")
+    workers_parser.add_argument('--patients', type=int, default=200, help="number of synthetic patients (default: 200)")
+    workers_parser.add_argument('--notes-per-patient', type=int, default=5, help="average number of notes per patient (default: 5)")
+    workers_parser.add_argument('--tokens-per-note', type=int, default=500, help="average number of words per note (default: 500)")
+    workers_parser.add_argument('--date-density', type=float, default=0.02, help="fraction of the words in a note that are date expressions (default: 0.02)")
+    workers_parser.add_argument('--max-workers', type=int, default=multiprocessing.cpu_count(), help="largest number of worker processes to try (default: number of CPUs)")
+    workers_parser.add_argument('--seed', type=int, default=0, help="random seed (default: 0)")
+
+    stages_parser = subparsers.add_parser('stages', help="time each stage of keyword extraction separately on synthetic notes (see synthetic_data.py)")
+    stages_parser.add_argument('--patients', type=int, default=100, help="number of synthetic patients (default: 100)")
+    stages_parser.add_argument('--notes-per-patient', type=int, default=10, help="average number of notes per patient (default: 10)")
+    stages_parser.add_argument('--tokens-per-note', type=int, default=300, help="average number of words per note (default: 300)")
+    stages_parser.add_argument('--date-density', type=float, default=0.02, help="fraction of the words in a note that are date expressions (default: 0.02)")
+    stages_parser.add_argument('--shapes', default=','.join(DATE_SHAPES), help="comma-separated date shapes to use, each optionally with a weight (default: all of them)")
+    stages_parser.add_argument('--seed', type=int, default=0, help="random seed (default: 0)")
+
+    window_parser = subparsers.add_parser('window', help="time the distance loop with and without a distance window (see set_distance_window()), and compare the rankings")
+    window_parser.add_argument('--patients', type=int, default=100, help="number of synthetic patients (default: 100)")
+    window_parser.add_argument('--notes-per-patient', type=int, default=10, help="average number of notes per patient (default: 10)")
+    window_parser.add_argument('--tokens-per-note', type=int, default=1000, help="average number of words per note (default: 1000)")
+    window_parser.add_argument('--date-density', type=float, default=0.01, help="fraction of the words in a note that are date expressions (default: 0.01)")
+    window_parser.add_argument('--windows', default='1,2,5,10,20,50,100', help="comma-separated window sizes to try (default: 1,2,5,10,20,50,100)")
+    window_parser.add_argument('--top', type=int, default=50, help="number of top keywords to compare with the full ranking (default: 50)")
+    window_parser.add_argument('--seed', type=int, default=0, help="random seed (default: 0)")
+
+    inference_parser = subparsers.add_parser('inference', help="time event date inference from learned keywords (see infer_dates.py), and compare the keyword automaton with searching the notes for each keyword in turn")
+    inference_parser.add_argument('--patients', type=int, default=200, help="number of synthetic patients; keywords are learned from the first half and event dates inferred for the second half (default: 200)")
+    inference_parser.add_argument('--notes-per-patient', type=int, default=10, help="average number of notes per patient (default: 10)")
+    inference_parser.add_argument('--tokens-per-note', type=int, default=300, help="average number of words per note (default: 300)")
+    inference_parser.add_argument('--date-density', type=float, default=0.02, help="fraction of the words in a note that are date expressions (default: 0.02)")
+    inference_parser.add_argument('--window', type=int, default=DEFAULT_WINDOW, help="window in characters around each keyword (default: %s)" % DEFAULT_WINDOW)
+    inference_parser.add_argument('--top', type=int, help="number of top keywords to infer event dates from (default: all the positive-scored ones)")
+    inference_parser.add_argument('--seed', type=int, default=0, help="random seed (default: 0)")
+
+    args = parser.parse_args()
+
+    if args.benchmark in ('window', 'inference') and args.top is not None and args.top < 0:
+        parser.error("--top can't be negative")
+
+    passed = True
+    if args.benchmark == 'distances':
+        passed = benchmark_distances(args.tokens, args.dates)
+    elif args.benchmark == 'workers':
+        passed = benchmark_workers(args.patients, args.notes_per_patient, args.tokens_per_note, args.date_density, args.max_workers, args.seed)
+    elif args.benchmark == 'stages':
+        try:
+            shape_weights = parse_shape_weights(args.shapes)
+        except ValueError as e:
+            parser.error(str(e))
+        benchmark_stages(args.patients, args.notes_per_patient, args.tokens_per_note, args.date_density, shape_weights, args.seed)
+    elif args.benchmark == 'window':
+        try:
+            windows = [int(window) for window in args.windows.split(',')]
+        except ValueError:
+            parser.error("Window sizes must be integers: %s" % args.windows)
+        benchmark_window(args.patients, args.notes_per_patient, args.tokens_per_note, args.date_density, windows, args.top, args.seed)
+    elif args.benchmark == 'inference':
+        passed = benchmark_inference(args.patients, args.notes_per_patient, args.tokens_per_note, args.date_density, args.window, args.top, args.seed)
+
+    if not passed:
+        sys.exit(1)
+
+
+def make_date_indices(num_tokens, num_dates, seed=0):
+    '''
+    This method takes as input a number of tokens, a number of dates, and (optionally) a random seed, and returns a (true date indices, false date indices) 2-tuple of sorted lists of token indices, as get_date_indices() would for a long note.
+    '''
+    rand = random.Random(seed)
+    date_indices = sorted(rand.sample(xrange(num_tokens), num_dates))
+    true_date_indices = [i for i in date_indices if rand.random() < 0.2]
+    false_date_indices = [i for i in date_indices if i not in true_date_indices]
+    return (true_date_indices, false_date_indices)
+
+
+def time_call(method, *args):
+    '''
+    This method calls the input method with the input arguments and returns a (return value, seconds elapsed) 2-tuple.
+    '''
+    start = time.time()
+    to_return = method(*args)
+    return (to_return, time.time() - start)
+
+
+def drain_queue(queue):
+    '''
+    This method takes as input a priority queue and returns a list of its items in the order in which they are returned.
+    '''
+    to_return = []
+    while not queue.empty():
+        to_return.append(queue.get())
+    return to_return
+
+
+def benchmark_distances(num_tokens, num_dates):
+    '''
+    This method compares the per-token get_ngram_distances() scan with the get_all_ngram_distances() sweep (and, if NumPy is installed, with get_all_ngram_distances_numpy()) on one note of the given size, checks that they all return the same inverse distances, and prints the timings. It returns True if the inverse distances are the same, and False if not.
+    '''
+    true_date_indices, false_date_indices = make_date_indices(num_tokens, num_dates)
+    # Date tokens themselves are never scored
+    date_indices = set(true_date_indices + false_date_indices)
+    token_indices = [i for i in xrange(num_tokens) if i not in date_indices]
+
+    def scan():
+        return [[get_ngram_distances(i, date_indices, position) for i in token_indices]
+                for date_indices in (true_date_indices, false_date_indices)
+                for position in ('PRE-DATE', 'POST-DATE')]
+
+    def sweep():
+        dists = [get_all_ngram_distances(num_tokens, date_indices, position)
+                 for date_indices in (true_date_indices, false_date_indices)
+                 for position in ('PRE-DATE', 'POST-DATE')]
+        return [[inv_dists[i] for i in token_indices] for inv_dists in dists]
+
+    scan_dists, scan_time = time_call(scan)
+    sweep_dists, sweep_time = time_call(sweep)
+
+    passed = True
+    if scan_dists != sweep_dists:
+        LOG.error("Sweep distances differ from per-token scan distances")
+        passed = False
+
+    print 'Distances for %s tokens, %s dates:' % (num_tokens, num_dates)
+    print '  per-token scan\t%.4fs' % scan_time
+    print '  sweep\t%.4fs\t%.1fx' % (sweep_time, scan_time / max(sweep_time, 1e-9))
+
+    if numpy is not None:
+        def numpy_sweep():
+            dists = [get_all_ngram_distances_numpy(num_tokens, date_indices, position)
+                     for date_indices in (true_date_indices, false_date_indices)
+                     for position in ('PRE-DATE', 'POST-DATE')]
+            return [[inv_dists[i] for i in token_indices] for inv_dists in dists]
+
+        numpy_dists, numpy_time = time_call(numpy_sweep)
+
+        # The NumPy backend must return exactly the same inverse distances as the pure python one
+        if numpy_dists != sweep_dists:
+            LOG.error("NumPy distances differ from pure python distances")
+            passed = False
+
+        print '  numpy\t%.4fs\t%.1fx' % (numpy_time, scan_time / max(numpy_time, 1e-9))
+
+    return passed
+
+
+def benchmark_workers(num_patients, notes_per_patient, tokens_per_note, date_density, max_workers, seed):
+    '''
+    This method generates synthetic patients (see synthetic_data.generate_patients()), times get_keyword_queue() on their notes with 1 to max_workers worker processes, checks that every run returns exactly the same ranking as the serial run, and prints the timings. It returns True if the rankings are the same, and False if not.
+    '''
+    blobs_dict = {}
+    gold_dates_dict = {}
+    for MRN, gold_date_expression, notes in generate_patients(num_patients, notes_per_patient, tokens_per_note, date_density, 0.2, None, seed):
+        blobs_dict[MRN] = [blob for note_date, description, blob in notes]
+        gold_dates_dict[MRN] = make_date(gold_date_expression)
+
+    print 'Keyword scoring for %s patients:' % num_patients
+    passed = True
+    serial_ranking = None
+    for workers in xrange(1, max(max_workers, 1) + 1):
+        keywords, seconds = time_call(get_keyword_queue, blobs_dict, gold_dates_dict, workers)
+        ranking = drain_queue(keywords)
+        if serial_ranking is None:
+            serial_ranking, serial_seconds = ranking, seconds
+        elif ranking != serial_ranking:
+            LOG.error("Ranking with %s workers differs from the serial ranking" % workers)
+            passed = False
+        print '  %s worker(s)\t%.3fs\t%.2fx' % (workers, seconds, serial_seconds / max(seconds, 1e-9))
+
+    return passed
+
+
+def get_peak_memory():
+    '''
+    This method returns the peak resident memory of this process so far, in megabytes.
+    '''
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def benchmark_stages(num_patients, notes_per_patient, tokens_per_note, date_density, shape_weights, seed):
+    '''
+    This method generates synthetic patients (see synthetic_data.generate_patients()) and times each stage of keyword extraction on their notes separately:
+    (1) finding date expressions (extract_dates_and_char_indices()),
+    (2) making Date objects of the date expressions found (make_date(), with an empty date expression cache),
+    (3) replacing date expressions with TRUE_DATE and FALSE_DATE (tag_dates()),
+    (4) tokenizing the tagged text (custom_tokenize() and split()),
+    (5) both of these, with the date expressions marked independently of the gold dates (tokenize_with_dates() and tag_tokenized_dates(), as add_ngram_distances() does),
+    (6) the distance loop (add_token_distances()), and
+    (7) ranking the keywords (rank_keywords()).
+    It prints the time each stage takes, its throughput in notes/sec and tokens/sec, and the peak memory of the process after it.
+    NB: Stages (3) and (5) find the date expressions again themselves, with the date expression cache already filled by stage (1).
+    '''
+    patients = []
+    for MRN, gold_date_expression, notes in generate_patients(num_patients, notes_per_patient, tokens_per_note, date_density, 0.2, shape_weights, seed):
+        patients.append((DateIndex(make_date(gold_date_expression)), [blob for note_date, description, blob in notes]))
+    num_notes = sum(len(blobs) for gold_dates_index, blobs in patients)
+
+    results = []
+    def run_stage(name, stage):
+        to_return, seconds = time_call(stage)
+        results.append((name, seconds, get_peak_memory()))
+        return to_return
+
+    def find_dates():
+        date_cache.clear()
+        return [extract_dates_and_char_indices(blob) for gold_dates_index, blobs in patients for blob in blobs]
+    date_expressions = run_stage('extract_dates_and_char_indices', find_dates)
+
+    blobs = [blob for gold_dates_index, blobs in patients for blob in blobs]
+    date_strings = [blob[start:end] for blob, expressions in zip(blobs, date_expressions) for date_val, start, end in expressions]
+    def make_dates():
+        date_cache.clear()
+        return [make_date(string) for string in date_strings]
+    run_stage('make_date', make_dates)
+
+    tagged_texts = run_stage('tag_dates', lambda: [tag_dates(blob, gold_dates_index) for gold_dates_index, blobs in patients for blob in blobs])
+    run_stage('custom_tokenize', lambda: [custom_tokenize(text).split() for text in tagged_texts])
+
+    def tokenize():
+        to_return = []
+        for gold_dates_index, blobs in patients:
+            for blob in blobs:
+                tokens, date_indices, dates = tokenize_with_dates(blob)
+                to_return.append((tokens,) + tag_tokenized_dates(date_indices, dates, gold_dates_index))
+        return to_return
+    tokenized_notes = run_stage('tokenize_with_dates', tokenize)
+    num_tokens = sum(len(tokens) for tokens, true_date_indices, false_date_indices in tokenized_notes)
+
+    def add_distances():
+        accumulator = NgramAccumulator()
+        for tokens, true_date_indices, false_date_indices in tokenized_notes:
+            add_token_distances(tokens, true_date_indices, false_date_indices, accumulator)
+        return accumulator
+    accumulator = run_stage('distance loop', add_distances)
+    run_stage('rank_keywords', lambda: rank_keywords(accumulator))
+
+    print 'Stages for %s patients, %s notes, %s tokens, %s date expressions:' % (num_patients, num_notes, num_tokens, len(date_strings))
+    print '  %-32s%10s%14s%14s%16s' % ('stage', 'seconds', 'notes/sec', 'tokens/sec', 'peak MB')
+    for name, seconds, peak_memory in results:
+        seconds = max(seconds, 1e-9)
+        print '  %-32s%10.3f%14.0f%14.0f%16.1f' % (name, seconds, num_notes / seconds, num_tokens / seconds, peak_memory)
+
+
+def benchmark_window(num_patients, notes_per_patient, tokens_per_note, date_density, windows, top, seed):
+    '''
+    This method generates synthetic patients (see synthetic_data.generate_patients()), tokenizes and tags their notes once, and then times the distance loop (add_token_distances()) over all the notes with no distance window and with each of the input windows (see set_distance_window()). For each window, it prints the time the loop takes, its speedup over scoring every token, how many of the top keywords of the full ranking are also among the top keywords of the windowed ranking, and the fraction of the full ranking's (keyword, position) pairs that keep their exact rank.
+    '''
+    tokenized_notes = []
+    for MRN, gold_date_expression, notes in generate_patients(num_patients, notes_per_patient, tokens_per_note, date_density, 0.2, None, seed):
+        gold_dates_index = DateIndex(make_date(gold_date_expression))
+        for note_date, description, blob in notes:
+            tokens, date_indices, dates = tokenize_with_dates(blob)
+            tokenized_notes.append((tokens,) + tag_tokenized_dates(date_indices, dates, gold_dates_index))
+    num_tokens = sum(len(tokens) for tokens, true_date_indices, false_date_indices in tokenized_notes)
+
+    def get_ranking(window):
+        set_distance_window(window)
+        try:
+            accumulator = NgramAccumulator()
+            start = time.time()
+            for tokens, true_date_indices, false_date_indices in tokenized_notes:
+                add_token_distances(tokens, true_date_indices, false_date_indices, accumulator)
+            seconds = time.time() - start
+        finally:
+            set_distance_window(None)
+        return ([(keyword, position) for keyword, position, score in rank_keywords(accumulator)], seconds)
+
+    full_ranking, full_seconds = get_ranking(None)
+    full_top = set(full_ranking[:top])
+
+    print 'Distance loop for %s notes, %s tokens:' % (len(tokenized_notes), num_tokens)
+    print '  %-12s%10s%10s%14s%14s' % ('window', 'seconds', 'speedup', 'top %s kept' % top, 'same rank')
+    print '  %-12s%10.3f%10.2f%14s%14.3f' % ('none', full_seconds, 1.0, '%s/%s' % (len(full_top), len(full_top)), 1.0)
+    for window in windows:
+        ranking, seconds = get_ranking(window)
+        num_kept = len(full_top.intersection(ranking[:top]))
+        num_same_rank = sum(1 for full_item, item in zip(full_ranking, ranking) if full_item == item)
+        print '  %-12s%10.3f%10.2f%14s%14.3f' % (window, seconds, full_seconds / max(seconds, 1e-9), '%s/%s' % (num_kept, len(full_top)), num_same_rank / float(max(len(full_ranking), 1)))
+
+
+def find_all_one_by_one(keywords, text):
+    '''
+    This method takes as input a list of keywords and a (lowercased) text, and returns the same list of (start index, end index, keyword index) 3-tuples that KeywordAutomaton(keywords).find_all() returns for the text (in the same order), by searching the text for each keyword in turn.
+    '''
+    hits = []
+    for keyword_index, keyword in enumerate(keywords):
+        # Zero-width matches, so that overlapping occurrences (e.g. of 'up up' in 'up up up') are all found
+        keyword_regex = re.compile(r'(?<![a-z0-9_])(?=(' + r'[^a-z0-9_]+'.join(WORD_REGEX.findall(keyword)) + r')(?![a-z0-9_]))')
+        for match in keyword_regex.finditer(text):
+            hits.append((match.start(1), match.end(1), keyword_index))
+    hits.sort(key=lambda hit: (hit[1], hit[0]))
+    return hits
+
+
+def benchmark_inference(num_patients, notes_per_patient, tokens_per_note, date_density, window, top, seed):
+    '''
+    This method generates synthetic patients (see synthetic_data.generate_patients()), learns keywords from the first half of them (get_keyword_list()), and infers the event dates of the second half from those keywords (see infer_dates.DateInferrer). It prints:
+    (1) the time it takes to find the keywords in the notes with the keyword automaton, and by searching the notes for each keyword in turn (which must find the same occurrences), and
+    (2) the time the whole inference takes (finding the keywords, finding the dates and voting), in notes/sec, and the fraction of the patients whose event date is a fuzzy match for their gold date.
+    It returns True if the keyword automaton and the search for each keyword found the same occurrences, and False if not.
+    '''
+    patients = []
+    for MRN, gold_date_expression, notes in generate_patients(num_patients, notes_per_patient, tokens_per_note, date_density, 0.2, None, seed):
+        patients.append((MRN, make_date(gold_date_expression), [blob for note_date, description, blob in notes]))
+    training = patients[:len(patients) // 2]
+    testing = patients[len(patients) // 2:]
+
+    keywords = [(keyword, position, score) for keyword, position, score in get_keyword_list(dict((MRN, blobs) for MRN, gold_dates, blobs in training), dict((MRN, gold_dates) for MRN, gold_dates, blobs in training), top) if score > 0]
+    inferrer = DateInferrer(keywords, window)
+    automaton = inferrer.automaton
+
+    blobs_dict = dict((MRN, blobs) for MRN, gold_dates, blobs in testing)
+    texts = [blob.lower() for MRN, gold_dates, blobs in testing for blob in blobs]
+    num_characters = sum(len(text) for text in texts)
+
+    automaton_hits, automaton_seconds = time_call(lambda: [automaton.find_all(text) for text in texts])
+    one_by_one_hits, one_by_one_seconds = time_call(lambda: [find_all_one_by_one(automaton.keywords, text) for text in texts])
+    passed = automaton_hits == one_by_one_hits
+    if not passed:
+        LOG.error("The keyword automaton and the search for each keyword found different keyword occurrences")
+
+    event_dates, inference_seconds = time_call(inferrer.infer_event_dates, blobs_dict)
+    num_correct = get_num_correct(event_dates, dict((MRN, gold_dates) for MRN, gold_dates, blobs in testing))
+
+    print 'Inference for %s patients, %s notes, %s characters, %s keywords, %s keyword occurrences:' % (len(testing), len(texts), num_characters, len(automaton.keywords), sum(len(hits) for hits in automaton_hits))
+    print '  %-32s%10s%14s%16s' % ('stage', 'seconds', 'notes/sec', 'MB/sec')
+    for name, seconds in (('find keywords (automaton)', automaton_seconds), ('find keywords (one by one)', one_by_one_seconds), ('infer_event_dates', inference_seconds)):
+        seconds = max(seconds, 1e-9)
+        print '  %-32s%10.3f%14.0f%16.2f' % (name, seconds, len(texts) / seconds, num_characters / seconds / 1e6)
+    print '  %s of %s event dates match a gold date (%.3f)' % (num_correct, len(testing), num_correct / float(max(len(testing), 1)))
+
+    return passed
+
+
+if __name__=='__main__':
+    main()
@@ -9,6 +9,8 @@ This module contains a Date class (a wrapper for python's datetime class that ta
 
 import logging
 import re
+import threading
+import time
 from datetime import datetime
 
 LOG = logging.getLogger(__name__)
@@ -55,20 +57,41 @@ str11 = '((?:(?:19)|(?:20))[\d]{2}) and ((?:(?:19)|(?:20))[\d]{2})'
 
 date_regex = re.compile('(?:' + ')|(?:'.join([str1, str2, str3, str4, str5, str6, str7, str8, str9, str10, str11]) + ')')
 
+# Every date expression date_regex matches starts with a digit or with a month name or abbreviation, and every month name starts with a three-letter abbreviation (including 'May', which has none in month_abrvs)
+date_anchor_regex = re.compile('[\d]|' + '|'.join(sorted(set(month[:3] for month in months.keys() + month_abrvs.keys()))))
+
 
 
 class Date(object):
     '''
     A Date object has attributes 'dt' (a python datetime), 'day_known' (a boolean that is set to False if the day of the month is unspecified), and 'month_known' (a boolean that is set to False if the month is unspecified).
     NB: day_known and month_known are set to True by default; day_known must be specified in order for month_known to be specified.
+    NB: Date objects are immutable, so that the same object can safely be shared (e.g., by the date expression cache).
+    NB: Each Date also has an integer 'key' (see make_date_key()), which packs the year, month and day of its datetime and what is known of them; Dates are compared, hashed and fuzzy-matched by their keys alone. Dates have no __dict__, since millions of them are made.
     '''
+    __slots__ = ('dt', 'day_known', 'month_known', 'key')
+
     def __init__(self, dt, day_known=True, month_known=True):
         if day_known and (not month_known):
             LOG.warning("Initializing Date object with known day but unknown month")
     
-        self.dt = dt
-        self.day_known = day_known
-        self.month_known = month_known
+        object.__setattr__(self, 'dt', dt)
+        object.__setattr__(self, 'day_known', day_known)
+        object.__setattr__(self, 'month_known', month_known)
+        object.__setattr__(self, 'key', make_date_key(dt, day_known, month_known))
+
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Date objects are immutable")
+
+
+    def __delattr__(self, name):
+        raise AttributeError("Date objects are immutable")
+
+
+    def __reduce__(self):
+        # Objects with __slots__ can't be pickled with the default protocol otherwise
+        return (Date, (self.dt, self.day_known, self.month_known))
 
         
     def __repr__(self):
@@ -78,20 +101,15 @@ class Date(object):
     def __eq__(self, other):
         if type(other) != type(self):
             return False
-
-        elif ((other.dt==self.dt) and (other.day_known==self.day_known) and (other.month_known==self.month_known)):
-            return True
-
-        else:
-            return False
+        return self.key == other.key
 
     
     def __ne__(self, other):
-        return not __eq__(other)
+        return not self.__eq__(other)
 
     
     def __hash__(self):
-        return hash(self.dt) + hash(self.day_known) + hash(self.month_known)
+        return hash(self.key)
 
 
     def is_fuzzy_match(self, other):
@@ -102,19 +120,24 @@ class Date(object):
         if type(other) != type(self):
             LOG.warning("Non-Date input cannot be a fuzzy match for Date object %s (input: %s)" % (self, str(other)))
             return False
-        
-        elif self==other:
+
+        key = self.key
+        other_key = other.key
+        if key == other_key:
             return True
-        
-        elif (other.dt==None) or (self.dt==None):
+
+        # Dates without datetimes have negative keys
+        elif key < 0 or other_key < 0:
             return False
-        
-        elif (self.month_known==False) or (other.month_known==False):
-            return (self.dt.year==other.dt.year)
-        
-        elif (self.day_known==False) or (other.day_known==False):
-            return (self.dt.month==other.dt.month and self.dt.year==other.dt.year)
-        
+
+        # If either month is unknown, the years must match
+        elif not key & other_key & DATE_KEY_MONTH_KNOWN:
+            return (key >> DATE_KEY_YEAR_SHIFT) == (other_key >> DATE_KEY_YEAR_SHIFT)
+
+        # Otherwise, if either day is unknown, the years and months must match
+        elif not key & other_key & DATE_KEY_DAY_KNOWN:
+            return (key >> DATE_KEY_MONTH_SHIFT) == (other_key >> DATE_KEY_MONTH_SHIFT)
+
         else:
             return False
 
@@ -136,254 +159,626 @@ class Date(object):
 
 
 
+def make_date_key(dt, day_known=True, month_known=True):
+    '''
+    This method takes as input a python datetime (or None) and whether its day and month are known (see Date), and returns the integer key of the Date of them: the year, month and day of the datetime and the DATE_KEY_MONTH_KNOWN and DATE_KEY_DAY_KNOWN bits, packed so that (key >> DATE_KEY_YEAR_SHIFT) is the year, (key >> DATE_KEY_MONTH_SHIFT) the (year, month) and (key >> DATE_KEY_DAY_SHIFT) the (year, month, day), or a negative key if the datetime is None.
+    NB: The time of day of the datetime is not part of the key; the datetimes of date expressions are all at midnight.
+    '''
+    known = (DATE_KEY_MONTH_KNOWN if month_known else 0) | (DATE_KEY_DAY_KNOWN if day_known else 0)
+    if dt is None:
+        return known - (1 << DATE_KEY_DAY_SHIFT)
+    return (dt.year << DATE_KEY_YEAR_SHIFT) | (dt.month << DATE_KEY_MONTH_SHIFT) | (dt.day << DATE_KEY_DAY_SHIFT) | known
+
+
+# Globals: Date Keys
+# Days take 5 bits and months 4, below the year; the lowest 2 bits say whether the month and the day are known
+DATE_KEY_DAY_KNOWN = 1
+DATE_KEY_MONTH_KNOWN = 2
+DATE_KEY_DAY_SHIFT = 2
+DATE_KEY_MONTH_SHIFT = 7
+DATE_KEY_YEAR_SHIFT = 11
+
+
+
+class DateIndex(object):
+    '''
+    A DateIndex object indexes a list of Date objects (e.g., the gold dates for a patient) by exact date, by (year, month), and by year, so that it can tell whether any of them is a fuzzy match for a given Date (see Date.is_fuzzy_match()) without comparing the Date to each of them in turn.
+    '''
+    def __init__(self, dates):
+        self.dates = list(dates)
+
+        # Years of all dates, and years of dates with unknown months (as in the Dates' keys; see make_date_key())
+        self.years = set()
+        self.month_unknown_years = set()
+        # (Year, month) keys of dates with known months, and of dates with known months but unknown days
+        self.year_months = set()
+        self.day_unknown_year_months = set()
+        # (Year, month, day) keys of dates with known months and days
+        self.full_days = set()
+        # Keys of dates without datetimes, which can only be exact matches
+        self.dtless_keys = set()
+
+        for date in self.dates:
+            key = date.key
+            if key < 0:
+                self.dtless_keys.add(key)
+            else:
+                self.years.add(key >> DATE_KEY_YEAR_SHIFT)
+                if not key & DATE_KEY_MONTH_KNOWN:
+                    self.month_unknown_years.add(key >> DATE_KEY_YEAR_SHIFT)
+                else:
+                    self.year_months.add(key >> DATE_KEY_MONTH_SHIFT)
+                    if not key & DATE_KEY_DAY_KNOWN:
+                        self.day_unknown_year_months.add(key >> DATE_KEY_MONTH_SHIFT)
+                    else:
+                        self.full_days.add(key >> DATE_KEY_DAY_SHIFT)
+
+
+    def __len__(self):
+        return len(self.dates)
+
+
+    def has_fuzzy_match(self, date):
+        '''
+        This method takes as input a Date object and returns True if any of the indexed Dates is a fuzzy match for it, else False.
+        '''
+        key = date.key
+        if key < 0:
+            return key in self.dtless_keys
+
+        # If either month is unknown, the years must match
+        elif not key & DATE_KEY_MONTH_KNOWN:
+            return (key >> DATE_KEY_YEAR_SHIFT) in self.years
+
+        elif (key >> DATE_KEY_YEAR_SHIFT) in self.month_unknown_years:
+            return True
+
+        # Otherwise, if either day is unknown, the years and months must match
+        elif not key & DATE_KEY_DAY_KNOWN:
+            return (key >> DATE_KEY_MONTH_SHIFT) in self.year_months
+
+        elif (key >> DATE_KEY_MONTH_SHIFT) in self.day_unknown_year_months:
+            return True
+
+        # Otherwise, the dates must be equal
+        else:
+            return (key >> DATE_KEY_DAY_SHIFT) in self.full_days
+
+
+
+class DateCache(object):
+    '''
+    A DateCache object is a least-recently-used cache mapping date expression strings to the tuple of Date objects that make_date() returns for them (or None if no date can be made).
+    It holds at most 'max_size' expressions and counts its hits, misses, and evictions.
+    NB: A DateCache is thread-safe (e.g. for the request threads of keyword_server.py): each method holds the cache's lock, but make_date() parses an expression that isn't cached without it, so two threads may both parse the same expression.
+    '''
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.reset()
+
+
+    def reset(self):
+        '''
+        This method empties the cache and resets its counts; the caller must hold the cache's lock (see clear()).
+        '''
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # Maps each string to its link in a circular doubly linked list of [prev, next, string, dates] links, ordered from least to most recently used
+        self.links = {}
+        self.root = []
+        self.root[:] = [self.root, self.root, None, None]
+
+
+    def __len__(self):
+        return len(self.links)
+
+
+    def get(self, string):
+        '''
+        This method takes as input a date expression string and returns a (found, dates) 2-tuple, where 'found' is True if the string is in the cache.
+        '''
+        with self.lock:
+            link = self.links.get(string)
+            if link is None:
+                self.misses += 1
+                return (False, None)
+
+            # Move the link to the most recently used end of the list
+            prev_link, next_link, string, dates = link
+            prev_link[1] = next_link
+            next_link[0] = prev_link
+            last = self.root[0]
+            last[1] = self.root[0] = link
+            link[0] = last
+            link[1] = self.root
+
+            self.hits += 1
+            return (True, dates)
+
+
+    def put(self, string, dates):
+        '''
+        This method takes as input a date expression string and the tuple of Date objects (or None) to store for it, evicting the least recently used string if the cache is full.
+        '''
+        with self.lock:
+            if self.max_size <= 0 or string in self.links:
+                return
+
+            if len(self.links) >= self.max_size:
+                oldest = self.root[1]
+                oldest[0][1] = oldest[1]
+                oldest[1][0] = oldest[0]
+                del self.links[oldest[2]]
+                self.evictions += 1
+
+            last = self.root[0]
+            link = [last, self.root, string, dates]
+            last[1] = self.root[0] = self.links[string] = link
+
+
+    def clear(self):
+        '''
+        This method empties the cache and resets its counts.
+        '''
+        with self.lock:
+            self.reset()
+
+
+    def stats(self):
+        '''
+        This method returns a dictionary of the cache's hits, misses, evictions, current size, and maximum size.
+        '''
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'size': len(self.links), 'max_size': self.max_size}
+
+
+
+# Globals: Date Expression Cache
+# Set the size to 0 (see set_date_cache_size()) to turn the cache off
+DEFAULT_DATE_CACHE_SIZE = 10000
+date_cache = DateCache(DEFAULT_DATE_CACHE_SIZE)
+
+
+def set_date_cache_size(max_size):
+    '''
+    This method takes as input the maximum number of date expressions to cache (0 or None to turn the cache off) and replaces the date expression cache with an empty cache of that size.
+    '''
+    global date_cache
+    date_cache = DateCache(max_size or 0)
+
+
+def get_date_cache_stats():
+    '''
+    This method returns a dictionary of the date expression cache's hits, misses, evictions, current size, and maximum size.
+    '''
+    return date_cache.stats()
+
+
+
+def find_date_matches(string):
+    '''
+    This method takes as input a string and yields the same match objects, for the same date expressions, as date_regex.finditer(string).
+    NB: Rather than trying all the alternatives of date_regex at every character, this method only tries date_regex at the anchors where a date expression can start (see date_anchor_regex): digits, and month names and abbreviations. A string with no anchors is scanned once, with a much simpler pattern.
+    '''
+    search_anchor = date_anchor_regex.search
+    match_date = date_regex.match
+
+    position = 0
+    while True:
+        anchor = search_anchor(string, position)
+        if anchor is None:
+            return
+
+        # As finditer() does, look for the next date expression after the end of this one, or from the next character if there is none here
+        start = anchor.start()
+        match = match_date(string, start)
+        if match is None:
+            position = start + 1
+        else:
+            yield match
+            position = match.end()
+
+
+
 def extract_date(string, position):
     '''
     This method takes as input a string from which to extract a date and either 'first' or 'last' (specifying whether to return the first or last date found), and returns the first or last internal string that looks like a date.
     NB: This method returns a string corresponding to a date expression, not a Date object. The output can then be fed to make_date() to generate a Date object.
     '''
-    if date_regex.search(string):
+    date = None
+    for match in find_date_matches(string):
+        date = match
         if position=='first':
-            date = min(date_regex.finditer(string), key=lambda x: x.start())
-        if position=='last':
-#           LOG.debug(string)
-            date = max(date_regex.finditer(string), key=lambda x: x.start())
-#           LOG.debug("Returning pre-window date %s" % date.group(0))
+            break
+#   LOG.debug("Returning pre-window date %s" % date.group(0))
+    if date is not None and position in ('first', 'last'):
         return date.group(0)
 
 
 
-def extract_dates_and_char_indices(string):
+def extract_dates_and_char_indices(string, stats=None):
     '''
     This method takes as input a string from which to extract dates and returns a list of (Date, start_index, end_index) 3-tuples.
+    If a stats object is given (see extract_keywords.PipelineStats), the date expressions found and the ones no Date could be made of are counted in it, and the time spent matching date_regex and making Dates is added to its 'find_dates' and 'parse_dates' timers.
     '''
+    if stats is not None:
+        return extract_dates_and_char_indices_with_stats(string, stats)
+
     to_return = []
 
-    if date_regex.search(string):
-        for match in date_regex.finditer(string):
-#           LOG.debug("Found date expression: %s" % match.group(0))
-            match_dates = make_date(match.group(0))
-            if match_dates:
-                match_date = match_dates[0]
-                match_start = match.start()
-                match_end = match.end()
-                to_return.append((match_date, match_start, match_end))
-            else:
-                LOG.warning("Tried unsuccessfully to make date from %s" % match.group(0))
-#               LOG.debug(string)
+    for match in find_date_matches(string):
+#       LOG.debug("Found date expression: %s" % match.group(0))
+        match_dates = make_date_from_match(match)
+        if match_dates:
+            match_date = match_dates[0]
+            match_start = match.start()
+            match_end = match.end()
+            to_return.append((match_date, match_start, match_end))
+        else:
+            LOG.warning("Tried unsuccessfully to make date from %s" % match.group(0))
+#           LOG.debug(string)
         
     return to_return
 
 
 
+def extract_dates_and_char_indices_with_stats(string, stats):
+    '''
+    This method does what extract_dates_and_char_indices() does, and also counts and times it in the input stats object.
+    '''
+    to_return = []
+
+    start = time.time()
+    parse_seconds = 0.0
+    for match in find_date_matches(string):
+        stats.count('date_expressions')
+        parse_start = time.time()
+        match_dates = make_date_from_match(match)
+        parse_seconds += time.time() - parse_start
+        if match_dates:
+            to_return.append((match_dates[0], match.start(), match.end()))
+        else:
+            stats.count('date_parse_failures')
+            LOG.warning("Tried unsuccessfully to make date from %s" % match.group(0))
+
+    stats.add_time('find_dates', time.time() - start - parse_seconds)
+    stats.add_time('parse_dates', parse_seconds)
+
+    return to_return
+
+
+
 def make_date(string):
     '''
     This method takes a string as input and returns a list of representative Date objects. In most cases, this list is length 1, except for the case of coordinated years or coordinated month/year combos, in which the returned list is length 2.
     '''
-    LOG.debug("Creating date from string %s" % string)
-    
-    mdy1 = re.compile(r'^('+'|'.join(months.keys())+')[ ,]*(?:([\d]{1,2})(?:st|nd|rd|th)?)?[ ,\']+((?:(?:19)|(?:20)|\')[\d]{2})$')
-    mdy2 = re.compile(r'^('+'|'.join(month_abrvs.keys())+')[ ,\.]*(?:([\d]{1,2})(?:st|nd|rd|th)?)?[ ,\']+((?:(?:19)|(?:20)|\')[\d]{2})$')
-    mdy3 = re.compile('^([\d]{1,2})([/\-])([\d]{1,2})\\2((?:(?:19)|(?:20))?[\d]{2})$')
-    mdy4 = re.compile('^([\d]{1,2})[/\-]((?:(?:19)|(?:20))[\d]{2})$')
-    mdy5 = re.compile('^((?:(?:19)|(?:20))[\d]{2}) in ('+'|'.join(month_abrvs.keys())+'|'.join(months.keys())+')$')
-    mdy6 = re.compile('^((?:(?:19)|(?:20))[\d]{2})([/\-])([\d]{1,2})\\2([\d]{1,2})$')
-    mdy7=re.compile('^((?:(?:19)|(?:20))[\d]{2})$')
-    mdy8 = re.compile('^('+'|'.join(month_abrvs.keys()+months.keys())+')(?:[ ,\.\']+((?:(?:19)|(?:20))?[\d]{2}))?,? +and +('+'|'.join(month_abrvs.keys()+months.keys())+')[ ,\.\']+((?:(?:19)|(?:20))?[\d]{2})$')
-    mdy9 = re.compile('^((?:(?:19)|(?:20))[\d]{2}) +and +((?:(?:19)|(?:20))[\d]{2})$')
+    LOG.debug("Creating date from string %s", string)
+
+    if date_cache.max_size > 0:
+        found, dates = date_cache.get(string)
+        if not found:
+            dates = parse_date(string)
+            date_cache.put(string, dates)
+    else:
+        dates = parse_date(string)
+
+    # Return a new list so that callers can't change what is cached
+    if dates:
+        return list(dates)
+
+
+
+def parse_date(string):
+    '''
+    This method takes a string as input and returns a tuple of representative Date objects (see make_date()), or None if no date can be made. Unlike make_date(), it does not use the date expression cache.
+    '''
+    # Use the first pattern that matches the whole string
+    for mdy, make_dates in mdy_parsers:
+        match = mdy.match(string)
+        if match:
+            return to_tuple(make_dates(string, *match.groups()))
+
+    LOG.warning("Could not create Date object (text: %s)" % string)
+
+
+
+def make_date_from_match(match):
+    '''
+    This method takes as input a match object returned by date_regex and returns the same list of Date objects that make_date() returns for the matched string.
+    NB: Rather than matching the string again, this method uses the groups already captured by the alternative of date_regex that matched.
+    '''
+    string = match.group(0)
+    LOG.debug("Creating date from string %s", string)
+
+    if date_cache.max_size > 0:
+        found, dates = date_cache.get(string)
+        if not found:
+            dates = parse_date_match(match)
+            date_cache.put(string, dates)
+    else:
+        dates = parse_date_match(match)
+
+    if dates:
+        return list(dates)
+
+
+
+def parse_date_match(match):
+    '''
+    This method takes as input a match object returned by date_regex and returns a tuple of representative Date objects (see make_date_from_match()), or None if no date can be made. It does not use the date expression cache.
+    '''
+    # The last group of every alternative is required, so the index of the last matched group tells us which alternative matched
+    first_group, make_dates = date_regex_parsers[match.lastindex]
+    return to_tuple(make_dates(match.group(0), *match.groups()[first_group - 1:match.lastindex]))
+
+
+
+def to_tuple(dates):
+    '''
+    This method takes as input a list of Date objects (or None) and returns it as a tuple (or None), so that it can be cached.
+    '''
+    if dates is not None:
+        return tuple(dates)
+
+
+
+# Methods for building Date objects from the groups of the patterns below
+# NB: Each method takes the full date expression (for logging) followed by the groups of the pattern
+
+def make_dates_mdy1(string, month, day, year):
+    LOG.debug("Matched mdy1")
 
     # Default is to assume years are 4 digits (always check and reset yr_string to 'y' if 2 digits)
     yr_string='Y'
-    
-    if mdy1.match(string):
-        LOG.debug("Matched mdy1")
-        if len(mdy1.match(string).group(3))==2:
-            yr_string='y'
-        
-        # Start by looking for fully named months, with years and possibly with days  
-        if mdy1.match(string).group(2):            
-            dt = make_datetime_myd(mdy1.match(string).group(1),mdy1.match(string).group(3),mdy1.match(string).group(2),'%B,%'+yr_string+',%d')
-            if dt:
-                date = Date(dt)
-                LOG.debug("Input was %s; matched mdy1; returning date %s" % (string, date))
-                return [date]
-            else:
-                LOG.warning("Could not create Date object (text: %s)" % string)            
-
-        # Back off to month and year (do nothing with month and two digits, which could be year or day)
-        elif len(mdy1.match(string).group(3))==4:
-            dt = make_datetime_my(mdy1.match(string).group(1),mdy1.match(string).group(3),'%B,%Y')
-            if dt:
-                date = Date(dt, False)
-                LOG.debug("Input was %s; matched mdy1 with no day; returning date %s" % (string, date))
-                return [date]
-            else:
-                LOG.warning("Could not create Date object (text: %s)" % string)
-        
-        # Deal with abbreviated years with apostrophes
-        elif len(mdy1.match(string).group(3))==3:
-            dt = make_datetime_my(mdy1.match(string).group(1),mdy1.match(string).group(3)[1:],'%B,%y')
-            if dt:
-                date = Date(dt, False)
-                LOG.debug("Input was %s; matched mdy1 with no day; returning date %s" % (string, date))
-                return [date]
-            else:
-                LOG.warning("Could not create Date object (text: %s)" % string)
-        
+    if len(year)==2:
+        yr_string='y'
 
-    # Back off to common month abbreviations, with years and possibly days
-    elif mdy2.match(string):
-        LOG.debug("Matched mdy2")
-        if len(mdy2.match(string).group(3))==2:
-            yr_string='y'
-            
-        if mdy2.match(string).group(2):
-            dt = make_datetime_myd(mdy2.match(string).group(1),mdy2.match(string).group(3),mdy2.match(string).group(2),'%b,%'+yr_string+',%d')
-            date = Date(dt)
-            LOG.debug("Input was %s; matched mdy2; returning date %s" % (string, date))
-            return [date]
-
-        # Back off to abbreviated month and year (do nothing with month and two digits, which could be year or day)
-        elif len(mdy2.match(string).group(3))==4:
-            dt = make_datetime_my(mdy2.match(string).group(1),mdy2.match(string).group(3),'%b,%Y')
-            if dt:
-                date = Date(dt, False)
-                LOG.debug("Input was %s; matched mdy2 with abbreviated month; returning date %s" % (string, date))
-                return [date]
-            else:
-                LOG.warning("Could not create Date object (text: %s)" % string)
-        
-        # Back off to abbreviated month and year abbreviated with apostrophe
-        elif len(mdy2.match(string).group(3))==3:
-            dt = make_datetime_my(mdy2.match(string).group(1),mdy2.match(string).group(3)[1:],'%b,%y')
-            if dt:
-                date = Date(dt, False)
-                LOG.debug("Input was %s; matched mdy2 with abbreviated month; returning date %s" % (string, date))
-                return [date]
-            else:
-                LOG.warning("Could not create Date object (text: %s)" % string)
-
-    # Back off to month/day/year or month-day-year
-    elif mdy3.match(string):
-        LOG.debug("Matched mdy3")
-        if len(mdy3.match(string).group(4))==2:
-            yr_string='y'
-        dt = make_datetime_myd(mdy3.match(string).group(1),mdy3.match(string).group(4),mdy3.match(string).group(3),'%m,%'+yr_string+',%d')
+    # Start by looking for fully named months, with years and possibly with days
+    if day:
+        dt = make_datetime_myd(month,year,day,'%B,%'+yr_string+',%d')
         if dt:
             date = Date(dt)
-            LOG.debug("Input was %s; matched mdy3; returning date %s" % (string, date))
+            LOG.debug("Input was %s; matched mdy1; returning date %s", string, date)
             return [date]
         else:
             LOG.warning("Could not create Date object (text: %s)" % string)
 
-    # Back off to month/year or month-year
-    elif mdy4.match(string):
-        LOG.debug("Matched mdy4")     
-        dt = make_datetime_my(mdy4.match(string).group(1),mdy4.match(string).group(2),'%m,%Y')
+    # Back off to month and year (do nothing with month and two digits, which could be year or day)
+    elif len(year)==4:
+        dt = make_datetime_my(month,year,'%B,%Y')
         if dt:
             date = Date(dt, False)
-            LOG.debug("Input was %s; matched mdy4; returning date %s" % (string, date))
+            LOG.debug("Input was %s; matched mdy1 with no day; returning date %s", string, date)
             return [date]
         else:
             LOG.warning("Could not create Date object (text: %s)" % string)
-    
-    # Back off to "year in month" or "year in month abbreviation"
-    elif mdy5.match(string):
-        LOG.debug("Matched mdy5")
-        if mdy5.match(string).group(1) in months:
-            dt = make_datetime_my(mdy5.match(string).group(2),mdy5.match(string).group(1),'%B,%Y')
-        else:
-            dt = make_datetime_my(mdy5.match(string).group(2),mdy5.match(string).group(1),'%b,%Y')
+
+    # Deal with abbreviated years with apostrophes
+    elif len(year)==3:
+        dt = make_datetime_my(month,year[1:],'%B,%y')
         if dt:
             date = Date(dt, False)
-            LOG.debug("Input was %s; matched mdy5; returning date %s" % (string, date))
+            LOG.debug("Input was %s; matched mdy1 with no day; returning date %s", string, date)
             return [date]
         else:
             LOG.warning("Could not create Date object (text: %s)" % string)
 
-    # Back off to year/month/day or year-month-day
-    elif mdy6.match(string):
-        LOG.debug("Matched mdy6")
-        dt = make_datetime_myd(mdy6.match(string).group(3),mdy6.match(string).group(1),mdy6.match(string).group(4),'%m,%'+yr_string+',%d')
 
+def make_dates_mdy2(string, month, day, year):
+    LOG.debug("Matched mdy2")
+
+    yr_string='Y'
+    if len(year)==2:
+        yr_string='y'
+
+    if day:
+        dt = make_datetime_myd(month,year,day,'%b,%'+yr_string+',%d')
+        date = Date(dt)
+        LOG.debug("Input was %s; matched mdy2; returning date %s", string, date)
+        return [date]
+
+    # Back off to abbreviated month and year (do nothing with month and two digits, which could be year or day)
+    elif len(year)==4:
+        dt = make_datetime_my(month,year,'%b,%Y')
         if dt:
-            date = Date(dt)
-            LOG.debug("Input was %s; matched mdy6; returning date %s" % (string, date))
+            date = Date(dt, False)
+            LOG.debug("Input was %s; matched mdy2 with abbreviated month; returning date %s", string, date)
             return [date]
         else:
             LOG.warning("Could not create Date object (text: %s)" % string)
 
-    # Back off to just a year
-    elif mdy7.match(string):
-        LOG.debug("Matched mdy7")
-        dt = make_datetime_y(mdy7.match(string).group(1),'%Y')
-
+    # Back off to abbreviated month and year abbreviated with apostrophe
+    elif len(year)==3:
+        dt = make_datetime_my(month,year[1:],'%b,%y')
         if dt:
-            date = Date(dt, False, False)
-            LOG.debug("Input was %s; matched mdy7; returning date %s" % (string, date))
+            date = Date(dt, False)
+            LOG.debug("Input was %s; matched mdy2 with abbreviated month; returning date %s", string, date)
             return [date]
         else:
             LOG.warning("Could not create Date object (text: %s)" % string)
 
-    # Look for coordinated month and year combos
-    elif mdy8.match(string):
-        LOG.debug("Matched mdy8")
-        mdy8_match = mdy8.match(string)
-        
-        # If no year given for first month, use the second month's year
-        if not mdy8_match.group(2):
-            yr_group = mdy8_match.group(4)
-        else:
-            yr_group = mdy8_match.group(2)
-            
-        if len(yr_group)==2:
-            yr_string='y'
-        
-        if mdy8_match.group(1) in months.keys():
-            mo_string = 'B'
-        else:
-            mo_string = 'b'
-        dt1 = make_datetime_my(mdy8_match.group(1), yr_group, '%'+mo_string+',%'+yr_string)
-        
-        if len(mdy8_match.group(4))==2:
-            yr_string='y'
-        else:
-            yr_string='Y'
 
-        if mdy8_match.group(3) in months.keys():
-            mo_string = 'B'
-        else:
-            mo_string = 'b'
-        dt2 = make_datetime_my(mdy8_match.group(3), mdy8_match.group(4), '%'+mo_string+',%'+yr_string)
-
-        if dt1 and dt2:
-            date1 = Date(dt1, False)
-            date2 = Date(dt2, False)
-            LOG.debug("Input was %s; matched mdy8; returning dates %s, %s" % (string, date1, date2))
-            return [date1, date2]
-        else:
-            LOG.warning("Could not create Date object (text: %s)" % string)
-    
-    # Look for coordinated year combos
-    elif mdy9.match(string):
-        LOG.debug("Matched mdy9")
-        mdy9_match = mdy9.match(string)
+def make_dates_mdy3(string, month, day, year):
+    LOG.debug("Matched mdy3")
 
-        dt1 = make_datetime_y(mdy9_match.group(1),'%Y')
-        dt2 = make_datetime_y(mdy9_match.group(2),'%Y')
+    yr_string='Y'
+    if len(year)==2:
+        yr_string='y'
+
+    dt = make_datetime_myd(month,year,day,'%m,%'+yr_string+',%d')
+    if dt:
+        date = Date(dt)
+        LOG.debug("Input was %s; matched mdy3; returning date %s", string, date)
+        return [date]
+    else:
+        LOG.warning("Could not create Date object (text: %s)" % string)
 
-        if dt1 and dt2:    
-            date1 = Date(dt1, False, False)
-            date2 = Date(dt2, False, False)
-            LOG.debug("Input was %s; matched mdy9; returning dates %s, %s" % (string, date1, date2))
-            return [date1, date2]
 
-        else:
-            LOG.warning("Could not create Date object (text: %s)" % string)
-    
+def make_dates_mdy4(string, month, year):
+    LOG.debug("Matched mdy4")
+    dt = make_datetime_my(month,year,'%m,%Y')
+    if dt:
+        date = Date(dt, False)
+        LOG.debug("Input was %s; matched mdy4; returning date %s", string, date)
+        return [date]
+    else:
+        LOG.warning("Could not create Date object (text: %s)" % string)
+
+
+def make_dates_mdy5(string, year, month):
+    LOG.debug("Matched mdy5")
+    if year in months:
+        dt = make_datetime_my(month,year,'%B,%Y')
+    else:
+        dt = make_datetime_my(month,year,'%b,%Y')
+    if dt:
+        date = Date(dt, False)
+        LOG.debug("Input was %s; matched mdy5; returning date %s", string, date)
+        return [date]
+    else:
+        LOG.warning("Could not create Date object (text: %s)" % string)
+
+
+def make_dates_mdy6(string, year, month, day):
+    LOG.debug("Matched mdy6")
+    dt = make_datetime_myd(month,year,day,'%m,%Y,%d')
+    if dt:
+        date = Date(dt)
+        LOG.debug("Input was %s; matched mdy6; returning date %s", string, date)
+        return [date]
+    else:
+        LOG.warning("Could not create Date object (text: %s)" % string)
+
+
+def make_dates_mdy7(string, year):
+    LOG.debug("Matched mdy7")
+    dt = make_datetime_y(year,'%Y')
+    if dt:
+        date = Date(dt, False, False)
+        LOG.debug("Input was %s; matched mdy7; returning date %s", string, date)
+        return [date]
+    else:
+        LOG.warning("Could not create Date object (text: %s)" % string)
+
+
+def make_dates_mdy8(string, month1, year1, month2, year2):
+    LOG.debug("Matched mdy8")
+
+    # If no year given for first month, use the second month's year
+    if not year1:
+        yr_group = year2
+    else:
+        yr_group = year1
+
+    yr_string='Y'
+    if len(yr_group)==2:
+        yr_string='y'
+
+    if month1 in months:
+        mo_string = 'B'
+    else:
+        mo_string = 'b'
+    dt1 = make_datetime_my(month1, yr_group, '%'+mo_string+',%'+yr_string)
+
+    if len(year2)==2:
+        yr_string='y'
+    else:
+        yr_string='Y'
+
+    if month2 in months:
+        mo_string = 'B'
+    else:
+        mo_string = 'b'
+    dt2 = make_datetime_my(month2, year2, '%'+mo_string+',%'+yr_string)
+
+    if dt1 and dt2:
+        date1 = Date(dt1, False)
+        date2 = Date(dt2, False)
+        LOG.debug("Input was %s; matched mdy8; returning dates %s, %s", string, date1, date2)
+        return [date1, date2]
+    else:
+        LOG.warning("Could not create Date object (text: %s)" % string)
+
+
+def make_dates_mdy9(string, year1, year2):
+    LOG.debug("Matched mdy9")
+
+    dt1 = make_datetime_y(year1,'%Y')
+    dt2 = make_datetime_y(year2,'%Y')
+
+    if dt1 and dt2:
+        date1 = Date(dt1, False, False)
+        date2 = Date(dt2, False, False)
+        LOG.debug("Input was %s; matched mdy9; returning dates %s, %s", string, date1, date2)
+        return [date1, date2]
+    else:
+        LOG.warning("Could not create Date object (text: %s)" % string)
+
+
+def make_dates_str10(string, month1, month2, year):
+    # Coordinated month and year combos are only parsed when they also match the stricter mdy8 pattern
+    mdy8_match = mdy8.match(string)
+    if mdy8_match:
+        return make_dates_mdy8(string, *mdy8_match.groups())
     else:
         LOG.warning("Could not create Date object (text: %s)" % string)
 
 
+# Anchored patterns tried by make_date(), in order, and the methods that build Date objects from their groups
+# NB: mdy3 and mdy6 capture the separator so that it can be required to be the same twice; it is dropped before the groups are passed on
+mdy1 = re.compile(r'^('+'|'.join(months.keys())+')[ ,]*(?:([\d]{1,2})(?:st|nd|rd|th)?)?[ ,\']+((?:(?:19)|(?:20)|\')[\d]{2})$')
+mdy2 = re.compile(r'^('+'|'.join(month_abrvs.keys())+')[ ,\.]*(?:([\d]{1,2})(?:st|nd|rd|th)?)?[ ,\']+((?:(?:19)|(?:20)|\')[\d]{2})$')
+mdy3 = re.compile('^([\d]{1,2})([/\-])([\d]{1,2})\\2((?:(?:19)|(?:20))?[\d]{2})$')
+mdy4 = re.compile('^([\d]{1,2})[/\-]((?:(?:19)|(?:20))[\d]{2})$')
+mdy5 = re.compile('^((?:(?:19)|(?:20))[\d]{2}) in ('+'|'.join(month_abrvs.keys())+'|'.join(months.keys())+')$')
+mdy6 = re.compile('^((?:(?:19)|(?:20))[\d]{2})([/\-])([\d]{1,2})\\2([\d]{1,2})$')
+mdy7=re.compile('^((?:(?:19)|(?:20))[\d]{2})$')
+mdy8 = re.compile('^('+'|'.join(month_abrvs.keys()+months.keys())+')(?:[ ,\.\']+((?:(?:19)|(?:20))?[\d]{2}))?,? +and +('+'|'.join(month_abrvs.keys()+months.keys())+')[ ,\.\']+((?:(?:19)|(?:20))?[\d]{2})$')
+mdy9 = re.compile('^((?:(?:19)|(?:20))[\d]{2}) +and +((?:(?:19)|(?:20))[\d]{2})$')
+
+mdy_parsers = [
+    (mdy1, make_dates_mdy1),
+    (mdy2, make_dates_mdy2),
+    (mdy3, lambda string, month, sep, day, year: make_dates_mdy3(string, month, day, year)),
+    (mdy4, make_dates_mdy4),
+    (mdy5, make_dates_mdy5),
+    (mdy6, lambda string, year, sep, month, day: make_dates_mdy6(string, year, month, day)),
+    (mdy7, make_dates_mdy7),
+    (mdy8, make_dates_mdy8),
+    (mdy9, make_dates_mdy9),
+]
+
+def index_date_regex_parsers(date_strs_and_parsers):
+    '''
+    This method takes as input a list of (pattern string, Date-building method) 2-tuples, in the order in which the pattern strings were joined to make date_regex, and returns a dictionary mapping the index of the last group of each alternative to a (index of its first group, Date-building method) 2-tuple.
+    '''
+    to_return = {}
+    first_group = 1
+    for date_str, make_dates in date_strs_and_parsers:
+        last_group = first_group + re.compile(date_str).groups - 1
+        to_return[last_group] = (first_group, make_dates)
+        first_group = last_group + 1
+    return to_return
+
+
+# Whichever alternative of date_regex matches a string, make_date() would have used the corresponding method on the same groups
+date_regex_parsers = index_date_regex_parsers([
+    (str1, make_dates_mdy1),
+    (str2, make_dates_mdy2),
+    (str3, make_dates_mdy3),
+    (str4, make_dates_mdy3),
+    (str5, make_dates_mdy4),
+    (str6, make_dates_mdy5),
+    (str7, make_dates_mdy6),
+    (str8, make_dates_mdy6),
+    (str9, make_dates_mdy7),
+    (str10, make_dates_str10),
+    (str11, make_dates_mdy9)])
+
+
 
 # Helper methods for converting strings to datetime objects
 # NB: Unknown days or months will default to '1'
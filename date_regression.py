@@ -0,0 +1,133 @@
+#!/usr/bin/python
+
+'''
+This script checks the date expression parser in date.py against stored expected outputs, so that changes to how Dates are made (e.g., the date expression cache, or building Dates from date_regex's match groups) can be shown not to change any of them.
+
+It makes a fixed set of text blobs (synthetic notes from synthetic_data.py with fixed seeds, and hand-written edge cases such as impossible days, 2-digit years and coordinated dates) and prints a line for each of the following, in the format kind[tab]key[tab]result:
+1) each (Date, start_index, end_index) 3-tuple extract_dates_and_char_indices() returns for each blob, and
+2) what make_date() returns for each distinct date expression found in the blobs, each gold date expression, and each edge case.
+
+By default the lines are made three times (with the date expression cache empty, full, and off) and compared with the expected output file; the differences are printed, and the script exits with status 1 if there are any. With --write, the expected output file is written instead.
+
+Command line usage: ./date_regression.py [--write] [<expected-output-file>]
+'''
+
+import argparse
+import logging
+import os
+import sys
+from date import *
+from synthetic_data import generate_patients
+
+LOG = logging.getLogger(__name__)
+LOG.setLevel(logging.WARNING)
+
+
+def main():
+    logging.basicConfig()
+
+    parser = argparse.ArgumentParser(description="Check date.py's date expression parsing against stored expected outputs.")
+    parser.add_argument('expected_filename', nargs='?', default=DEFAULT_EXPECTED_FILENAME, help="expected output file (default: %s)" % DEFAULT_EXPECTED_FILENAME)
+    parser.add_argument('--write', action='store_true', help="write the expected output file from the current date.py instead of checking against it")
+    parser.add_argument('--max-differences', type=int, default=20, metavar='N', help="largest number of differences to print (default: 20)")
+    args = parser.parse_args()
+
+    if args.write:
+        lines = get_regression_lines()
+        expected_file = open(args.expected_filename, 'w')
+        for line in lines:
+            expected_file.write(line + '\n')
+        expected_file.close()
+        LOG.warning("Wrote %s lines to %s" % (len(lines), args.expected_filename))
+        return
+
+    expected_file = open(args.expected_filename)
+    expected_lines = [line.rstrip('\r\n') for line in expected_file]
+    expected_file.close()
+
+    num_differences = 0
+    # The cache is checked empty, full, and off, since each takes a different path through make_date()
+    for cache_state in ('empty cache', 'full cache', 'no cache'):
+        if cache_state == 'empty cache':
+            set_date_cache_size(DEFAULT_DATE_CACHE_SIZE)
+        elif cache_state == 'no cache':
+            set_date_cache_size(0)
+        differences = get_differences(expected_lines, get_regression_lines())
+        for difference in differences[:args.max_differences]:
+            sys.stdout.write("%s: %s\n" % (cache_state, difference))
+        num_differences += len(differences)
+    set_date_cache_size(DEFAULT_DATE_CACHE_SIZE)
+
+    if num_differences:
+        sys.stdout.write("%s differences from %s\n" % (num_differences, args.expected_filename))
+        sys.exit(1)
+    sys.stdout.write("%s lines match %s\n" % (len(expected_lines), args.expected_filename))
+
+
+def get_regression_blobs():
+    '''
+    This method returns a list of (blob ID, text blob) 2-tuples for the synthetic notes (see REGRESSION_SEEDS) and the edge cases (see EDGE_CASES), and a list of the synthetic patients' gold date expressions.
+    '''
+    blobs = []
+    gold_date_expressions = []
+    for seed in REGRESSION_SEEDS:
+        for MRN, gold_date_expression, notes in generate_patients(REGRESSION_PATIENTS, notes_per_patient=3, tokens_per_note=100, date_density=0.05, seed=seed):
+            gold_date_expressions.append(gold_date_expression)
+            for i, (note_date, description, blob) in enumerate(notes):
+                blobs.append(('seed%s-%s-%s' % (seed, MRN, i), blob))
+    for i, blob in enumerate(EDGE_CASES):
+        blobs.append(('edge%s' % i, blob))
+    return blobs, gold_date_expressions
+
+
+def get_regression_lines():
+    '''
+    This method returns the list of output lines (kind[tab]key[tab]result) that date.py currently gives for the regression blobs (see get_regression_blobs()).
+    '''
+    blobs, gold_date_expressions = get_regression_blobs()
+
+    lines = []
+    expressions = []
+    for blob_id, blob in blobs:
+        for date_val, date_start, date_end in extract_dates_and_char_indices(blob):
+            expression = blob[date_start:date_end]
+            expressions.append(expression)
+            lines.append('extract\t%s:%s-%s\t%s %r' % (blob_id, date_start, date_end, expression, date_val))
+
+    for expression in sorted(set(expressions + gold_date_expressions + EDGE_CASES)):
+        lines.append('make_date\t%s\t%r' % (expression, make_date(expression)))
+
+    return lines
+
+
+def get_differences(expected_lines, lines):
+    '''
+    This method takes as input the list of expected output lines and the list of current output lines, and returns a list of strings describing where they differ (empty if they are the same).
+    '''
+    differences = []
+    for i in xrange(max(len(expected_lines), len(lines))):
+        expected_line = expected_lines[i] if i < len(expected_lines) else '(no line)'
+        line = lines[i] if i < len(lines) else '(no line)'
+        if line != expected_line:
+            differences.append("line %s: expected %r, got %r" % (i + 1, expected_line, line))
+    return differences
+
+
+# Globals: Regression Data
+DEFAULT_EXPECTED_FILENAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'date_regression.tsv')
+
+REGRESSION_SEEDS = (0, 1, 2)
+REGRESSION_PATIENTS = 20
+
+# Date expressions (and text around them) that synthetic_data.py doesn't make
+EDGE_CASES = [
+    'Feb 29, 1900', 'Feb 29, 2000', 'Feb. 30 2012', 'Sep 31, 2019', 'April 31st, 2001', '2/30/2011', '13/1/2011', '0/12/2011', '2011-13-01', '2011/2/30',
+    "March '99", "Mar. 3rd '05", 'Jan 1, 00', '1/2/03', '01-02-03', '12/1999', '0-2011', '2008 in May', '1999 in Sept',
+    'Jan and Feb 2010', 'January, and March, 2009', 'Jan 2009 and Mar 2010', 'Dec. and Jan. 11', '2001 and 2002', '2001  and  2003',
+    'seen 1/2/2003-4 and 2004-1-2/5', 'on 3/4/2011, 5/6/2012 and 2013', 'Jun 12 2010Jul 1 2011', 'x2010y', '19999', '1899 2100 1900 2099',
+    'Sept 2, 2010', 'sept 2, 2010', 'MAY 5 2010', 'June, 2010 and July 2011',
+]
+
+
+if __name__=='__main__':
+    main()
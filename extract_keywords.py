@@ -21,177 +21,1869 @@ Alternatively, the module can be imported and the get_keyword_queue() method can
 2) a dictionary of MRNs mapped to lists of Date objects (corresponding to the gold dates for the event in question for that patient).
 
 It then returns a priority queue of (keyword, position) tuples and their corresponding scores.
+
+The get_keyword_list() method takes the same input and (optionally) a number of top-scored keywords to return, and returns a list of (keyword, position, score) tuples in descending order by score.
 '''
 
-import logging
-from sys import argv
-from sys import exit
-from collections import defaultdict
-import Queue
-from date import *
+import argparse
+import bz2
+import cPickle
+import gzip
+import hashlib
+import heapq
+import json
+import logging
+import math
+import mmap
+import multiprocessing
+import os
+import random
+import struct
+import threading
+import time
+from sys import exc_info
+from sys import exit
+from sys import stdout
+from array import array
+from collections import deque
+from itertools import groupby
+from itertools import izip
+from operator import itemgetter
+import Queue
+from date import *
+
+# NumPy is optional; if it is installed, it is used to compute inverse distances for long notes
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+LOG = logging.getLogger(__name__)
+LOG.setLevel(logging.WARNING)
+
+
+def main():
+    logging.basicConfig()
+
+    parser = argparse.ArgumentParser(description="Print keywords that tend to appear close to gold dates, in descending order by score.")
+    parser.add_argument('notes_filename', help="notes file (MRN[tab]date[tab]description[tab]text blob)")
+    parser.add_argument('data_filename', help="gold data file (MRN[tab]gold_date_1[tab]gold_date_2 ...)")
+    parser.add_argument('--stream', action='store_true', help="score the notes one patient at a time as they are read, rather than reading the whole notes file into memory first")
+    parser.add_argument('--top', type=int, metavar='K', help="print only the K highest-scored keywords")
+    parser.add_argument('--model', metavar='FILE', help="update the keyword model saved in FILE (or create it) with the patients in the input files, rather than scoring all of them, and save it again")
+    parser.add_argument('--index', action='store_true', help="read only the notes of the patients in the gold data file, through a memory map of the notes file and an index of each patient's lines in it (NOTES_FILE%s, built the first time and rebuilt when the notes file changes)" % NOTES_INDEX_SUFFIX)
+    parser.add_argument('--cache', action='store_true', help="read the notes tokenized, with their dates found and parsed, from a cache of the notes file (NOTES_FILE%s, built the first time and rebuilt when the notes file changes), so that only matching the dates with the gold dates is done again" % NOTES_CACHE_SUFFIX)
+    parser.add_argument('--remove-missing', action='store_true', help="with --model, also remove the patients in the model that aren't in the gold data file")
+    parser.add_argument('--workers', type=int, default=1, help="number of processes to score patients in (default: 1)")
+    parser.add_argument('--distance-backend', choices=DISTANCE_BACKENDS, help="how to compute distances to dates (default: 'numpy' if NumPy is installed, else 'python')")
+    parser.add_argument('--ngrams', type=int, default=1, metavar='N', help="score keywords of 1 to N words (at most %s; default: 1)" % MAX_NGRAM_LENGTH)
+    parser.add_argument('--ngram-min-count', type=int, default=0, metavar='C', help="bound the memory n-grams take by only scoring n-grams of more than one word from (about) their C-th occurrence on (default: 0, i.e. score all of them exactly)")
+    parser.add_argument('--ngram-sketch-width', type=int, metavar='W', help="number of counters in each of the %s rows of the sketch that counts n-grams for --ngram-min-count (default: %s)" % (NgramSketch.DEPTH, ngram_sketch_width))
+    parser.add_argument('--window', type=int, metavar='W', help="only score keywords at most W tokens away from the closest date in each position, visiting only the tokens that close to a date (default: score every token)")
+    parser.add_argument('--normalize-word-freq', action='store_true', help="normalize the scores for keyword frequency")
+    parser.add_argument('--normalize-date-freq', action='store_true', help="normalize the scores for true vs. false date frequency")
+    parser.add_argument('--variants', metavar='V1,V2,...', help="rank the keywords by each of several scoring variants (%s, or 'all'), from the same scores, and print each ranking with the variant's name in front of each line" % ', '.join(SCORING_VARIANTS))
+    parser.add_argument('--folds', type=int, metavar='K', help="cross-validate: split the patients in the gold data file into K folds, and print the ranking trained on all the other folds for each fold, with the fold's number in front of each line")
+    parser.add_argument('--fold-seed', type=int, default=0, metavar='S', help="random seed for splitting the patients into folds (default: 0)")
+    parser.add_argument('--fold-assignments', metavar='FILE', help="with --folds, write the fold of each patient to FILE (MRN[tab]fold)")
+    parser.add_argument('--stats', metavar='FILE', help="write counts and timings for each stage of keyword extraction to FILE, as JSON")
+    args = parser.parse_args()
+
+    if args.top is not None and args.top < 0:
+        parser.error("--top can't be negative")
+    if args.model and args.stream:
+        parser.error("--model reads all of each patient's notes at once, so it can't be used with --stream")
+    if args.index and args.stream:
+        parser.error("--index reads each patient's notes from wherever they are in the notes file, so it can't be used with --stream")
+    if args.index and is_compressed(args.notes_filename):
+        parser.error("--index reads the notes file through a memory map, so it can't be used with a compressed notes file")
+    if args.cache and (args.model or args.index or args.stream):
+        parser.error("--cache reads the tokenized notes rather than the notes file, so it can't be used with --model, --index or --stream")
+    if args.folds is not None:
+        if args.model:
+            parser.error("--folds keeps the scores of each fold rather than of all the patients, so it can't be used with --model")
+        if args.folds < 2:
+            parser.error("--folds must be at least 2")
+        if args.ngrams > 1 and args.ngram_min_count > 1:
+            parser.error("--folds gives exactly the rankings of the other folds' patients, which n-grams counted approximately (--ngram-min-count) can't, so they can't be used together")
+    elif args.fold_assignments:
+        parser.error("--fold-assignments can only be used with --folds")
+
+    if args.distance_backend:
+        set_distance_backend(args.distance_backend)
+
+    variants = None
+    if args.variants:
+        if args.normalize_word_freq or args.normalize_date_freq:
+            parser.error("--variants chooses the normalizations of each ranking itself, so it can't be used with --normalize-word-freq or --normalize-date-freq")
+        try:
+            variants = parse_scoring_variants(args.variants)
+        except ValueError as e:
+            parser.error(str(e))
+
+    try:
+        set_max_ngram_length(args.ngrams)
+        set_ngram_min_count(args.ngram_min_count, args.ngram_sketch_width)
+        set_distance_window(args.window)
+    except ValueError as e:
+        parser.error(str(e))
+
+    data_file = open_input(args.data_filename)
+    data_dict = read_gold_dates(data_file)
+    data_file.close()
+
+    notes_file = open_input(args.notes_filename)
+
+    stats = PipelineStats() if args.stats else None
+
+    LOG.info("Getting keyword list")
+    add_distances = add_ngram_distances
+    if args.cache:
+        patients = ((MRN, notes, data_dict[MRN]) for MRN, notes in read_notes_cache(get_notes_cache(args.notes_filename, stats), data_dict))
+        add_distances = add_tokenized_ngram_distances
+    elif args.stream:
+        patients = ((MRN, blobs, data_dict[MRN]) for MRN, blobs in read_notes_by_MRN(notes_file, True) if MRN in data_dict)
+    else:
+        if args.index:
+            notes_dict = MappedNotes(args.notes_filename, get_notes_index(args.notes_filename))
+        else:
+            notes_dict = {}
+            for MRN, note in read_notes_in_background(notes_file):
+                if not notes_dict.get(MRN):
+                    notes_dict[MRN] = []
+                notes_dict[MRN].append(note)
+        if args.model:
+            try:
+                if os.path.exists(args.model):
+                    model = load_keyword_model(args.model)
+                else:
+                    model = KeywordModel()
+                num_updated, num_removed = model.update(notes_dict, data_dict, args.workers, args.remove_missing, stats)
+            except ValueError as e:
+                parser.error(str(e))
+            LOG.info("Added or updated %s patients and removed %s patients; the model now has %s patients" % (num_updated, num_removed, len(model)))
+            model.save(args.model)
+            accumulator = model.accumulator
+        else:
+            patients = ((MRN, notes_dict.get(MRN, []), data_dict[MRN]) for MRN in data_dict)
+
+    if args.folds is not None:
+        folds = assign_folds(data_dict, args.folds, args.fold_seed)
+        fold_accumulators = get_fold_accumulators(((folds[MRN], blobs, gold_dates) for MRN, blobs, gold_dates in patients), args.folds, args.workers, stats, add_distances)
+    elif not args.model:
+        accumulator = get_ngram_accumulator(((blobs, gold_dates) for MRN, blobs, gold_dates in patients), args.workers, stats, add_distances)
+
+    if args.index:
+        notes_dict.close()
+    notes_file.close()
+
+    if args.folds is not None:
+        for fold, accumulator in enumerate(get_training_accumulators(fold_accumulators)):
+            if variants is None:
+                keywords = rank_keywords(accumulator, args.top, args.normalize_word_freq, args.normalize_date_freq, stats)
+                stdout.writelines(str(fold)+'\t'+keyword+'\t'+position+'\t'+str(score)+'\n' for keyword, position, score in keywords)
+            else:
+                keyword_lists = rank_keyword_variants(accumulator, variants, args.top, stats)
+                for variant in variants:
+                    stdout.writelines(str(fold)+'\t'+variant+'\t'+keyword+'\t'+position+'\t'+str(score)+'\n' for keyword, position, score in keyword_lists[variant])
+        if args.fold_assignments:
+            assignments_file = open(args.fold_assignments, 'w')
+            assignments_file.writelines(MRN+'\t'+str(folds[MRN])+'\n' for MRN in sorted(folds))
+            assignments_file.close()
+
+    elif variants is None:
+        keywords = rank_keywords(accumulator, args.top, args.normalize_word_freq, args.normalize_date_freq, stats)
+        stdout.writelines(keyword+'\t'+position+'\t'+str(score)+'\n' for keyword, position, score in keywords)
+    else:
+        keyword_lists = rank_keyword_variants(accumulator, variants, args.top, stats)
+        for variant in variants:
+            stdout.writelines(variant+'\t'+keyword+'\t'+position+'\t'+str(score)+'\n' for keyword, position, score in keyword_lists[variant])
+
+    if stats is not None:
+        stats_file = open(args.stats, 'w')
+        json.dump(stats.get_report(), stats_file, indent=2, sort_keys=True)
+        stats_file.write('\n')
+        stats_file.close()
+
+
+
+def read_notes(notes_file):
+    '''
+    This method takes as input an open notes file, where each line corresponds with a note and takes the format MRN[tab]date[tab]description[tab]text blob, and yields an (MRN, text blob) 2-tuple for each note, in the order in which they appear in the file.
+    '''
+    for line in notes_file:
+        MRN_note = parse_note_line(line)
+        if MRN_note is not None:
+            yield MRN_note
+
+
+def parse_note_line(line):
+    '''
+    This method takes as input a line of the notes file and returns an (MRN, text blob) 2-tuple, or None (with a warning) if the line isn't in the format MRN[tab]date[tab]description[tab]text blob.
+    '''
+    line = line.strip()
+    tokens = line.split('\t')
+    if len(tokens) not in [3, 4]:
+        LOG.warning("Unexpected line format (should be MRN[tab]date[tab]description[tab]note); skipping line: %s" % line)
+        return None
+
+    MRN = tokens[0]
+
+    if len(tokens) == 3:
+        note = ''
+    else:
+        note = tokens[3]
+
+    return (MRN, note)
+
+
+def read_notes_by_MRN(notes_file, in_background=False):
+    '''
+    This method takes as input an open notes file (see read_notes()) and (optionally) whether to read it in a background thread (see read_notes_in_background()), and yields an (MRN, list of text blobs) 2-tuple for each run of consecutive lines with the same MRN, reading only one run into memory at a time.
+    NB: If the file is sorted (or at least grouped) by MRN, each patient's notes are yielded together. Otherwise a patient's notes may be split over several runs; since notes are scored independently, get_keyword_queue_from_stream() returns the same scores either way.
+    '''
+    if in_background:
+        records = read_notes_in_background(notes_file)
+    else:
+        records = read_notes(notes_file)
+
+    for MRN, notes in groupby(records, key=itemgetter(0)):
+        yield (MRN, [note for MRN, note in notes])
+
+
+def read_notes_in_background(notes_file):
+    '''
+    This method takes as input an open notes file and yields the same (MRN, text blob) 2-tuples as read_notes(), but reads (and, for a compressed file, decompresses) and splits the lines of the file in a background thread, so that reading overlaps with scoring the notes already read.
+    The notes are passed from the thread in chunks of READER_CHUNK_SIZE notes through a queue of at most READER_QUEUE_SIZE chunks, so the thread never gets more than that far ahead of the scoring, however large the file is.
+    '''
+    return iterate_in_background(read_notes(notes_file), READER_QUEUE_SIZE, READER_CHUNK_SIZE)
+
+
+def iterate_in_background(iterable, queue_size, chunk_size):
+    '''
+    This method takes as input an iterable, the largest number of chunks to hold in the queue, and the number of items in each chunk, and yields the items of the iterable, which are produced in a background thread and passed through a bounded queue. An exception raised by the iterable is raised again here.
+    NB: If the caller stops early, the thread is stopped the next time it has a chunk ready.
+    '''
+    queue = Queue.Queue(queue_size)
+    stopped = threading.Event()
+
+    def produce():
+        try:
+            chunk = []
+            for item in iterable:
+                chunk.append(item)
+                if len(chunk) == chunk_size:
+                    # Blocks while the queue is full
+                    queue.put(chunk)
+                    if stopped.is_set():
+                        return
+                    chunk = []
+            if chunk:
+                queue.put(chunk)
+            queue.put(None)
+        except BaseException:
+            queue.put(exc_info())
+
+    thread = threading.Thread(target=produce)
+    thread.daemon = True
+    thread.start()
+
+    try:
+        while True:
+            chunk = queue.get()
+            if chunk is None:
+                break
+            if isinstance(chunk, tuple):
+                raise chunk[0], chunk[1], chunk[2]
+            for item in chunk:
+                yield item
+    finally:
+        # Make room in the queue until the thread sees that it should stop
+        stopped.set()
+        while thread.is_alive():
+            try:
+                queue.get_nowait()
+            except Queue.Empty:
+                thread.join(0.01)
+
+
+def is_compressed(filename):
+    '''
+    This method takes as input a path and returns whether it is that of a gzip (.gz) or bzip2 (.bz2) file.
+    '''
+    return filename.endswith('.gz') or filename.endswith('.bz2')
+
+
+def open_input(filename):
+    '''
+    This method takes as input the path of a notes file or gold data file and returns it opened for reading, decompressing it as it is read if it is a gzip (.gz) or bzip2 (.bz2) file.
+    '''
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rb')
+    if filename.endswith('.bz2'):
+        return bz2.BZ2File(filename, 'rb')
+    return open(filename)
+
+
+# Globals: Background reading
+READER_QUEUE_SIZE = 16
+READER_CHUNK_SIZE = 256
+
+
+class NotesIndex(object):
+    '''
+    A NotesIndex object records where each patient's lines are in a notes file, so that the notes of a few patients can be read without reading the whole file (see MappedNotes).
+    spans maps each MRN to a list of (start, end) byte offsets of the runs of consecutive lines for that MRN, in the order in which they appear in the file; size and mtime are those of the notes file when it was indexed.
+    '''
+    def __init__(self, size, mtime):
+        self.size = size
+        self.mtime = mtime
+        self.spans = {}
+
+
+    def __len__(self):
+        return len(self.spans)
+
+
+    def is_current(self, notes_filename):
+        '''
+        This method takes as input the path of the notes file this index was built from, and returns whether the file is unchanged since (i.e., has the same size and modification time).
+        '''
+        stat = os.stat(notes_filename)
+        return stat.st_size == self.size and stat.st_mtime == self.mtime
+
+
+    def save(self, filename):
+        '''
+        This method takes as input a path and saves the index there (see load_notes_index()).
+        NB: The index is saved as a dictionary of built-in types rather than as a NotesIndex, so that it can be loaded whether this module was run as a script (as __main__) or imported.
+        '''
+        state = {'format': NOTES_INDEX_FORMAT, 'version': NOTES_INDEX_VERSION, 'size': self.size, 'mtime': self.mtime, 'spans': self.spans}
+        index_file = open(filename, 'wb')
+        try:
+            cPickle.dump(state, index_file, cPickle.HIGHEST_PROTOCOL)
+        finally:
+            index_file.close()
+
+
+def build_notes_index(notes_filename):
+    '''
+    This method takes as input the path of a notes file (see read_notes()), reads it once, and returns a NotesIndex of the byte offsets of each patient's lines in it. Lines that aren't in the notes file format are skipped (with a warning), as read_notes() skips them.
+    '''
+    if is_compressed(notes_filename):
+        raise ValueError("A compressed notes file can't be indexed: %s" % notes_filename)
+
+    stat = os.stat(notes_filename)
+    index = NotesIndex(stat.st_size, stat.st_mtime)
+
+    notes_file = open(notes_filename, 'rb')
+    try:
+        offset = 0
+        span_MRN = None
+        span_start = 0
+        for line in notes_file:
+            MRN_note = parse_note_line(line)
+            MRN = MRN_note[0] if MRN_note is not None else None
+
+            # Consecutive lines for the same MRN make up one span
+            if MRN != span_MRN:
+                if span_MRN is not None:
+                    index.spans.setdefault(span_MRN, []).append((span_start, offset))
+                span_MRN = MRN
+                span_start = offset
+
+            offset += len(line)
+
+        if span_MRN is not None:
+            index.spans.setdefault(span_MRN, []).append((span_start, offset))
+    finally:
+        notes_file.close()
+
+    return index
+
+
+def load_notes_index(filename):
+    '''
+    This method takes as input the path of an index saved by NotesIndex.save() and returns the NotesIndex. It raises a ValueError if the file isn't a notes index of the current version.
+    '''
+    state = load_saved_state(filename, NOTES_INDEX_FORMAT, NOTES_INDEX_VERSION)
+    index = NotesIndex(state['size'], state['mtime'])
+    index.spans = state['spans']
+    return index
+
+
+def load_saved_state(filename, file_format, version):
+    '''
+    This method takes as input the path of a file saved as a pickled dictionary of built-in types (see NotesIndex.save() and KeywordModel.save()), the format name that the dictionary's 'format' must be, and the version that its 'version' must be, and returns the dictionary. It raises a ValueError if the file can't be read as such a dictionary, or is of another format or version.
+    NB: Only dictionaries of built-in types are loaded, so files pickled as instances of this module's classes (by older versions) are rejected rather than depending on where the classes are found.
+    '''
+    saved_file = open(filename, 'rb')
+    try:
+        unpickler = cPickle.Unpickler(saved_file)
+        unpickler.find_global = find_saved_state_global
+        state = unpickler.load()
+    except (cPickle.UnpicklingError, EOFError, ImportError, AttributeError, IndexError, KeyError, TypeError, ValueError) as e:
+        raise ValueError("Not a %s: %s (%s)" % (file_format, filename, e))
+    finally:
+        saved_file.close()
+
+    if not isinstance(state, dict) or state.get('format') != file_format:
+        raise ValueError("Not a %s: %s" % (file_format, filename))
+    if state.get('version') != version:
+        raise ValueError("The %s %s is of version %s, not %s; build it again" % (file_format, filename, state.get('version'), version))
+    return state
+
+
+def find_saved_state_global(module_name, name):
+    '''
+    This method is the find_global of the unpickler of load_saved_state(): it only allows the classes that saved states are made of (arrays of counts), so that no other class (e.g. one of this module's, as __main__) is ever looked up.
+    '''
+    if (module_name, name) == ('array', 'array'):
+        return array
+    raise cPickle.UnpicklingError("Unexpected class in saved state: %s.%s" % (module_name, name))
+
+
+def get_notes_index(notes_filename):
+    '''
+    This method takes as input the path of a notes file and returns its NotesIndex: the one saved next to it (in notes_filename + NOTES_INDEX_SUFFIX), if the notes file hasn't changed since, or else a new one, which is saved there.
+    '''
+    index_filename = notes_filename + NOTES_INDEX_SUFFIX
+    if os.path.exists(index_filename):
+        try:
+            index = load_notes_index(index_filename)
+        except ValueError as e:
+            LOG.warning("%s; indexing %s again" % (e, notes_filename))
+        else:
+            if index.is_current(notes_filename):
+                return index
+            LOG.info("Notes file %s has changed since it was indexed; indexing it again" % notes_filename)
+
+    index = build_notes_index(notes_filename)
+    index.save(index_filename)
+    return index
+
+
+# Globals: Notes index
+# NB: NOTES_INDEX_VERSION must be changed whenever what NotesIndex.save() saves changes
+NOTES_INDEX_SUFFIX = '.idx'
+NOTES_INDEX_FORMAT = 'notes index'
+NOTES_INDEX_VERSION = 1
+
+
+class MappedNotes(object):
+    '''
+    A MappedNotes object maps MRNs to lists of text blobs, as the dictionaries get_keyword_list() and get_keyword_queue() take, but reads each patient's notes from a memory map of the notes file only when they are asked for (see NotesIndex). Only the pages of the file that hold the notes of the patients asked for are then read, so scoring a few patients takes time proportional to their notes rather than to the whole file.
+    '''
+    def __init__(self, notes_filename, index):
+        self.index = index
+        notes_file = open(notes_filename, 'rb')
+        try:
+            # NB: An empty file can't be memory-mapped
+            if index.size > 0:
+                self.map = mmap.mmap(notes_file.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self.map = ''
+        finally:
+            notes_file.close()
+
+
+    def __len__(self):
+        return len(self.index.spans)
+
+
+    def __contains__(self, MRN):
+        return MRN in self.index.spans
+
+
+    def __iter__(self):
+        return iter(self.index.spans)
+
+
+    def __getitem__(self, MRN):
+        blobs = self.get(MRN)
+        if blobs is None:
+            raise KeyError(MRN)
+        return blobs
+
+
+    def get(self, MRN, default=None):
+        '''
+        This method takes as input an MRN and (optionally) a default value, and returns a list of the text blobs of that patient's notes, in the order in which they appear in the notes file (or the default value if the patient has no notes).
+        '''
+        spans = self.index.spans.get(MRN)
+        if spans is None:
+            return default
+
+        blobs = []
+        for start, end in spans:
+            lines = self.map[start:end].split('\n')
+            # The last line of a span ends with a newline, unless it is the last line of the file
+            if not lines[-1]:
+                lines.pop()
+            blobs.extend(parse_note_line(line)[1] for line in lines)
+        return blobs
+
+
+    def close(self):
+        '''
+        This method closes the memory map of the notes file.
+        '''
+        if self.map:
+            self.map.close()
+
+
+def build_notes_cache(notes_filename, cache_filename, stats=None):
+    '''
+    This method takes as input the path of a notes file (see read_notes()), the path to write its cache to, and (optionally) a PipelineStats object to count and time finding the date expressions and tokenizing in. It tokenizes every note in the notes file and finds and parses its date expressions (see tokenize_with_dates()) once, and writes the results to the cache, so that later runs only need to match the dates with the gold dates (see read_notes_cache()).
+    The cache starts with a header (NOTES_CACHE_MAGIC, NOTES_CACHE_VERSION, and the size and modification time of the notes file), followed by a record for each run of consecutive lines with the same MRN: the length of the MRN, the MRN, the length of the notes, and the pickled list of (tokens, date token indices, Date objects) 3-tuples of the notes.
+    NB: Tokens are interned, so that each distinct token is pickled only once per record. The cache is written to a temporary file first, so that an interrupted build never leaves a partial cache behind.
+    '''
+    stat = os.stat(notes_filename)
+    temp_filename = cache_filename + '.tmp'
+
+    notes_file = open_input(notes_filename)
+    cache_file = open(temp_filename, 'wb')
+    try:
+        cache_file.write(NOTES_CACHE_HEADER.pack(NOTES_CACHE_MAGIC, NOTES_CACHE_VERSION, stat.st_size, stat.st_mtime))
+        for MRN, blobs in read_notes_by_MRN(notes_file, True):
+            notes = []
+            for blob in blobs:
+                tokens, date_indices, dates = tokenize_with_dates(blob, stats)
+                notes.append(([intern(token) if token is not None else None for token in tokens], date_indices, dates))
+            pickled_notes = cPickle.dumps(notes, cPickle.HIGHEST_PROTOCOL)
+            cache_file.write(NOTES_CACHE_LENGTH.pack(len(MRN)) + MRN + NOTES_CACHE_LENGTH.pack(len(pickled_notes)))
+            cache_file.write(pickled_notes)
+    finally:
+        notes_file.close()
+        cache_file.close()
+
+    os.rename(temp_filename, cache_filename)
+
+
+def is_notes_cache_current(cache_filename, notes_filename):
+    '''
+    This method takes as input the path of a notes cache and the path of the notes file it was built from, and returns whether the cache is in the current format and the notes file is unchanged since (i.e., has the same size and modification time).
+    '''
+    cache_file = open(cache_filename, 'rb')
+    try:
+        header = cache_file.read(NOTES_CACHE_HEADER.size)
+    finally:
+        cache_file.close()
+    if len(header) != NOTES_CACHE_HEADER.size:
+        return False
+
+    magic, version, size, mtime = NOTES_CACHE_HEADER.unpack(header)
+    stat = os.stat(notes_filename)
+    return magic == NOTES_CACHE_MAGIC and version == NOTES_CACHE_VERSION and size == stat.st_size and mtime == stat.st_mtime
+
+
+def read_notes_cache(cache_filename, MRNs=None):
+    '''
+    This method takes as input the path of a notes cache (see build_notes_cache()) and (optionally) a container of MRNs, and yields an (MRN, list of (tokens, date token indices, Date objects) 3-tuples) 2-tuple for each record in the cache (only for the MRNs in the container, if one is given). The records of other MRNs are skipped without unpickling them.
+    '''
+    cache_file = open(cache_filename, 'rb')
+    try:
+        cache_file.seek(NOTES_CACHE_HEADER.size)
+        while True:
+            length = cache_file.read(NOTES_CACHE_LENGTH.size)
+            if not length:
+                break
+            MRN = cache_file.read(NOTES_CACHE_LENGTH.unpack(length)[0])
+            notes_length = NOTES_CACHE_LENGTH.unpack(cache_file.read(NOTES_CACHE_LENGTH.size))[0]
+            if MRNs is None or MRN in MRNs:
+                yield (MRN, cPickle.loads(cache_file.read(notes_length)))
+            else:
+                cache_file.seek(notes_length, os.SEEK_CUR)
+    finally:
+        cache_file.close()
+
+
+def get_notes_cache(notes_filename, stats=None):
+    '''
+    This method takes as input the path of a notes file and (optionally) a PipelineStats object (see build_notes_cache()), and returns the path of its cache (notes_filename + NOTES_CACHE_SUFFIX), building the cache first if it doesn't exist yet or is out of date.
+    '''
+    cache_filename = notes_filename + NOTES_CACHE_SUFFIX
+    if os.path.exists(cache_filename):
+        if is_notes_cache_current(cache_filename, notes_filename):
+            return cache_filename
+        LOG.info("Notes file %s has changed since it was cached; caching it again" % notes_filename)
+
+    build_notes_cache(notes_filename, cache_filename, stats)
+    return cache_filename
+
+
+# Globals: Notes cache
+# NB: NOTES_CACHE_VERSION must be changed whenever the format of the cache, or the way notes are tokenized or dates are found or parsed, changes
+NOTES_CACHE_SUFFIX = '.cache'
+NOTES_CACHE_MAGIC = 'KWNOTES\x00'
+NOTES_CACHE_VERSION = 2
+NOTES_CACHE_HEADER = struct.Struct('<8sIQd')
+NOTES_CACHE_LENGTH = struct.Struct('<I')
+
+
+def read_gold_dates(data_file):
+    '''
+    This method takes as input an open gold data file, where each line corresponds with a patient and takes the format MRN[tab]gold_date_1[tab]gold_date_2 ..., and returns a dictionary of MRNs mapped to lists of Date objects.
+    '''
+    data_dict = {}
+    for line in data_file:
+        line = line.strip()
+        tokens = line.split('\t')
+        if len(tokens) < 2:
+            LOG.warning("Unexpected line format (should be MRN[tab]date ... ); skipping line: %s" % line)
+        else:
+            MRN = tokens[0]
+            for i in xrange(1, len(tokens)):
+#               LOG.debug("Trying to make date from: %s" % tokens[i])
+                date_vals = make_date(tokens[i])
+                if not date_vals:
+                    LOG.warning("Could not interpret date expression; skipping line: %s" % line)
+                else:
+                    if data_dict.get(MRN) == None:
+                        data_dict[MRN] = []
+                    data_dict[MRN].extend(date_vals)
+
+    return data_dict
+
+
+    
+def get_keyword_list(blobs_dict, gold_dates_dict, top=None, workers=1, normalize_word_freq=False, normalize_date_freq=False, stats=None):
+    '''
+    This method takes as input:
+    (1) a dictionary of MRNs mapped to lists of text blobs (corresponding to clinic notes for that patient),
+    (2) a dictionary of MRNs mapped to lists of Date objects (corresponding to the gold dates for the event in question for that patient),
+    (3) (optionally) the number of top-scored keywords to return (all of them if None),
+    (4) (optionally) the number of processes to score patients in,
+    (5) (optionally) whether to normalize the scores for keyword frequency and for true vs. false date frequency (see get_score()), and
+    (6) (optionally) a PipelineStats object to add counts and timings for each stage to (none are collected if None).
+    It then returns a list of (keyword, position, score) 3-tuples in descending order by score (see rank_keywords()).
+    '''
+    patients = ((blobs_dict.get(MRN, []), gold_dates_dict[MRN]) for MRN in gold_dates_dict)
+    accumulator = get_ngram_accumulator(patients, workers, stats)
+
+    return rank_keywords(accumulator, top, normalize_word_freq, normalize_date_freq, stats)
+
+
+def get_keyword_lists(blobs_dict, gold_dates_dict, variants=None, top=None, workers=1, stats=None):
+    '''
+    This method takes as input:
+    (1) a dictionary of MRNs mapped to lists of text blobs (corresponding to clinic notes for that patient),
+    (2) a dictionary of MRNs mapped to lists of Date objects (corresponding to the gold dates for the event in question for that patient),
+    (3) (optionally) a list of the names of scoring variants (see SCORING_VARIANTS; all of them if None), and
+    (4) the optional top, workers and stats arguments of get_keyword_list().
+    It then returns a dictionary of the names of the variants mapped to the lists that get_keyword_list() returns with each variant's normalizations, scoring the notes only once (see rank_keyword_variants()).
+    '''
+    patients = ((blobs_dict.get(MRN, []), gold_dates_dict[MRN]) for MRN in gold_dates_dict)
+    accumulator = get_ngram_accumulator(patients, workers, stats)
+
+    return rank_keyword_variants(accumulator, variants, top, stats)
+
+
+def cross_validate_keywords(blobs_dict, gold_dates_dict, num_folds, top=None, workers=1, normalize_word_freq=False, normalize_date_freq=False, seed=0, stats=None):
+    '''
+    This method takes as input:
+    (1) a dictionary of MRNs mapped to lists of text blobs (corresponding to clinic notes for that patient),
+    (2) a dictionary of MRNs mapped to lists of Date objects (corresponding to the gold dates for the event in question for that patient),
+    (3) a number of folds to split the patients in the gold dates dictionary into (see assign_folds()),
+    (4) the optional arguments of get_keyword_list(), and
+    (5) (optionally) a random seed for splitting the patients into folds.
+    It then returns a list of (set of held-out MRNs, keyword list) 2-tuples, one per fold, where the keyword list is the one get_keyword_list() would return for all the patients in the other folds.
+    NB: Each patient is scored only once, into the accumulator of its fold (see get_fold_accumulators()), and each fold's training scores are the total of all the folds less that fold's (see get_training_accumulators()), so k folds cost about as much as scoring all the patients once.
+    '''
+    folds = assign_folds(gold_dates_dict, num_folds, seed)
+    patients = ((folds[MRN], blobs_dict.get(MRN, []), gold_dates_dict[MRN]) for MRN in gold_dates_dict)
+    fold_accumulators = get_fold_accumulators(patients, num_folds, workers, stats)
+
+    held_out_MRNs = [set() for fold in xrange(num_folds)]
+    for MRN, fold in folds.iteritems():
+        held_out_MRNs[fold].add(MRN)
+
+    return [(held_out_MRNs[fold], rank_keywords(accumulator, top, normalize_word_freq, normalize_date_freq, stats))
+            for fold, accumulator in enumerate(get_training_accumulators(fold_accumulators))]
+
+
+def get_keyword_list_from_stream(MRN_blobs, gold_dates_dict, top=None, workers=1, normalize_word_freq=False, normalize_date_freq=False, stats=None):
+    '''
+    This method takes as input:
+    (1) an iterable of (MRN, list of text blobs) 2-tuples (e.g., as yielded by read_notes_by_MRN()),
+    (2) a dictionary of MRNs mapped to lists of Date objects (corresponding to the gold dates for the event in question for that patient), and
+    (3) the optional arguments of get_keyword_list().
+    It then returns the same list as get_keyword_list(), but scores each patient's notes as soon as they are read, so only one patient's notes (or, with several processes, a few batches of patients' notes) need to be in memory at a time.
+    '''
+    patients = ((blobs, gold_dates_dict[MRN]) for MRN, blobs in MRN_blobs if MRN in gold_dates_dict)
+    accumulator = get_ngram_accumulator(patients, workers, stats)
+
+    return rank_keywords(accumulator, top, normalize_word_freq, normalize_date_freq, stats)
+
+
+def get_keyword_list_from_cache(cache_filename, gold_dates_dict, top=None, workers=1, normalize_word_freq=False, normalize_date_freq=False, stats=None):
+    '''
+    This method takes as input:
+    (1) the path of a notes cache (see build_notes_cache()),
+    (2) a dictionary of MRNs mapped to lists of Date objects (corresponding to the gold dates for the event in question for that patient), and
+    (3) the optional arguments of get_keyword_list().
+    It then returns the same list as get_keyword_list() would for the notes in the cache, but without finding, parsing or tokenizing the date expressions in the notes again: only the notes of the patients in the gold dates dictionary are read, and only their dates are matched with the gold dates.
+    '''
+    patients = ((notes, gold_dates_dict[MRN]) for MRN, notes in read_notes_cache(cache_filename, gold_dates_dict))
+    accumulator = get_ngram_accumulator(patients, workers, stats, add_tokenized_ngram_distances)
+
+    return rank_keywords(accumulator, top, normalize_word_freq, normalize_date_freq, stats)
+
+
+def get_keyword_queue(blobs_dict, gold_dates_dict, workers=1, normalize_word_freq=False, normalize_date_freq=False, stats=None):
+    '''
+    This method takes as input:
+    (1) a dictionary of MRNs mapped to lists of text blobs (corresponding to clinic notes for that patient),
+    (2) a dictionary of MRNs mapped to lists of Date objects (corresponding to the gold dates for the event in question for that patient),
+    (3) (optionally) the number of processes to score patients in,
+    (4) (optionally) whether to normalize the scores for keyword frequency and for true vs. false date frequency (see get_score()), and
+    (5) (optionally) a PipelineStats object to add counts and timings for each stage to (none are collected if None).
+    It then returns a priority queue of (keyword, position) tuples and their corresponding scores. (Scores returned are multiplied by -1 so that highest-scored keywords are returned first, since python's priority queue returns lowest-scored items first.)
+    NB: This method is kept for compatibility; get_keyword_list() returns the same keywords in the same order as a plain list.
+    '''
+    patients = ((blobs_dict.get(MRN, []), gold_dates_dict[MRN]) for MRN in gold_dates_dict)
+    accumulator = get_ngram_accumulator(patients, workers, stats)
+
+    return make_keyword_queue(accumulator, normalize_word_freq, normalize_date_freq, stats)
+
+
+def get_keyword_queue_from_stream(MRN_blobs, gold_dates_dict, workers=1, normalize_word_freq=False, normalize_date_freq=False, stats=None):
+    '''
+    This method takes as input:
+    (1) an iterable of (MRN, list of text blobs) 2-tuples (e.g., as yielded by read_notes_by_MRN()),
+    (2) a dictionary of MRNs mapped to lists of Date objects (corresponding to the gold dates for the event in question for that patient),
+    (3) (optionally) the number of processes to score patients in, and
+    (4) (optionally) whether to normalize the scores and a PipelineStats object (see get_keyword_queue()).
+    It then returns the same priority queue as get_keyword_queue(), but scores each patient's notes as soon as they are read (see get_keyword_list_from_stream()).
+    '''
+    patients = ((blobs, gold_dates_dict[MRN]) for MRN, blobs in MRN_blobs if MRN in gold_dates_dict)
+    accumulator = get_ngram_accumulator(patients, workers, stats)
+
+    return make_keyword_queue(accumulator, normalize_word_freq, normalize_date_freq, stats)
+
+
+class PipelineStats(object):
+    '''
+    A PipelineStats object keeps counters and timers for the stages of keyword extraction. Collecting them is off by default; to collect them, pass a PipelineStats object to get_keyword_list() or get_keyword_queue() (or use --stats on the command line), then call get_report().
+    The stages timed (in seconds, in 'seconds') are:
+    (1) 'find_dates': matching date_regex against the notes,
+    (2) 'parse_dates': making Date objects of the date expressions found (including strptime and the date expression cache),
+    (3) 'tokenize': tokenizing the notes, not counting (1) and (2),
+    (4) 'tag_dates': deciding which date expressions are gold dates,
+    (5) 'distances': the distance loop (computing inverse distances and adding them to the score tables), and
+    (6) 'rank': scoring and sorting the keywords.
+    NB: With more than one process, the times of the worker processes are added up, so they can add up to more than the time that passed.
+    '''
+    COUNTERS = ('patients', 'notes', 'notes_scored', 'tokens', 'date_expressions', 'date_parse_failures', 'true_dates', 'false_dates', 'tied_distances', 'keywords_ranked')
+    STAGES = ('find_dates', 'parse_dates', 'tokenize', 'tag_dates', 'distances', 'rank')
+
+    def __init__(self):
+        self.counts = dict((name, 0) for name in self.COUNTERS)
+        self.seconds = dict((stage, 0.0) for stage in self.STAGES)
+
+
+    def count(self, name, number=1):
+        self.counts[name] += number
+
+
+    def add_time(self, stage, seconds):
+        self.seconds[stage] += seconds
+
+
+    def merge(self, other):
+        '''
+        This method takes as input a second PipelineStats object and adds its counts and times to this one's.
+        '''
+        for name in self.COUNTERS:
+            self.counts[name] += other.counts[name]
+        for stage in self.STAGES:
+            self.seconds[stage] += other.seconds[stage]
+
+
+    def get_report(self):
+        '''
+        This method returns a dictionary of the counts and times (which can be written out as JSON), along with the throughput of the stages in notes/sec and tokens/sec.
+        '''
+        total_seconds = sum(self.seconds.values())
+        report = {
+            'counts': dict(self.counts),
+            'seconds': dict(self.seconds),
+            'total_seconds': total_seconds,
+        }
+        if total_seconds > 0:
+            report['notes_per_second'] = self.counts['notes'] / total_seconds
+            report['tokens_per_second'] = self.counts['tokens'] / total_seconds
+        return report
+
+
+# Inverse distances are summed as integers, in units of 2**-FIXED_POINT_BITS
+# Every inverse distance to a date less than 2**75 tokens away is a whole number of these units, so the sums are exact: they don't depend on the order in which patients are scored, and they can be merged (or subtracted) without rounding error
+FIXED_POINT_BITS = 128
+FIXED_POINT_SCALE = 2.0 ** FIXED_POINT_BITS
+
+
+# Positions of keywords with respect to dates, in the order in which the score tables are indexed
+POSITIONS = ('PRE-DATE', 'POST-DATE')
+PRE_DATE = 0
+POST_DATE = 1
+
+
+class Vocabulary(object):
+    '''
+    A Vocabulary object maps lowercased keywords to consecutive integer IDs, so that keyword statistics can be kept in arrays indexed by ID.
+    It also remembers the ID of each multi-word keyword (n-gram) by the IDs of its first n-1 words and its last word, so that n-grams can be looked up without joining their words (see get_ngram_id()).
+    NB: Tokens are lowercased when the notes are tokenized (see tokenize_with_dates()), so they are looked up in 'ids' as they are.
+    '''
+    def __init__(self):
+        self.ids = {}
+        self.keywords = []
+        self.ngram_ids = {}
+
+
+    def __len__(self):
+        return len(self.keywords)
+
+
+    def __getstate__(self):
+        # Only the keywords need to be pickled; the rest can be rebuilt from them
+        return self.keywords
+
+
+    def __setstate__(self, keywords):
+        self.keywords = keywords
+        self.ids = dict((keyword, keyword_id) for keyword_id, keyword in enumerate(keywords))
+        self.ngram_ids = {}
+
+
+    def get_id(self, keyword):
+        '''
+        This method takes as input a lowercased keyword and returns its ID, adding it to the vocabulary if it isn't already there.
+        '''
+        keyword_id = self.ids.get(keyword)
+        if keyword_id is None:
+            keyword_id = self.ids[keyword] = len(self.keywords)
+            self.keywords.append(keyword)
+        return keyword_id
+
+
+    def get_ngram_id(self, prefix_id, keyword_id):
+        '''
+        This method takes as input the ID of an n-gram (or a single keyword) and the ID of a single keyword, and returns the ID of the n-gram made of the two (their keywords joined by a space), adding it to the vocabulary if it isn't already there.
+        '''
+        key = get_ngram_key(prefix_id, keyword_id)
+        ngram_id = self.ngram_ids.get(key)
+        if ngram_id is None:
+            ngram_id = self.ngram_ids[key] = self.get_id(self.keywords[prefix_id] + ' ' + self.keywords[keyword_id])
+        return ngram_id
+
+
+def get_ngram_key(prefix_id, keyword_id):
+    '''
+    This method takes as input the ID of an n-gram (or a single keyword) and the ID of a single keyword, and returns an integer that identifies the n-gram made of the two (see Vocabulary.get_ngram_id()).
+    '''
+    return (prefix_id << 32) | keyword_id
+
+
+def get_ngram_sketch_key(prefix, keyword):
+    '''
+    This method takes as input an n-gram (or a single keyword) and a single keyword, and returns an integer that identifies the n-gram made of the two in the process's NgramSketch (see get_ngram_sketch()).
+    NB: Unlike get_ngram_key(), the key doesn't depend on any accumulator's IDs, since the sketch is shared by all the accumulators in the process; it is made from the words' own hashes, which Python keeps with the strings, so no string is made for the n-gram.
+    '''
+    return hash(prefix) * NGRAM_SKETCH_KEY_MULTIPLIER + hash(keyword)
+
+
+class NgramAccumulator(object):
+    '''
+    An NgramAccumulator object keeps, for each (keyword, position) 2-tuple (where 'position' is 'PRE-DATE' or 'POST-DATE'), the sum and the number of the inverse distances to the closest true date and to the closest false date.
+    These are all the statistics the scores (including the optional normalizations) need, so memory grows with the number of distinct keywords rather than with the number of times they occur.
+    NB: Keywords are stored by their Vocabulary IDs; the statistics are kept in parallel tables indexed first by position (PRE_DATE or POST_DATE) and then by keyword ID. (Keyword, position) 2-tuples are only built again when the results are output.
+    NB: If 'collect_stats' is True, the accumulator also has a PipelineStats object (in 'stats', else None) that counts and times the stages of scoring the notes whose distances are added to it.
+    NB: Keywords of up to max_ngram_length words are scored (see set_max_ngram_length()). If ngram_min_count is set, n-grams of more than one word are only given room in the score tables once they have been seen that many times, as estimated by the process's NgramSketch (see get_ngram_sketch()); accumulators that are only merged into never count n-grams, so they never need it.
+    '''
+    def __init__(self, collect_stats=False):
+        self.vocabulary = Vocabulary()
+        self.stats = PipelineStats() if collect_stats else None
+        self.max_ngram_length = max_ngram_length
+        self.ngram_min_count = ngram_min_count
+
+        # Fixed-point sums are arbitrarily large integers, so they are kept in lists; counts are kept in arrays of C longs
+        self.true_sums = ([], [])
+        self.true_counts = (array('l'), array('l'))
+        self.false_sums = ([], [])
+        self.false_counts = (array('l'), array('l'))
+
+
+    def __len__(self):
+        return len(self.get_ngrams())
+
+
+    def get_keyword_id(self, keyword):
+        '''
+        This method takes as input a lowercased keyword (or token; see tokenize_with_dates()) and returns its ID, making room for it in the score tables if it is new.
+        '''
+        keyword_id = self.vocabulary.get_id(keyword)
+        if keyword_id == len(self.true_counts[PRE_DATE]):
+            self.add_table_entry()
+        return keyword_id
+
+
+    def get_ngram_id(self, prefix_id, keyword_id):
+        '''
+        This method takes as input the ID of an n-gram (or a single keyword) and the ID of a single keyword, and returns the ID of the n-gram made of the two, making room for it in the score tables if it is new (see Vocabulary.get_ngram_id()).
+        '''
+        ngram_id = self.vocabulary.get_ngram_id(prefix_id, keyword_id)
+        if ngram_id == len(self.true_counts[PRE_DATE]):
+            self.add_table_entry()
+        return ngram_id
+
+
+    def get_state(self):
+        '''
+        This method returns a dictionary of the accumulator's keywords, settings and score tables, made only of built-in types and arrays, from which make_ngram_accumulator() makes the same accumulator again (see KeywordModel.save()).
+        '''
+        return {
+            'keywords': list(self.vocabulary.keywords),
+            'max_ngram_length': self.max_ngram_length,
+            'ngram_min_count': self.ngram_min_count,
+            'true_sums': tuple(list(table) for table in self.true_sums),
+            'true_counts': tuple(array('l', table) for table in self.true_counts),
+            'false_sums': tuple(list(table) for table in self.false_sums),
+            'false_counts': tuple(array('l', table) for table in self.false_counts),
+        }
+
+
+    def add_table_entry(self):
+        '''
+        This method makes room in the score tables for the most recent keyword added to the vocabulary.
+        '''
+        for tables in (self.true_sums, self.false_sums):
+            for table in tables:
+                table.append(0)
+        for tables in (self.true_counts, self.false_counts):
+            for table in tables:
+                table.append(0)
+
+
+    def add(self, ngram, inv_dist, is_true_date):
+        '''
+        This method takes as input a (keyword, position) 2-tuple, the inverse distance from the keyword to the closest date in that position, and whether that date is a true date.
+        '''
+        keyword, position = ngram
+        keyword_id = self.get_keyword_id(keyword)
+        position_index = POSITIONS.index(position)
+        if is_true_date:
+            self.true_sums[position_index][keyword_id] += int(inv_dist * FIXED_POINT_SCALE)
+            self.true_counts[position_index][keyword_id] += 1
+        else:
+            self.false_sums[position_index][keyword_id] += int(inv_dist * FIXED_POINT_SCALE)
+            self.false_counts[position_index][keyword_id] += 1
+
+
+    def merge(self, other, sign=1):
+        '''
+        This method takes as input a second NgramAccumulator and adds its sums and counts to this one's (or, if 'sign' is -1, subtracts them; see subtract()).
+        '''
+        for other_id, keyword in enumerate(other.vocabulary.keywords):
+            keyword_id = self.get_keyword_id(keyword)
+            for position_index in (PRE_DATE, POST_DATE):
+                self.true_sums[position_index][keyword_id] += sign * other.true_sums[position_index][other_id]
+                self.true_counts[position_index][keyword_id] += sign * other.true_counts[position_index][other_id]
+                self.false_sums[position_index][keyword_id] += sign * other.false_sums[position_index][other_id]
+                self.false_counts[position_index][keyword_id] += sign * other.false_counts[position_index][other_id]
+
+        if sign == 1 and self.stats is not None and other.stats is not None:
+            self.stats.merge(other.stats)
+
+
+    def subtract(self, other):
+        '''
+        This method takes as input a second NgramAccumulator whose sums and counts were merged into this one, and takes them out again. Since the sums are exact, this leaves exactly the sums and counts this accumulator would have had without them.
+        '''
+        self.merge(other, -1)
+
+
+    def get_ngrams(self):
+        '''
+        This method returns a list of the (keyword, position) 2-tuples that were at least once closest to a true date (the ones that are scored).
+        '''
+        keywords = self.vocabulary.keywords
+        return [(keywords[keyword_id], POSITIONS[position_index])
+                for position_index in (PRE_DATE, POST_DATE)
+                for keyword_id, count in enumerate(self.true_counts[position_index]) if count > 0]
+
+
+    def get_sums(self, ngram):
+        '''
+        This method takes as input a (keyword, position) 2-tuple and returns a (true date sum, true date count, false date sum, false date count) 4-tuple, where the sums are floats.
+        '''
+        keyword, position = ngram
+        keyword_id = self.vocabulary.ids.get(keyword)
+        if keyword_id is None:
+            return (0.0, 0, 0.0, 0)
+
+        position_index = POSITIONS.index(position)
+        return (from_fixed_point(self.true_sums[position_index][keyword_id]), self.true_counts[position_index][keyword_id],
+                from_fixed_point(self.false_sums[position_index][keyword_id]), self.false_counts[position_index][keyword_id])
+
+    def get_score(self, ngram, normalize_word_freq=False, normalize_date_freq=False):
+        '''
+        This method takes as input a (keyword, position) 2-tuple and (optionally) whether to normalize for keyword frequency and for true vs. false date frequency, and returns the keyword's score (see get_score()).
+        '''
+        true_sum, true_count, false_sum, false_count = self.get_sums(ngram)
+        return get_score(true_sum, true_count, false_sum, false_count, normalize_word_freq, normalize_date_freq)
+
+
+    def get_scores(self, normalize_word_freq=False, normalize_date_freq=False):
+        '''
+        This method takes as input (optionally) whether to normalize the scores (see get_score()), and yields a (score, (keyword, position)) 2-tuple for each scored (keyword, position) 2-tuple (see get_ngrams()), reading the score tables directly.
+        '''
+        for ngram, true_sum, true_count, false_sum, false_count in self.get_all_sums():
+            yield (get_score(true_sum, true_count, false_sum, false_count, normalize_word_freq, normalize_date_freq), ngram)
+
+
+    def get_all_sums(self):
+        '''
+        This method yields a ((keyword, position), true date sum, true date count, false date sum, false date count) 5-tuple for each scored (keyword, position) 2-tuple (see get_ngrams()), where the sums are floats, reading the score tables directly.
+        '''
+        keywords = self.vocabulary.keywords
+        for position_index in (PRE_DATE, POST_DATE):
+            position = POSITIONS[position_index]
+            true_sums = self.true_sums[position_index]
+            true_counts = self.true_counts[position_index]
+            false_sums = self.false_sums[position_index]
+            false_counts = self.false_counts[position_index]
+            for keyword_id in xrange(len(keywords)):
+                if true_counts[keyword_id] > 0:
+                    yield ((keywords[keyword_id], position), from_fixed_point(true_sums[keyword_id]), true_counts[keyword_id],
+                           from_fixed_point(false_sums[keyword_id]), false_counts[keyword_id])
+
+
+def make_ngram_accumulator(state):
+    '''
+    This method takes as input a dictionary returned by NgramAccumulator.get_state() and returns an NgramAccumulator with the same keywords, settings and score tables.
+    '''
+    accumulator = NgramAccumulator()
+    for keyword in state['keywords']:
+        accumulator.vocabulary.get_id(keyword)
+    if len(accumulator.vocabulary) != len(state['keywords']):
+        raise ValueError("The saved keywords aren't distinct")
+    accumulator.max_ngram_length = state['max_ngram_length']
+    accumulator.ngram_min_count = state['ngram_min_count']
+    accumulator.true_sums = tuple(list(table) for table in state['true_sums'])
+    accumulator.true_counts = tuple(array('l', table) for table in state['true_counts'])
+    accumulator.false_sums = tuple(list(table) for table in state['false_sums'])
+    accumulator.false_counts = tuple(array('l', table) for table in state['false_counts'])
+    for tables in (accumulator.true_sums, accumulator.true_counts, accumulator.false_sums, accumulator.false_counts):
+        if len(tables) != len(POSITIONS) or any(len(table) != len(state['keywords']) for table in tables):
+            raise ValueError("The saved score tables don't match the saved keywords")
+    return accumulator
+
+
+def get_score(true_sum, true_count, false_sum, false_count, normalize_word_freq=False, normalize_date_freq=False):
+    '''
+    This method takes as input the sum and number of a keyword's inverse distances to true dates and to false dates, and (optionally) whether to normalize for keyword frequency and for true vs. false date frequency. It returns the keyword's score: the sum of its inverse distances to false dates less the sum of its inverse distances to true dates.
+    The normalizations are the ones normalize_for_word_freq() and normalize_for_date_freq() apply to lists of inverse distances, applied to the sums instead:
+    (1) normalizing for word frequency divides both sums by the total number of inverse distances, and
+    (2) normalizing for date frequency divides each sum by its own number of inverse distances.
+    '''
+    # Optional normalization for false vs. true date frequency
+    if normalize_date_freq and true_count > 0:
+        true_sum *= 1.0/true_count
+
+    # Optional normalization for word frequency
+    if normalize_word_freq and true_count + false_count > 0:
+        true_sum *= 1.0/(true_count + false_count)
+        false_sum *= 1.0/(true_count + false_count)
+
+    # Optional normalization for false vs. true date frequency
+    if normalize_date_freq and false_count > 0:
+        false_sum *= 1.0/false_count
+
+    return false_sum - true_sum
+
+
+def from_fixed_point(fixed_sum):
+    '''
+    This method takes as input a fixed-point sum of inverse distances (see NgramAccumulator) and returns the closest float.
+    '''
+    return math.ldexp(float(fixed_sum), -FIXED_POINT_BITS)
+
+
+# Number of patients sent to a worker process at a time
+PATIENTS_PER_BATCH = 50
+
+
+def get_ngram_accumulator(patients, workers=1, stats=None, add_distances=None):
+    '''
+    This method takes as input:
+    (1) an iterable of (list of text blobs, list of gold Date objects) 2-tuples, one per patient,
+    (2) (optionally) the number of processes to score patients in,
+    (3) (optionally) a PipelineStats object to add counts and timings for each stage to, and
+    (4) (optionally) the method to score each patient with (add_ngram_distances() by default, or add_tokenized_ngram_distances() if the patients' notes are tokenized notes from a notes cache).
+    It then returns an NgramAccumulator of the inverse distances for all the patients.
+    NB: With more than one process, patients are sent to a pool of worker processes in batches; each worker returns an NgramAccumulator for its batch, and these are merged. Since the sums are exact, the order in which batches are merged doesn't change them.
+    '''
+    if add_distances is None:
+        add_distances = add_ngram_distances
+
+    # N-grams are counted from scratch for each run (the worker processes are forked after this, so they start from scratch too)
+    reset_ngram_sketch()
+
+    accumulator = NgramAccumulator(stats is not None)
+
+    if workers <= 1:
+        for blobs, gold_dates in patients:
+            add_distances(blobs, gold_dates, accumulator)
+
+    else:
+        pool = multiprocessing.Pool(workers)
+        try:
+            # Keep only a few batches in flight, so that a stream of patients is not read into memory all at once
+            pending = deque()
+            for batch in get_batches(patients, PATIENTS_PER_BATCH):
+                pending.append(pool.apply_async(get_ngram_accumulator_for_batch, (batch, stats is not None, add_distances)))
+                if len(pending) >= 2 * workers:
+                    accumulator.merge(pending.popleft().get())
+            while pending:
+                accumulator.merge(pending.popleft().get())
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    if stats is not None:
+        stats.merge(accumulator.stats)
+
+    return accumulator
+
+
+def get_ngram_accumulator_for_batch(batch, collect_stats=False, add_distances=None):
+    '''
+    This method takes as input a list of (list of text blobs, list of gold Date objects) 2-tuples, one per patient, (optionally) whether to count and time the stages of scoring them, and (optionally) the method to score each patient with (see get_ngram_accumulator()), and returns an NgramAccumulator of the inverse distances for those patients. (It is run in the worker processes.)
+    '''
+    if add_distances is None:
+        add_distances = add_ngram_distances
+
+    accumulator = NgramAccumulator(collect_stats)
+    for blobs, gold_dates in batch:
+        add_distances(blobs, gold_dates, accumulator)
+    return accumulator
+
+
+def get_batches(items, batch_size):
+    '''
+    This method takes as input an iterable and a batch size, and yields lists of consecutive items of (at most) that size.
+    '''
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def get_patient_ngram_accumulators(patients, workers=1, collect_stats=False):
+    '''
+    This method takes as input:
+    (1) an iterable of (list of text blobs, list of gold Date objects) 2-tuples, one per patient,
+    (2) (optionally) the number of processes to score patients in, and
+    (3) (optionally) whether to count and time the stages of scoring each patient (see NgramAccumulator).
+    It then yields an NgramAccumulator of the inverse distances for each patient, in the same order as the patients.
+    '''
+    if workers <= 1:
+        for blobs, gold_dates in patients:
+            accumulator = NgramAccumulator(collect_stats)
+            add_ngram_distances(blobs, gold_dates, accumulator)
+            yield accumulator
+
+    else:
+        pool = multiprocessing.Pool(workers)
+        try:
+            # As in get_ngram_accumulator(), keep only a few batches in flight
+            pending = deque()
+            for batch in get_batches(patients, PATIENTS_PER_BATCH):
+                pending.append(pool.apply_async(get_patient_ngram_accumulators_for_batch, (batch, collect_stats)))
+                if len(pending) >= 2 * workers:
+                    for accumulator in pending.popleft().get():
+                        yield accumulator
+            while pending:
+                for accumulator in pending.popleft().get():
+                    yield accumulator
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+
+def get_patient_ngram_accumulators_for_batch(batch, collect_stats=False):
+    '''
+    This method takes as input a list of (list of text blobs, list of gold Date objects) 2-tuples, one per patient, and (optionally) whether to count and time the stages of scoring them, and returns a list of NgramAccumulators of the inverse distances, one per patient. (It is run in the worker processes.)
+    '''
+    return list(get_patient_ngram_accumulators(batch, 1, collect_stats))
+
+
+def assign_folds(MRNs, num_folds, seed=0):
+    '''
+    This method takes as input an iterable of MRNs, a number of folds, and (optionally) a random seed, and returns a dictionary of the MRNs mapped to fold numbers (0 to num_folds - 1). The MRNs are shuffled and dealt out to the folds in turn, so the folds differ in size by at most one patient, and the same MRNs and seed always give the same folds.
+    '''
+    shuffled_MRNs = sorted(MRNs)
+    random.Random(seed).shuffle(shuffled_MRNs)
+    return dict((MRN, i % num_folds) for i, MRN in enumerate(shuffled_MRNs))
+
+
+def get_fold_accumulators(patients, num_folds, workers=1, stats=None, add_distances=None):
+    '''
+    This method takes as input:
+    (1) an iterable of (fold number, list of text blobs, list of gold Date objects) 3-tuples, one per patient,
+    (2) the number of folds, and
+    (3) the optional arguments of get_ngram_accumulator().
+    It then returns a list of NgramAccumulators of the inverse distances for the patients in each fold, scoring each patient once.
+    '''
+    # Which n-grams are counted approximately would depend on how the patients are split into folds, so the training rankings wouldn't be those of the other folds' patients
+    if max_ngram_length > 1 and ngram_min_count > 1:
+        raise ValueError("N-grams can't be counted approximately (see set_ngram_min_count()) when cross-validating")
+
+    if add_distances is None:
+        add_distances = add_ngram_distances
+
+    fold_accumulators = [NgramAccumulator(stats is not None) for fold in xrange(num_folds)]
+
+    if workers <= 1:
+        for fold, blobs, gold_dates in patients:
+            add_distances(blobs, gold_dates, fold_accumulators[fold])
+
+    else:
+        pool = multiprocessing.Pool(workers)
+        try:
+            # As in get_ngram_accumulator(), keep only a few batches in flight
+            pending = deque()
+            def merge_batch(batch_accumulators):
+                for fold_accumulator, batch_accumulator in izip(fold_accumulators, batch_accumulators):
+                    fold_accumulator.merge(batch_accumulator)
+            for batch in get_batches(patients, PATIENTS_PER_BATCH):
+                pending.append(pool.apply_async(get_fold_accumulators_for_batch, (batch, num_folds, stats is not None, add_distances)))
+                if len(pending) >= 2 * workers:
+                    merge_batch(pending.popleft().get())
+            while pending:
+                merge_batch(pending.popleft().get())
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    if stats is not None:
+        for fold_accumulator in fold_accumulators:
+            stats.merge(fold_accumulator.stats)
+
+    return fold_accumulators
+
+
+def get_fold_accumulators_for_batch(batch, num_folds, collect_stats=False, add_distances=None):
+    '''
+    This method takes as input a list of (fold number, list of text blobs, list of gold Date objects) 3-tuples, one per patient, the number of folds, (optionally) whether to count and time the stages of scoring them, and (optionally) the method to score each patient with (see get_ngram_accumulator()), and returns a list of NgramAccumulators of the inverse distances for the patients in each fold. (It is run in the worker processes.)
+    '''
+    if add_distances is None:
+        add_distances = add_ngram_distances
+
+    fold_accumulators = [NgramAccumulator(collect_stats) for fold in xrange(num_folds)]
+    for fold, blobs, gold_dates in batch:
+        add_distances(blobs, gold_dates, fold_accumulators[fold])
+    return fold_accumulators
+
+
+def get_training_accumulators(fold_accumulators):
+    '''
+    This method takes as input a list of NgramAccumulators, one per fold (see get_fold_accumulators()), and yields, for each fold in turn, an NgramAccumulator of the inverse distances for all the patients in the other folds.
+    NB: Rather than merging the other k-1 folds for each fold, the folds are merged once into a total, and each fold is subtracted from a copy of it; since the sums are exact, this gives exactly the sums and counts of scoring the other folds' patients from scratch.
+    '''
+    total = NgramAccumulator()
+    for fold_accumulator in fold_accumulators:
+        total.merge(fold_accumulator)
+
+    for fold_accumulator in fold_accumulators:
+        accumulator = NgramAccumulator()
+        accumulator.merge(total)
+        accumulator.subtract(fold_accumulator)
+        yield accumulator
+
+
+class KeywordModel(object):
+    '''
+    A KeywordModel object keeps an NgramAccumulator of the inverse distances for a set of patients, together with a log of each patient's contribution to it (the patient's own NgramAccumulator), so that patients can be added, updated, or removed without scoring the other patients again.
+    The contributions are stored by MRN, along with a fingerprint of the notes and gold dates they were computed from, so that patients whose input hasn't changed are skipped when the model is updated.
+    NB: Since the sums are exact, a model that has been updated has exactly the sums and counts of a model built from scratch from the same patients, so the ranking is the same.
+    '''
+    def __init__(self):
+        self.accumulator = NgramAccumulator()
+        self.contributions = {}
+        self.max_ngram_length = max_ngram_length
+        self.distance_window = distance_window
+
 
-LOG = logging.getLogger(__name__)
-LOG.setLevel(logging.WARNING)
+    def __len__(self):
+        return len(self.contributions)
 
 
-def main():
-    logging.basicConfig()
+    def __contains__(self, MRN):
+        return MRN in self.contributions
 
-    notes_filename = argv[1]
-    data_filename = argv[2]
-    
-    notes_file = open(notes_filename)
-    data_file = open(data_filename)
-    
-    notes_dict = {}
-    for line in notes_file:
-        line = line.strip()
-        tokens = line.split('\t')
-        if len(tokens) not in [3, 4]:
-            LOG.warning("Unexpected line format (should be MRN[tab]date[tab]description[tab]note); skipping line: %s" % line)
+
+    def add_patients(self, patients, workers=1, stats=None):
+        '''
+        This method takes as input:
+        (1) an iterable of (MRN, list of text blobs, list of gold Date objects) 3-tuples, where the text blobs are all the notes for that patient,
+        (2) (optionally) the number of processes to score patients in, and
+        (3) (optionally) a PipelineStats object to add counts and timings for each stage of scoring the patients to.
+        It then adds the patients to the model, replacing the contributions of patients already in it, and returns the number of patients added or replaced. Patients whose notes and gold dates are the same as when they were last added are skipped.
+        '''
+        # Every patient's contribution must be counted the same way
+        if getattr(self, 'max_ngram_length', 1) != max_ngram_length:
+            raise ValueError("The model scores keywords of up to %s words, not %s" % (getattr(self, 'max_ngram_length', 1), max_ngram_length))
+        if getattr(self, 'distance_window', None) != distance_window:
+            raise ValueError("The model scores keywords within a window of %s tokens, not %s" % (getattr(self, 'distance_window', None), distance_window))
+        if max_ngram_length > 1 and ngram_min_count > 1:
+            raise ValueError("N-grams can't be counted approximately (see set_ngram_min_count()) in a keyword model")
+
+        changed = []
+        for MRN, blobs, gold_dates in patients:
+            fingerprint = get_patient_fingerprint(blobs, gold_dates)
+            contribution = self.contributions.get(MRN)
+            if contribution is None or contribution[0] != fingerprint:
+                changed.append((MRN, fingerprint, blobs, gold_dates))
+
+        accumulators = get_patient_ngram_accumulators(((blobs, gold_dates) for MRN, fingerprint, blobs, gold_dates in changed), workers, stats is not None)
+        for (MRN, fingerprint, blobs, gold_dates), accumulator in izip(changed, accumulators):
+            # The counts and timings are not part of the patient's contribution
+            if stats is not None:
+                stats.merge(accumulator.stats)
+                accumulator.stats = None
+            self.remove_patient(MRN)
+            self.accumulator.merge(accumulator)
+            self.contributions[MRN] = (fingerprint, accumulator)
+
+        return len(changed)
+
+
+    def remove_patient(self, MRN):
+        '''
+        This method takes as input an MRN and retracts that patient's contribution from the model. It returns True if the patient was in the model, else False.
+        '''
+        contribution = self.contributions.pop(MRN, None)
+        if contribution is None:
+            return False
+        self.accumulator.subtract(contribution[1])
+        return True
+
+
+    def update(self, blobs_dict, gold_dates_dict, workers=1, remove_missing=False, stats=None):
+        '''
+        This method takes as input:
+        (1) a dictionary of MRNs mapped to lists of text blobs (all the clinic notes for that patient),
+        (2) a dictionary of MRNs mapped to lists of Date objects (corresponding to the gold dates for the event in question for that patient),
+        (3) (optionally) the number of processes to score patients in,
+        (4) (optionally) whether to remove the patients in the model that aren't in the gold dates dictionary (e.g., if the input is the whole corpus rather than only the new or changed patients), and
+        (5) (optionally) a PipelineStats object (see add_patients()).
+        It then adds new patients to the model, replaces the contributions of patients whose notes or gold dates have changed, and returns a (number of patients added or replaced, number of patients removed) 2-tuple.
+        '''
+        patients = ((MRN, blobs_dict.get(MRN, []), gold_dates_dict[MRN]) for MRN in gold_dates_dict)
+        num_updated = self.add_patients(patients, workers, stats)
+
+        num_removed = 0
+        if remove_missing:
+            for MRN in [MRN for MRN in self.contributions if MRN not in gold_dates_dict]:
+                self.remove_patient(MRN)
+                num_removed += 1
+
+        return (num_updated, num_removed)
+
+
+    def save(self, filename):
+        '''
+        This method takes as input a path and saves the model there (see load_keyword_model()).
+        NB: The model is saved as a dictionary of built-in types (see NgramAccumulator.get_state()) rather than as a KeywordModel, so that a model saved by extract_keywords.py run as a script (whose classes are __main__'s) can be loaded where this module is imported, and the other way round.
+        '''
+        state = {
+            'format': KEYWORD_MODEL_FORMAT,
+            'version': KEYWORD_MODEL_VERSION,
+            'max_ngram_length': self.max_ngram_length,
+            'distance_window': self.distance_window,
+            'accumulator': self.accumulator.get_state(),
+            'contributions': dict((MRN, (fingerprint, accumulator.get_state())) for MRN, (fingerprint, accumulator) in self.contributions.iteritems()),
+        }
+        model_file = open(filename, 'wb')
+        try:
+            cPickle.dump(state, model_file, cPickle.HIGHEST_PROTOCOL)
+        finally:
+            model_file.close()
+
+
+def load_keyword_model(filename):
+    '''
+    This method takes as input the path of a model saved by KeywordModel.save() and returns the KeywordModel. It raises a ValueError if the file isn't a keyword model of the current version.
+    '''
+    state = load_saved_state(filename, KEYWORD_MODEL_FORMAT, KEYWORD_MODEL_VERSION)
+
+    model = KeywordModel()
+    try:
+        model.max_ngram_length = state['max_ngram_length']
+        model.distance_window = state['distance_window']
+        model.accumulator = make_ngram_accumulator(state['accumulator'])
+        model.contributions = dict((MRN, (fingerprint, make_ngram_accumulator(accumulator_state))) for MRN, (fingerprint, accumulator_state) in state['contributions'].iteritems())
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError("Not a keyword model: %s (%s)" % (filename, e))
+    return model
+
+
+# Globals: Keyword models
+# NB: KEYWORD_MODEL_VERSION must be changed whenever what KeywordModel.save() saves changes
+KEYWORD_MODEL_FORMAT = 'keyword model'
+KEYWORD_MODEL_VERSION = 1
+
+
+def get_patient_fingerprint(blobs, gold_dates):
+    '''
+    This method takes as input a list of text blobs and a list of gold Date objects for one patient, and returns a string that changes whenever either of them does.
+    '''
+    fingerprint = hashlib.sha1(repr(gold_dates))
+    for blob in blobs:
+        fingerprint.update('%d\t' % len(blob))
+        fingerprint.update(blob)
+    return fingerprint.hexdigest()
+
+
+def add_ngram_distances(blobs, gold_dates, accumulator):
+    '''
+    This method takes as input:
+    (1) a list of text blobs (corresponding to clinic notes for one patient),
+    (2) a list of Date objects (corresponding to the gold dates for the event in question for that patient), and
+    (3) an NgramAccumulator.
+    It then adds the inverse distances for the keywords in the text blobs to the accumulator.
+    '''
+    # Index the gold dates once per patient rather than comparing every date expression to each of them
+    gold_dates_index = DateIndex(gold_dates)
+
+    stats = accumulator.stats
+    if stats is not None:
+        add_ngram_distances_with_stats(blobs, gold_dates_index, accumulator, stats)
+        return
+
+    for blob in blobs:
+#       LOG.debug("\n")
+#       LOG.debug("Original text: %s" % blob)
+        tokens, date_indices, dates = tokenize_with_dates(blob)
+#       LOG.debug("Tokenized text: %s" % tokens)
+        true_date_indices, false_date_indices = tag_tokenized_dates(date_indices, dates, gold_dates_index)
+        add_token_distances(tokens, true_date_indices, false_date_indices, accumulator)
+
+
+def add_ngram_distances_with_stats(blobs, gold_dates_index, accumulator, stats):
+    '''
+    This method does what add_ngram_distances() does, and also counts and times each stage in the input PipelineStats object.
+    '''
+    stats.count('patients')
+    for blob in blobs:
+        stats.count('notes')
+
+        # Finding and parsing the date expressions is timed separately (see extract_dates_and_char_indices())
+        date_seconds = stats.seconds['find_dates'] + stats.seconds['parse_dates']
+        start = time.time()
+        tokens, date_indices, dates = tokenize_with_dates(blob, stats)
+        stats.add_time('tokenize', time.time() - start - (stats.seconds['find_dates'] + stats.seconds['parse_dates'] - date_seconds))
+        stats.count('tokens', len(tokens))
+
+        start = time.time()
+        true_date_indices, false_date_indices = tag_tokenized_dates(date_indices, dates, gold_dates_index)
+        stats.add_time('tag_dates', time.time() - start)
+        stats.count('true_dates', len(true_date_indices))
+        stats.count('false_dates', len(false_date_indices))
+
+        if true_date_indices and false_date_indices:
+            stats.count('notes_scored')
+        start = time.time()
+        stats.count('tied_distances', add_token_distances(tokens, true_date_indices, false_date_indices, accumulator))
+        stats.add_time('distances', time.time() - start)
+
+
+def add_tokenized_ngram_distances(notes, gold_dates, accumulator):
+    '''
+    This method takes as input:
+    (1) a list of (tokens, date token indices, Date objects) 3-tuples, one per note, as returned by tokenize_with_dates() (e.g., as read from a notes cache by read_notes_cache()),
+    (2) a list of Date objects (corresponding to the gold dates for the event in question for that patient), and
+    (3) an NgramAccumulator.
+    It then adds the inverse distances for the keywords in the notes to the accumulator, as add_ngram_distances() does for the text blobs of the notes.
+    '''
+    gold_dates_index = DateIndex(gold_dates)
+
+    stats = accumulator.stats
+    if stats is not None:
+        add_tokenized_ngram_distances_with_stats(notes, gold_dates_index, accumulator, stats)
+        return
+
+    for tokens, date_indices, dates in notes:
+        true_date_indices, false_date_indices = tag_tokenized_dates(date_indices, dates, gold_dates_index)
+        add_token_distances(tokens, true_date_indices, false_date_indices, accumulator)
+
+
+def add_tokenized_ngram_distances_with_stats(notes, gold_dates_index, accumulator, stats):
+    '''
+    This method does what add_tokenized_ngram_distances() does, and also counts and times each stage in the input PipelineStats object.
+    '''
+    stats.count('patients')
+    for tokens, date_indices, dates in notes:
+        stats.count('notes')
+        stats.count('tokens', len(tokens))
+
+        start = time.time()
+        true_date_indices, false_date_indices = tag_tokenized_dates(date_indices, dates, gold_dates_index)
+        stats.add_time('tag_dates', time.time() - start)
+        stats.count('true_dates', len(true_date_indices))
+        stats.count('false_dates', len(false_date_indices))
+
+        if true_date_indices and false_date_indices:
+            stats.count('notes_scored')
+        start = time.time()
+        stats.count('tied_distances', add_token_distances(tokens, true_date_indices, false_date_indices, accumulator))
+        stats.add_time('distances', time.time() - start)
+
+
+def add_token_distances(tokens, true_date_indices, false_date_indices, accumulator):
+    '''
+    This method takes as input:
+    (1) a list of tokens of one note, as returned by tokenize_with_dates(),
+    (2) a list of the token indices of gold dates (TRUE_DATE tokens),
+    (3) a list of the token indices of other dates (FALSE_DATE tokens), and
+    (4) an NgramAccumulator.
+    It then adds the inverse distances for the keywords in the note to the accumulator, and returns the number of inverse distances it skipped because the closest true and false dates were equally close.
+    '''
+    if accumulator.max_ngram_length > 1:
+        return add_token_ngram_distances(tokens, true_date_indices, false_date_indices, accumulator)
+    if distance_window is not None:
+        return add_token_window_distances(tokens, true_date_indices, false_date_indices, accumulator, distance_window)
+
+    num_ties = 0
+
+#   if (not true_date_indices) and (not false_date_indices):
+#       LOG.debug("No dates in this note; moving on to next note")
+         
+#   else:
+    if true_date_indices and false_date_indices:
+
+        keyword_ids = accumulator.vocabulary.ids
+        true_sums = accumulator.true_sums
+        true_counts = accumulator.true_counts
+        false_sums = accumulator.false_sums
+        false_counts = accumulator.false_counts
+
+        # Get the inverse distances from every token to the nearest {true, false} date in each position in one sweep per list of date indices
+        if distance_backend == 'numpy' and len(tokens) >= NUMPY_MIN_TOKENS:
+            get_distances = get_all_ngram_distances_numpy
         else:
-            MRN = tokens[0]
+            get_distances = get_all_ngram_distances
+        inv_dists_to_next_true_date = get_distances(len(tokens), true_date_indices, 'PRE-DATE')
+        inv_dists_to_next_false_date = get_distances(len(tokens), false_date_indices, 'PRE-DATE')
+        inv_dists_to_prev_true_date = get_distances(len(tokens), true_date_indices, 'POST-DATE')
+        inv_dists_to_prev_false_date = get_distances(len(tokens), false_date_indices, 'POST-DATE')
+        
+        for i in xrange(len(tokens)):
+#           LOG.debug("Considering token %s" % tokens[i])
+            
+            # Skip date tokens
+#           if i not in (true_date_indices + false_date_indices):
 
-            if len(tokens) == 3:
-                note = ''
-            else:
-                note = tokens[3]
+            # Skip tokens that are or encompass date expressions
+            token = tokens[i]
+            if token is not None:
+            
+                keyword_id = keyword_ids.get(token)
+                if keyword_id is None:
+                    keyword_id = accumulator.get_keyword_id(token)
+        
+                inv_dist_to_next_true_date = inv_dists_to_next_true_date[i]
+#               LOG.debug("Inverse distance to next true date is %s" % inv_dist_to_next_true_date)
+                inv_dist_to_next_false_date = inv_dists_to_next_false_date[i]
+#               LOG.debug("Inverse distance to next false date is %s" % inv_dist_to_next_false_date)
                 
-            if not notes_dict.get(MRN):
-                notes_dict[MRN] = []
-            notes_dict[MRN].append(note)
+                if inv_dist_to_next_true_date > inv_dist_to_next_false_date:
+                    true_sums[PRE_DATE][keyword_id] += int(inv_dist_to_next_true_date * FIXED_POINT_SCALE)
+                    true_counts[PRE_DATE][keyword_id] += 1
+                elif inv_dist_to_next_false_date > inv_dist_to_next_true_date:
+                    false_sums[PRE_DATE][keyword_id] += int(inv_dist_to_next_false_date * FIXED_POINT_SCALE)
+                    false_counts[PRE_DATE][keyword_id] += 1
+                else:
+                    if inv_dist_to_next_false_date != 0:
+                        LOG.warning("Inverse distance to true and false dates are the same; skipping")
+                        num_ties += 1
+            
+                inv_dist_to_prev_true_date = inv_dists_to_prev_true_date[i]
+#               LOG.debug("Inverse distance to previous true date is %s" % inv_dist_to_prev_true_date)
+                inv_dist_to_prev_false_date = inv_dists_to_prev_false_date[i]
+#               LOG.debug("Inverse distance to previous false date is %s" % inv_dist_to_prev_false_date)
 
-    data_dict = {}
-    for line in data_file:
-        line = line.strip()
-        tokens = line.split('\t')
-        if len(tokens) < 2:
-            LOG.warning("Unexpected line format (should be MRN[tab]date ... ); skipping line: %s" % line)
-        else:
-            MRN = tokens[0]
-            for i in xrange(1, len(tokens)):
-#               LOG.debug("Trying to make date from: %s" % tokens[i])
-                date_vals = make_date(tokens[i])
-                if not date_vals:
-                    LOG.warning("Could not interpret date expression; skipping line: %s" % line)
+                if inv_dist_to_prev_true_date > inv_dist_to_prev_false_date:
+                    true_sums[POST_DATE][keyword_id] += int(inv_dist_to_prev_true_date * FIXED_POINT_SCALE)
+                    true_counts[POST_DATE][keyword_id] += 1
+                elif inv_dist_to_prev_false_date > inv_dist_to_prev_true_date:
+                    false_sums[POST_DATE][keyword_id] += int(inv_dist_to_prev_false_date * FIXED_POINT_SCALE)
+                    false_counts[POST_DATE][keyword_id] += 1
                 else:
-                    if data_dict.get(MRN) == None:
-                        data_dict[MRN] = []
-                    data_dict[MRN].extend(date_vals)
+                    if inv_dist_to_prev_false_date != 0:
+                        LOG.warning("Inverse distance to true and false dates are the same; skipping")
+                        num_ties += 1
 
-    data_file.close()
-    notes_file.close()
-    
-    LOG.info("Getting keyword queue")
-    keywords = get_keyword_queue(notes_dict, data_dict)
+    return num_ties
 
-    while not keywords.empty():
-        top = keywords.get()        
-        score, keyword_position = top
-        keyword, position = keyword_position
-        score = -1 * score
-        print keyword+'\t'+position+'\t'+str(score)
 
 
-    
-def get_keyword_queue(blobs_dict, gold_dates_dict):
+def add_token_window_distances(tokens, true_date_indices, false_date_indices, accumulator, window):
     '''
-    This method takes as input:
-    (1) a dictionary of MRNs mapped to lists of text blobs (corresponding to clinic notes for that patient), and
-    (2) a dictionary of MRNs mapped to lists of Date objects (corresponding to the gold dates for the event in question for that patient).
-    It then returns a priority queue of (keyword, position) tuples and their corresponding scores. (Scores returned are multiplied by -1 so that highest-scored keywords are returned first, since python's priority queue returns lowest-scored items first.)
+    This method takes as input the same arguments as add_token_distances() and a window size, and adds the inverse distances for the keywords in the note that are at most window tokens away from the closest date in each position to the accumulator. It returns the number of inverse distances it skipped because of ties (always 0, since no two dates share a token).
+    NB: Rather than visiting every token, this method visits only the window tokens before and after each date, so the work per note is proportional to the number of dates times the window size rather than to the length of the note. The inverse distances it adds are exactly those that add_token_distances() adds for distances of at most window tokens.
     '''
-    # In the following dictionaries:
-    # keys are (keyword, position) 2-tuples, where 'position' is the string 'PRE' or the string 'POST', depending on whether the n-gram appeared before or after the date
-    # values are lists of the inverse of the distance to the closest correct or incorrect date given the position
-    true_date_ngrams = defaultdict(lambda: [])
-    false_date_ngrams = defaultdict(lambda: [])
-
-    for MRN in gold_dates_dict:
-        gold_dates_list = gold_dates_dict[MRN]
- 
-        for blob in blobs_dict[MRN]:
-#           LOG.debug("\n")
-#           LOG.debug("Original text: %s" % blob)
-            tagged_text = tag_dates(blob, gold_dates_list)
-#           LOG.debug("Tagged text: %s" % tagged_text)
-            tokenized_text = custom_tokenize(tagged_text)
-            tokens = tokenized_text.split()
-#           LOG.debug("Tokenized text: %s" % tokens)
-            true_date_indices, false_date_indices = get_date_indices(tokens)
-             
-#           if (not true_date_indices) and (not false_date_indices):
-#               LOG.debug("No dates in this note; moving on to next note")
-             
-#           else:
-            if true_date_indices and false_date_indices:
-                
-                for i in xrange(len(tokens)):
-#                   LOG.debug("Considering token %s" % tokens[i])
-                    
-                    # Skip date tokens
-#                   if i not in (true_date_indices + false_date_indices):
-
-                    # Skip tokens that are or encompass replaced date expressions
-                    if not any(d in tokens[i] for d in ['TRUE_DATE', 'FALSE_DATE']):
-                    
-                        # Ignore case
-                        token = tokens[i].lower()
-                
-                        inv_dist_to_next_true_date = get_ngram_distances(i, true_date_indices, 'PRE-DATE')
-#                       LOG.debug("Inverse distance to next true date is %s" % inv_dist_to_next_true_date)
-                        inv_dist_to_next_false_date = get_ngram_distances(i, false_date_indices, 'PRE-DATE')
-#                       LOG.debug("Inverse distance to next false date is %s" % inv_dist_to_next_false_date)
-                        
-                        if inv_dist_to_next_true_date > inv_dist_to_next_false_date:
-                            true_date_ngrams[(token, 'PRE-DATE')].append(inv_dist_to_next_true_date)
-                        elif inv_dist_to_next_false_date > inv_dist_to_next_true_date:
-                            false_date_ngrams[(token, 'PRE-DATE')].append(inv_dist_to_next_false_date)
-                        else:
-                            if inv_dist_to_next_false_date != 0:
-                                LOG.warning("Inverse distance to true and false dates are the same; skipping")
-                    
-                        inv_dist_to_prev_true_date = get_ngram_distances(i, true_date_indices, 'POST-DATE')
-#                       LOG.debug("Inverse distance to previous true date is %s" % inv_dist_to_prev_true_date)
-                        inv_dist_to_prev_false_date = get_ngram_distances(i, false_date_indices, 'POST-DATE')
-#                       LOG.debug("Inverse distance to previous false date is %s" % inv_dist_to_prev_false_date)
-
-                        if inv_dist_to_prev_true_date > inv_dist_to_prev_false_date:
-                            true_date_ngrams[(token, 'POST-DATE')].append(inv_dist_to_prev_true_date)
-                        elif inv_dist_to_prev_false_date > inv_dist_to_prev_true_date:
-                            false_date_ngrams[(token, 'POST-DATE')].append(inv_dist_to_prev_false_date)
-                        else:
-                            if inv_dist_to_prev_false_date != 0:
-                                LOG.warning("Inverse distance to true and false dates are the same; skipping")
+    if true_date_indices and false_date_indices:
 
-    # Score the ngrams by taking the difference between the sum of their distances from false dates and the sum of their distances from true dates
-    # Store the ngrams by these scores in a priority queue
-    # Extremely negative score (i.e., popped first from queue) = high correlation
-    ngrams = Queue.PriorityQueue()
+        keyword_ids = accumulator.vocabulary.ids
+        true_sums = accumulator.true_sums
+        true_counts = accumulator.true_counts
+        false_sums = accumulator.false_sums
+        false_counts = accumulator.false_counts
 
-    for ngram in true_date_ngrams:
-        LOG.debug("Summing distances for ngram %s" % str(ngram))
-        
-        LOG.debug("True date distances: %s" % true_date_ngrams[ngram])
+        # Inverse distances in fixed point, by distance, computed exactly as in get_ngram_distances()
+        fixed_inv_dists = [0] + [int(dist**(-1) * FIXED_POINT_SCALE) for dist in xrange(1, window + 1)]
+
+        # The closest date in each position is the closest date of either kind, so each date is scored against the tokens between it and its neighboring dates
+        date_indices = sorted([(date_index, True) for date_index in true_date_indices] + [(date_index, False) for date_index in false_date_indices])
+        prev_date_index = -1
+        for k in xrange(len(date_indices)):
+            date_index, is_true_date = date_indices[k]
+            if k + 1 < len(date_indices):
+                next_date_index = date_indices[k+1][0]
+            else:
+                next_date_index = len(tokens)
+
+            if is_true_date:
+                sums, counts = true_sums, true_counts
+            else:
+                sums, counts = false_sums, false_counts
+
+            # Tokens before this date (and after the previous one) are PRE-DATE
+            for i in xrange(max(prev_date_index + 1, date_index - window), date_index):
+                token = tokens[i]
+                if token is not None:
+                    keyword_id = keyword_ids.get(token)
+                    if keyword_id is None:
+                        keyword_id = accumulator.get_keyword_id(token)
+                    sums[PRE_DATE][keyword_id] += fixed_inv_dists[date_index - i]
+                    counts[PRE_DATE][keyword_id] += 1
+
+            # Tokens after this date (and before the next one) are POST-DATE
+            for i in xrange(date_index + 1, min(next_date_index, date_index + window + 1)):
+                token = tokens[i]
+                if token is not None:
+                    keyword_id = keyword_ids.get(token)
+                    if keyword_id is None:
+                        keyword_id = accumulator.get_keyword_id(token)
+                    sums[POST_DATE][keyword_id] += fixed_inv_dists[i - date_index]
+                    counts[POST_DATE][keyword_id] += 1
+
+            prev_date_index = date_index
+
+    return 0
+
+
+def add_token_ngram_distances(tokens, true_date_indices, false_date_indices, accumulator):
+    '''
+    This method takes as input the same arguments as add_token_distances(), and adds the inverse distances for the keywords of up to accumulator.max_ngram_length words in the note to the accumulator. It returns the number of inverse distances it skipped because the closest true and false dates were equally close.
+    An n-gram is n consecutive tokens, none of which is (or encompasses) a date expression. Its distance to the next date is that of its last token, and its distance to the previous date is that of its first token, so for single keywords this is the same as add_token_distances().
+    NB: The IDs of the n-grams that end at each token are computed from the IDs of the (n-1)-grams that end at the token before it, so n-grams are looked up by integer keys rather than by tuples or strings of their words.
+    '''
+    num_ties = 0
+
+    if true_date_indices and false_date_indices:
+
+        keyword_ids = accumulator.vocabulary.ids
+        ngram_ids = accumulator.vocabulary.ngram_ids
+        keywords = accumulator.vocabulary.keywords
+        min_count = accumulator.ngram_min_count
+        max_length = accumulator.max_ngram_length
+        sketch = get_ngram_sketch() if (max_length > 1 and min_count > 1) else None
+        true_sums = accumulator.true_sums
+        true_counts = accumulator.true_counts
+        false_sums = accumulator.false_sums
+        false_counts = accumulator.false_counts
+
+        if distance_backend == 'numpy' and len(tokens) >= NUMPY_MIN_TOKENS:
+            get_distances = get_all_ngram_distances_numpy
+        else:
+            get_distances = get_all_ngram_distances
+        inv_dists_to_next_true_date = get_distances(len(tokens), true_date_indices, 'PRE-DATE', distance_window)
+        inv_dists_to_next_false_date = get_distances(len(tokens), false_date_indices, 'PRE-DATE', distance_window)
+        inv_dists_to_prev_true_date = get_distances(len(tokens), true_date_indices, 'POST-DATE', distance_window)
+        inv_dists_to_prev_false_date = get_distances(len(tokens), false_date_indices, 'POST-DATE', distance_window)
+
+        # prev_ids[k] is the ID of the (k+1)-gram that ends at the previous token (None if there is none, or if it has no room in the score tables yet)
+        no_ids = [None] * max_length
+        prev_ids = no_ids
+        for i in xrange(len(tokens)):
+            token = tokens[i]
+            if token is None:
+                prev_ids = no_ids
+                continue
+
+            keyword_id = keyword_ids.get(token)
+            if keyword_id is None:
+                keyword_id = accumulator.get_keyword_id(token)
+
+            ids = [keyword_id]
+            for k in xrange(1, max_length):
+                prefix_id = prev_ids[k-1]
+                ngram_id = None
+                if prefix_id is not None:
+                    key = get_ngram_key(prefix_id, keyword_id)
+                    ngram_id = ngram_ids.get(key)
+                    if ngram_id is None and (sketch is None or sketch.add(get_ngram_sketch_key(keywords[prefix_id], keywords[keyword_id])) >= min_count):
+                        ngram_id = accumulator.get_ngram_id(prefix_id, keyword_id)
+                ids.append(ngram_id)
+
+            inv_dist_to_next_true_date = inv_dists_to_next_true_date[i]
+            inv_dist_to_next_false_date = inv_dists_to_next_false_date[i]
+            for k in xrange(max_length):
+                ngram_id = ids[k]
+                if ngram_id is None:
+                    continue
+
+                # The n-gram runs from token i-k to token i
+                if inv_dist_to_next_true_date > inv_dist_to_next_false_date:
+                    true_sums[PRE_DATE][ngram_id] += int(inv_dist_to_next_true_date * FIXED_POINT_SCALE)
+                    true_counts[PRE_DATE][ngram_id] += 1
+                elif inv_dist_to_next_false_date > inv_dist_to_next_true_date:
+                    false_sums[PRE_DATE][ngram_id] += int(inv_dist_to_next_false_date * FIXED_POINT_SCALE)
+                    false_counts[PRE_DATE][ngram_id] += 1
+                elif inv_dist_to_next_false_date != 0:
+                    LOG.warning("Inverse distance to true and false dates are the same; skipping")
+                    num_ties += 1
 
-        # Optional normalization for false vs. true date frequency
-#       normalize_for_date_freq(true_date_ngrams[ngram])
-#       LOG.debug("True date distances after normalizing for true/false date frequency: %s" % true_date_ngrams[ngram])
+                inv_dist_to_prev_true_date = inv_dists_to_prev_true_date[i-k]
+                inv_dist_to_prev_false_date = inv_dists_to_prev_false_date[i-k]
+                if inv_dist_to_prev_true_date > inv_dist_to_prev_false_date:
+                    true_sums[POST_DATE][ngram_id] += int(inv_dist_to_prev_true_date * FIXED_POINT_SCALE)
+                    true_counts[POST_DATE][ngram_id] += 1
+                elif inv_dist_to_prev_false_date > inv_dist_to_prev_true_date:
+                    false_sums[POST_DATE][ngram_id] += int(inv_dist_to_prev_false_date * FIXED_POINT_SCALE)
+                    false_counts[POST_DATE][ngram_id] += 1
+                elif inv_dist_to_prev_false_date != 0:
+                    LOG.warning("Inverse distance to true and false dates are the same; skipping")
+                    num_ties += 1
 
-        LOG.debug("False date distances: %s" % false_date_ngrams[ngram])
+            prev_ids = ids
 
-        # Optional normalization for word frequency
-#       normalize_for_word_freq(true_date_ngrams[ngram], false_date_ngrams[ngram])
-#       LOG.debug("True date distances after normalizing for keyword frequency: %s" % true_date_ngrams[ngram])
-#       LOG.debug("False date distances after normalizing for keyword frequency: %s" % false_date_ngrams[ngram])
+    return num_ties
 
-        # Optional normalization for false vs. true date frequency
-#       normalize_for_date_freq(false_date_ngrams[ngram])
-#       LOG.debug("False date distances after normalizing for true/false date frequency: %s" % false_date_ngrams[ngram])
 
-        score = sum(false_date_ngrams[ngram]) - sum(true_date_ngrams[ngram])
-        LOG.debug("Score: %s" % score)
+def rank_keywords(accumulator, top=None, normalize_word_freq=False, normalize_date_freq=False, stats=None):
+    '''
+    This method takes as input an NgramAccumulator, (optionally) the number of top-scored keywords to return (all of them if None), (optionally) whether to normalize the scores (see get_score()), and (optionally) a PipelineStats object to add the time ranking takes to.
+    It then returns a list of (keyword, position, score) 3-tuples in descending order by score, in the same order in which they would be returned from the priority queue returned by make_keyword_queue() (ties are broken by keyword, then position).
+    NB: When 'top' is given, only the top-scored keywords are kept, in a heap of that size, rather than sorting them all.
+    '''
+    start = time.time()
+
+    # As in the priority queue, sort (score, (keyword, position)) 2-tuples in ascending order, where extremely negative score = high correlation
+    scores = accumulator.get_scores(normalize_word_freq, normalize_date_freq)
+    if top is None:
+        ranked = sorted(scores)
+    else:
+        ranked = heapq.nsmallest(top, scores)
+
+    to_return = [(keyword, position, -1 * score) for score, (keyword, position) in ranked]
+
+    if stats is not None:
+        stats.add_time('rank', time.time() - start)
+        stats.count('keywords_ranked', len(to_return))
+
+    return to_return
+
+
+def rank_keyword_variants(accumulator, variants=None, top=None, stats=None):
+    '''
+    This method takes as input an NgramAccumulator, (optionally) a list of the names of scoring variants (see SCORING_VARIANTS; all of them if None), (optionally) the number of top-scored keywords to return for each variant, and (optionally) a PipelineStats object to add the time ranking takes to.
+    It then returns a dictionary of the names of the variants mapped to the lists that rank_keywords() returns with each variant's normalizations.
+    NB: The sums of each keyword are read from the score tables once, and all the variants' scores are computed from them, so ranking by several variants costs little more than ranking by one.
+    '''
+    start = time.time()
+
+    if variants is None:
+        variants = SCORING_VARIANTS
+    normalizations = [SCORING_VARIANT_NORMALIZATIONS[variant] for variant in variants]
+
+    scores = [[] for variant in variants]
+    for ngram, true_sum, true_count, false_sum, false_count in accumulator.get_all_sums():
+        for variant_scores, (normalize_word_freq, normalize_date_freq) in izip(scores, normalizations):
+            variant_scores.append((get_score(true_sum, true_count, false_sum, false_count, normalize_word_freq, normalize_date_freq), ngram))
+
+    to_return = {}
+    for variant, variant_scores in izip(variants, scores):
+        if top is None:
+            variant_scores.sort()
+            ranked = variant_scores
+        else:
+            ranked = heapq.nsmallest(top, variant_scores)
+        to_return[variant] = [(keyword, position, -1 * score) for score, (keyword, position) in ranked]
+
+    if stats is not None:
+        stats.add_time('rank', time.time() - start)
+        if variants:
+            stats.count('keywords_ranked', len(to_return[variants[0]]))
+
+    return to_return
+
+
+def parse_scoring_variants(string):
+    '''
+    This method takes as input a comma-separated string of the names of scoring variants (see SCORING_VARIANTS), or 'all', and returns a list of the names, in the order given.
+    '''
+    if string.strip() == 'all':
+        return list(SCORING_VARIANTS)
+
+    variants = []
+    for variant in string.split(','):
+        variant = variant.strip()
+        if variant not in SCORING_VARIANT_NORMALIZATIONS:
+            raise ValueError("Unknown scoring variant: %s (should be one of %s, or 'all')" % (variant, ', '.join(SCORING_VARIANTS)))
+        if variant not in variants:
+            variants.append(variant)
+    return variants
+
+
+# Globals: Scoring variants
+# Each variant is named for the normalizations it applies: (normalize for keyword frequency, normalize for true vs. false date frequency) (see get_score())
+SCORING_VARIANTS = ('raw', 'word-freq', 'date-freq', 'both')
+SCORING_VARIANT_NORMALIZATIONS = {
+    'raw': (False, False),
+    'word-freq': (True, False),
+    'date-freq': (False, True),
+    'both': (True, True),
+}
+
+
+def make_keyword_queue(accumulator, normalize_word_freq=False, normalize_date_freq=False, stats=None):
+    '''
+    This method takes as input an NgramAccumulator, (optionally) whether to normalize the scores (see get_score()), and (optionally) a PipelineStats object to add the time ranking takes to, and returns a priority queue of (keyword, position) tuples and their corresponding scores (multiplied by -1).
+    '''
+    # Score the ngrams by taking the difference between the sum of their distances from false dates and the sum of their distances from true dates
+    # Store the ngrams by these scores in a priority queue
+    # Extremely negative score (i.e., popped first from queue) = high correlation
+    start = time.time()
+    ngrams = Queue.PriorityQueue()
+
+    for score, ngram in accumulator.get_scores(normalize_word_freq, normalize_date_freq):
+        LOG.debug("Score for ngram %s: %s", ngram, score)
         ngrams.put((score, ngram))
+
+    if stats is not None:
+        stats.add_time('rank', time.time() - start)
+        stats.count('keywords_ranked', ngrams.qsize())
     
     return ngrams
 
@@ -200,36 +1892,35 @@ def tag_dates(text, gold_dates):
     '''
     This method takes as input:
     (1) a text blob, and
-    (2) a list of Date objects corresponding to the gold dates for the specified event for the current patient.
+    (2) a list of Date objects (or a DateIndex of them) corresponding to the gold dates for the specified event for the current patient.
     It then returns the text blob with the date expressions corresponding to gold dates replaced with the string TRUE_DATE and those corresponding with other dates with the string FALSE_DATE.
     '''
+    if not isinstance(gold_dates, DateIndex):
+        gold_dates = DateIndex(gold_dates)
+
     # Get a list of (Date object, char index of start of date expression, char index of end of date expression) 3-tuples
     date_expressions = extract_dates_and_char_indices(text)
 
-    to_return = ''
+    # Collect the pieces of the tagged text and join them once at the end, rather than copying the text so far for every date expression
+    to_return = []
     text_start = 0
     i = 0
     
     while i < len(date_expressions):
         date_val, date_start, date_end = date_expressions[i]
-        to_return += text[text_start:date_start]
+        to_return.append(text[text_start:date_start])
 #       LOG.debug("Looking for %s in gold dates list" % date_val)
 
-        is_true_date = False
-        for gold_date in gold_dates:
-            if gold_date.is_fuzzy_match(date_val):
-                is_true_date = True
-
-        if is_true_date:
-            to_return += 'TRUE_DATE'
+        if gold_dates.has_fuzzy_match(date_val):
+            to_return.append('TRUE_DATE')
         else:
-            to_return += 'FALSE_DATE'
+            to_return.append('FALSE_DATE')
         text_start = date_end
         i += 1
     
-    to_return += text[text_start:]
+    to_return.append(text[text_start:])
 
-    return to_return
+    return ''.join(to_return)
 
 
 def custom_tokenize(text):
@@ -262,6 +1953,84 @@ def get_date_indices(token_list):
     return (true_date_indices, false_date_indices)
 
 
+def tokenize_with_dates(text, stats=None):
+    '''
+    This method takes as input a text blob (and, optionally, a PipelineStats object to count and time finding its date expressions in; see extract_dates_and_char_indices()) and returns a 3-tuple:
+    (1) a list of lowercased tokens, in which the tokens that are (or encompass) date expressions are None,
+    (2) a list of the token indices of the date expressions, and
+    (3) a list of the corresponding Date objects (see tag_tokenized_dates()).
+    The token indices are those of the tokens of custom_tokenize(tag_dates(text, gold_dates)).split(), and the other tokens are the same tokens, lowercased; but since the date expressions are replaced with a marker rather than with TRUE_DATE or FALSE_DATE, the tokens don't depend on the gold dates (so they can be cached; see build_notes_cache()).
+    It tokenizes a marked copy of the text: each date expression is replaced with a marker (see DATE_MARKER), the copy is tokenized with custom_tokenize() and split(), and the tokens are then walked once to lowercase them and to record the indices of the markers. (The copy is built once per note, rather than one per gold date, as tag_dates() would.)
+    NB: A date expression with no whitespace or punctuation on either side is glued to the neighbouring text, just as its TRUE_DATE or FALSE_DATE replacement would be, and the token is then skipped.
+    '''
+    date_expressions = extract_dates_and_char_indices(text, stats)
+
+    # The marker is made of letters, like TRUE_DATE and FALSE_DATE, so that custom_tokenize() splits the text around it in the same places; it is made longer until it doesn't occur in the text itself
+    marker = DATE_MARKER
+    while marker in text:
+        marker = 'X' + marker + 'X'
+
+    pieces = []
+    text_start = 0
+    for date_val, date_start, date_end in date_expressions:
+        pieces.append(text[text_start:date_start])
+        pieces.append(marker)
+        text_start = date_end
+    pieces.append(text[text_start:])
+
+    tokens = []
+    date_indices = []
+    dates = []
+    next_date = 0
+    for token in custom_tokenize(''.join(pieces)).split():
+        if marker in token:
+            if token == marker:
+                date_indices.append(len(tokens))
+                dates.append(date_expressions[next_date][0])
+            next_date += token.count(marker)
+            tokens.append(None)
+        elif 'TRUE_DATE' in token or 'FALSE_DATE' in token:
+            # The text itself contains a replacement string; it is treated as it would be in the output of tag_dates()
+            if token == 'TRUE_DATE' or token == 'FALSE_DATE':
+                date_indices.append(len(tokens))
+                dates.append(token)
+            tokens.append(None)
+        else:
+            tokens.append(token.lower())
+
+    return (tokens, date_indices, dates)
+
+
+# Stands in for date expressions in the text that tokenize_with_dates() tokenizes
+DATE_MARKER = 'XDATEX'
+
+
+def tag_tokenized_dates(date_indices, dates, gold_dates):
+    '''
+    This method takes as input:
+    (1) a list of the token indices of date expressions and (2) a list of the corresponding Date objects, as returned by tokenize_with_dates(), and
+    (3) a list of Date objects (or a DateIndex of them) corresponding to the gold dates for the specified event for the current patient.
+    It then returns the same two lists as get_date_indices(): the token indices of the date expressions corresponding to gold dates (TRUE_DATE tokens), and those of other dates (FALSE_DATE tokens).
+    '''
+    if not isinstance(gold_dates, DateIndex):
+        gold_dates = DateIndex(gold_dates)
+
+    true_date_indices = []
+    false_date_indices = []
+
+    for i, date_val in zip(date_indices, dates):
+        if isinstance(date_val, str):
+            is_true_date = (date_val == 'TRUE_DATE')
+        else:
+            is_true_date = gold_dates.has_fuzzy_match(date_val)
+        if is_true_date:
+            true_date_indices.append(i)
+        else:
+            false_date_indices.append(i)
+
+    return (true_date_indices, false_date_indices)
+
+
 def get_ngram_distances(token_index, date_indices, token_position):
     '''
     This method takes as input:
@@ -293,6 +2062,200 @@ def get_ngram_distances(token_index, date_indices, token_position):
     return inv_dist_to_next_date
 
 
+def get_all_ngram_distances(num_tokens, date_indices, token_position, window=None):
+    '''
+    This method takes as input:
+    1) the number of tokens in the document,
+    2) a sorted list of indices of TRUE_DATE or FALSE_DATE tokens in the document,
+    3) a string, either 'PRE-DATE' or 'POST-DATE', corresponding to the position of the tokens with respect to the dates we'd like to consider, and
+    4) (optionally) a window size.
+    It then returns a list containing, for each token index, the same inverse distance that get_ngram_distances() returns for that index (0 if no date in the desired position, or if the closest one is more than window tokens away).
+    NB: Rather than scanning every date for every token, this method sweeps the token list once (backward for 'PRE-DATE', forward for 'POST-DATE'), keeping track of the closest date seen so far.
+    '''
+    inv_dists = [0] * num_tokens
+
+    if token_position == 'PRE-DATE':
+        # Walk backward so that the closest following date is always the last one passed
+        j = len(date_indices) - 1
+        next_date_index = None
+        for token_index in xrange(num_tokens - 1, -1, -1):
+            while j >= 0 and date_indices[j] > token_index:
+                next_date_index = date_indices[j]
+                j -= 1
+            if next_date_index is not None and (window is None or next_date_index - token_index <= window):
+                # NB: The inverse distance is computed exactly as in get_ngram_distances() so that the inverse distances are identical
+                inv_dists[token_index] = (next_date_index - token_index)**(-1)
+
+    elif token_position == 'POST-DATE':
+        # Walk forward so that the closest preceding date is always the last one passed
+        j = 0
+        prev_date_index = None
+        for token_index in xrange(num_tokens):
+            while j < len(date_indices) and date_indices[j] < token_index:
+                prev_date_index = date_indices[j]
+                j += 1
+            if prev_date_index is not None and (window is None or token_index - prev_date_index <= window):
+                inv_dists[token_index] = (token_index - prev_date_index)**(-1)
+
+    else:
+        LOG.warning("Token position must be 'PRE-DATE' or 'POST-DATE'; setting distances to 0")
+
+    return inv_dists
+
+
+def get_all_ngram_distances_numpy(num_tokens, date_indices, token_position, window=None):
+    '''
+    This method takes the same input and returns the same list as get_all_ngram_distances(), but computes the inverse distances for all the tokens at once with NumPy: the closest date in the desired position is found for every token with numpy.searchsorted().
+    '''
+    # If no {true, false} dates in the document, every inverse distance is 0
+    if len(date_indices) == 0:
+        return [0] * num_tokens
+
+    token_indices = numpy.arange(num_tokens)
+    date_indices = numpy.asarray(date_indices, dtype=token_indices.dtype)
+
+    if token_position == 'PRE-DATE':
+        # Index of the first date after each token
+        closest = numpy.searchsorted(date_indices, token_indices, side='right')
+        has_date = closest < len(date_indices)
+        dists = date_indices[numpy.minimum(closest, len(date_indices) - 1)] - token_indices
+
+    elif token_position == 'POST-DATE':
+        # Index of the last date before each token
+        closest = numpy.searchsorted(date_indices, token_indices, side='left') - 1
+        has_date = closest >= 0
+        dists = token_indices - date_indices[numpy.maximum(closest, 0)]
+
+    else:
+        LOG.warning("Token position must be 'PRE-DATE' or 'POST-DATE'; setting distances to 0")
+        return [0] * num_tokens
+
+    if window is not None:
+        has_date &= dists <= window
+
+    # NB: numpy.power() computes the inverse distances exactly as get_ngram_distances() does, so they are identical (numpy.reciprocal() can differ in the last bit)
+    # Distances for tokens with no date in the desired position are set to 1 here and to infinity (inverse distance 0) below
+    dists[~has_date] = 1
+    inv_dists = numpy.power(dists.astype(numpy.float64), -1.0)
+    inv_dists[~has_date] = 0
+    return inv_dists.tolist()
+
+
+def set_distance_backend(backend):
+    '''
+    This method takes as input the name of the backend to compute inverse distances to dates with: 'numpy' (which requires NumPy, and is only used for notes with at least NUMPY_MIN_TOKENS tokens) or 'python'.
+    '''
+    global distance_backend
+    if backend not in DISTANCE_BACKENDS:
+        raise ValueError("Distance backend must be one of %s" % ', '.join(DISTANCE_BACKENDS))
+    if backend == 'numpy' and numpy is None:
+        raise ValueError("The 'numpy' distance backend requires NumPy")
+    distance_backend = backend
+
+
+# Globals: Distance Backends
+# The NumPy backend is selected automatically when NumPy is installed
+# For short notes, the cost of converting to and from arrays outweighs the speedup, so they are always handled in pure python
+DISTANCE_BACKENDS = ('python', 'numpy')
+distance_backend = 'numpy' if numpy is not None else 'python'
+NUMPY_MIN_TOKENS = 200
+
+
+class NgramSketch(object):
+    '''
+    An NgramSketch object estimates how many times each n-gram has been seen in a fixed amount of memory (a count-min sketch with conservative update): each n-gram key is counted in one cell of each of several rows of counters, and its estimate is the smallest of those counts. Estimates are never too low, and are only too high when other n-grams share all of the n-gram's cells.
+    '''
+    DEPTH = 4
+
+    # Odd 61-bit multipliers, one per row, for hashing n-gram keys to cells
+    MULTIPLIERS = (0x1e3779b97f4a7c15, 0x0bf58476d1ce4e5b, 0x14d049bb133111eb, 0x1ba2c3c1a4e2b9f1)
+
+    def __init__(self, width):
+        self.width = width
+        self.rows = [array('l', [0]) * width for i in xrange(self.DEPTH)]
+
+
+    def add(self, key):
+        '''
+        This method takes as input an integer n-gram key, counts it once more, and returns the estimate of the number of times it has been seen (including this one).
+        '''
+        cells = [((key * multiplier) >> 17) % self.width for multiplier in self.MULTIPLIERS]
+        count = min(row[cell] for row, cell in zip(self.rows, cells)) + 1
+        for row, cell in zip(self.rows, cells):
+            if row[cell] < count:
+                row[cell] = count
+        return count
+
+
+def set_max_ngram_length(length):
+    '''
+    This method takes as input the largest number of words in a keyword (1 to MAX_NGRAM_LENGTH); keywords of 1 up to that many words are then scored.
+    '''
+    global max_ngram_length
+    if not 1 <= length <= MAX_NGRAM_LENGTH:
+        raise ValueError("N-gram length must be between 1 and %s" % MAX_NGRAM_LENGTH)
+    max_ngram_length = length
+
+
+def set_ngram_min_count(min_count, sketch_width=None):
+    '''
+    This method takes as input a number of times, and (optionally) the number of counters in each row of the NgramSketch, and bounds the memory that n-grams of more than one word take: each accumulator only makes room in its score tables for an n-gram once it has seen the n-gram (about) that many times, and the occurrences before then are not scored. A min_count of 0 or 1 scores every n-gram exactly.
+    NB: The scores of the n-grams that are kept are then approximate. With more than one process, each worker process counts the n-grams of its own batches of patients (see get_ngram_sketch()).
+    '''
+    global ngram_min_count, ngram_sketch_width
+    if min_count < 0:
+        raise ValueError("N-gram minimum count can't be negative")
+    if sketch_width is not None:
+        if sketch_width < 1:
+            raise ValueError("N-gram sketch width must be positive")
+        ngram_sketch_width = sketch_width
+    ngram_min_count = min_count
+    reset_ngram_sketch()
+
+
+def get_ngram_sketch():
+    '''
+    This method returns the NgramSketch that counts n-grams for ngram_min_count (see set_ngram_min_count()) in this process, making it the first time it is needed. There is one sketch per process, shared by all the accumulators that count n-grams in it, so memory doesn't grow with the number of accumulators.
+    '''
+    global ngram_sketch
+    if ngram_sketch is None:
+        ngram_sketch = NgramSketch(ngram_sketch_width)
+    return ngram_sketch
+
+
+def reset_ngram_sketch():
+    '''
+    This method drops the process's NgramSketch (see get_ngram_sketch()), so that n-grams are counted from scratch from then on.
+    '''
+    global ngram_sketch
+    ngram_sketch = None
+
+
+def set_distance_window(window):
+    '''
+    This method takes as input a number of tokens (or None), and sets the largest distance between a keyword and a date for which the keyword is scored: keywords farther than that from the closest date in a position get no score in that position, and only the tokens that close to a date are visited at all (see add_token_window_distances()). None (the default) scores every token.
+    '''
+    global distance_window
+    if window is not None and window < 1:
+        raise ValueError("Distance window must be at least 1 token")
+    distance_window = window
+
+
+# Globals: Distance window
+distance_window = None
+
+
+# Globals: N-grams
+# By default only single keywords are scored, and n-grams are counted exactly
+MAX_NGRAM_LENGTH = 4
+max_ngram_length = 1
+ngram_min_count = 0
+ngram_sketch_width = 2 ** 20
+ngram_sketch = None
+# Odd 64-bit multiplier that combines the hashes of an n-gram's prefix and last keyword (see get_ngram_sketch_key())
+NGRAM_SKETCH_KEY_MULTIPLIER = 0x9e3779b97f4a7c15
+
+
 def normalize_for_word_freq_old(dist_list):
     '''
     This method takes a list of inverse distances to either TRUE_DATE or FALSE_DATE tokens and normalizes them to account for the relative frequency of the keyword. This method will not work with the current code, since only the inverse distance to the closest TRUE OR FALSE date is added to the appropriate list; it was intended for use with an older version, when the inverse distance to the closest TRUE date AND the closest FALSE date was added.
@@ -0,0 +1,277 @@
+#!/usr/bin/python
+
+'''
+This script takes as input:
+1) a path to a keyword file, in the format extract_keywords.py prints (keyword[tab]position[tab]score),
+2) a path to the notes file, where each line corresponds with a note and takes the format MRN[tab]date[tab]description[tab]text blob, and
+3) (optionally) a path to the gold data file, where each line corresponds with a patient and takes the format MRN[tab]gold_date_1[tab]gold_date_2 ...
+
+It then infers the date of the event for each patient from the patient's notes: every date expression within a window of characters after an occurrence of a PRE-DATE keyword, or before an occurrence of a POST-DATE keyword, gets a vote weighted by the keyword's score, and the date with the most votes over all the patient's notes is the patient's event date. It prints lines in the following format:
+MRN[tab]event_date
+
+...where event_date takes the format YYYY, MM-YYYY, or YYYY-MM-DD, as Date.make_date_expression() makes it (empty if no date got a vote). If a gold data file is given, only the patients in it are scored, and the fraction of them whose event date is a fuzzy match for one of their gold dates (see Date.is_fuzzy_match()) is logged.
+
+The keywords are found in each note in one pass with an Aho-Corasick automaton over the words of all of them (see KeywordAutomaton), rather than by searching the note for each keyword in turn, so the time it takes hardly depends on the number of keywords.
+
+Command line usage: ./infer_dates.py [options] <keyword-file> <note-file> [<gold-data-file>]
+'''
+
+import argparse
+import logging
+import re
+from bisect import bisect_left
+from bisect import bisect_right
+from collections import deque
+from sys import stdout
+from date import *
+from extract_keywords import open_input, read_gold_dates, read_notes
+
+LOG = logging.getLogger(__name__)
+LOG.setLevel(logging.WARNING)
+
+
+def main():
+    logging.basicConfig()
+
+    parser = argparse.ArgumentParser(description="Infer the date of the event for each patient from the keywords extract_keywords.py prints.")
+    parser.add_argument('keywords_filename', help="keyword file (keyword[tab]position[tab]score), as printed by extract_keywords.py")
+    parser.add_argument('notes_filename', help="notes file (MRN[tab]date[tab]description[tab]text blob)")
+    parser.add_argument('data_filename', nargs='?', help="gold data file (MRN[tab]gold_date_1[tab]gold_date_2 ...); if given, only its patients are scored, and the accuracy of the event dates is logged")
+    parser.add_argument('--window', type=int, default=DEFAULT_WINDOW, metavar='C', help="largest number of characters between a keyword and a date it votes for (default: %s)" % DEFAULT_WINDOW)
+    parser.add_argument('--top', type=int, metavar='K', help="only use the K highest-scored keywords")
+    args = parser.parse_args()
+
+    if args.window < 0:
+        parser.error("--window can't be negative")
+    if args.top is not None and args.top < 0:
+        parser.error("--top can't be negative")
+
+    keywords_file = open_input(args.keywords_filename)
+    keywords = read_keywords(keywords_file, args.top)
+    keywords_file.close()
+
+    gold_dates_dict = None
+    if args.data_filename:
+        data_file = open_input(args.data_filename)
+        gold_dates_dict = read_gold_dates(data_file)
+        data_file.close()
+
+    inferrer = DateInferrer(keywords, args.window)
+
+    notes_file = open_input(args.notes_filename)
+    blobs_dict = {}
+    for MRN, note in read_notes(notes_file):
+        if gold_dates_dict is None or MRN in gold_dates_dict:
+            blobs_dict.setdefault(MRN, []).append(note)
+    notes_file.close()
+
+    event_dates = inferrer.infer_event_dates(blobs_dict)
+    for MRN in sorted(event_dates):
+        event_date = event_dates[MRN]
+        stdout.write(MRN + '\t' + (event_date.make_date_expression() if event_date is not None else '') + '\n')
+
+    if gold_dates_dict is not None:
+        num_correct = get_num_correct(event_dates, gold_dates_dict)
+        LOG.warning("%s of %s patients' event dates match a gold date (%.3f)" % (num_correct, len(gold_dates_dict), num_correct / float(max(len(gold_dates_dict), 1))))
+
+
+def read_keywords(keywords_file, top=None):
+    '''
+    This method takes as input an open keyword file, where each line takes the format keyword[tab]position[tab]score (as printed by extract_keywords.py), and (optionally) a number K, and returns a list of (keyword, position, score) 3-tuples for the keywords with positive scores (only the first K lines of the file, if K is given).
+    NB: Keywords with scores of 0 or less are closer to other dates than to gold dates, so they are left out.
+    '''
+    keywords = []
+    for i, line in enumerate(keywords_file):
+        if top is not None and i >= top:
+            break
+        tokens = line.rstrip('\r\n').split('\t')
+        if len(tokens) != 3 or tokens[1] not in ('PRE-DATE', 'POST-DATE'):
+            LOG.warning("Unexpected line format (should be keyword[tab]position[tab]score); skipping line: %s" % line.strip())
+            continue
+        try:
+            score = float(tokens[2])
+        except ValueError:
+            LOG.warning("Could not read score; skipping line: %s" % line.strip())
+            continue
+        if score > 0:
+            keywords.append((tokens[0], tokens[1], score))
+    return keywords
+
+
+class KeywordAutomaton(object):
+    '''
+    A KeywordAutomaton object is an Aho-Corasick automaton over a list of keywords, which finds all the occurrences of all the keywords in a text in one pass over the text.
+    The automaton runs over the words of the text (the runs of letters, digits and underscores in it, found by WORD_REGEX) rather than over its characters, so a keyword is only found as whole words, and the words of a keyword of more than one word (e.g. 'follow up', or '2/3') may be separated by any other characters in the text. Keywords are split into words the same way.
+    State 0 is the root; 'transitions' holds a dictionary of the next state for each word out of each state, 'failures' the state to fall back to when a word has no transition, and 'outputs' the (keyword index, number of words) 2-tuples of the keywords that end at each state (including those that end at the states it falls back to).
+    '''
+    def __init__(self, keywords):
+        self.keywords = list(keywords)
+        self.transitions = [{}]
+        self.failures = [0]
+        self.outputs = [()]
+
+        # Build the trie of the keywords' words
+        for keyword_index, keyword in enumerate(self.keywords):
+            words = WORD_REGEX.findall(keyword)
+            if not words:
+                LOG.warning("Keyword has no letters or digits; skipping keyword: %s" % keyword)
+                continue
+            state = 0
+            for word in words:
+                next_state = self.transitions[state].get(word)
+                if next_state is None:
+                    next_state = len(self.transitions)
+                    self.transitions.append({})
+                    self.failures.append(0)
+                    self.outputs.append(())
+                    self.transitions[state][word] = next_state
+                state = next_state
+            self.outputs[state] += ((keyword_index, len(words)),)
+
+        # Add the failure links, breadth first, so that each state's failure state is done before its own
+        queue = deque(self.transitions[0].itervalues())
+        while queue:
+            state = queue.popleft()
+            for word, next_state in self.transitions[state].iteritems():
+                queue.append(next_state)
+                failure = self.failures[state]
+                while failure and word not in self.transitions[failure]:
+                    failure = self.failures[failure]
+                failure = self.transitions[failure].get(word, 0)
+                self.failures[next_state] = failure
+                self.outputs[next_state] += self.outputs[failure]
+
+
+    def find_all(self, text):
+        '''
+        This method takes as input a (lowercased) text and returns a list of (start index, end index, keyword index) 3-tuples, one for each occurrence of a keyword in the text, in order of their end indices (and longest first, for occurrences that end at the same index).
+        '''
+        transitions = self.transitions
+        failures = self.failures
+        outputs = self.outputs
+
+        hits = []
+        # Start indices of the words seen so far, for the start indices of keywords of more than one word
+        word_starts = []
+        state = 0
+        for match in WORD_REGEX.finditer(text):
+            word_starts.append(match.start())
+            word = match.group()
+            next_state = transitions[state].get(word)
+            while next_state is None and state:
+                state = failures[state]
+                next_state = transitions[state].get(word)
+            state = next_state or 0
+
+            if outputs[state]:
+                end = match.end()
+                for keyword_index, num_words in outputs[state]:
+                    hits.append((word_starts[-num_words], end, keyword_index))
+
+        return hits
+
+
+# Keywords are found as whole words, since extract_keywords.py only scores whole tokens
+WORD_REGEX = re.compile(r'[a-z0-9_]+')
+
+
+class DateInferrer(object):
+    '''
+    A DateInferrer object infers the dates of the event for patients from the keywords extract_keywords.py prints for the event (see read_keywords()): each date expression within 'window' characters after an occurrence of a PRE-DATE keyword, or before an occurrence of a POST-DATE keyword, gets a vote of the keyword's score.
+    NB: Keywords are found in the lowercased text, since extract_keywords.py lowercases them (see KeywordAutomaton).
+    '''
+    def __init__(self, keywords, window=None):
+        if window is None:
+            window = DEFAULT_WINDOW
+        self.window = window
+
+        # Each keyword's scores in the PRE-DATE and POST-DATE positions (0 if it isn't scored in that position)
+        scores = {}
+        for keyword, position, score in keywords:
+            pre_score, post_score = scores.get(keyword, (0.0, 0.0))
+            if position == 'PRE-DATE':
+                pre_score = score
+            else:
+                post_score = score
+            scores[keyword] = (pre_score, post_score)
+
+        self.automaton = KeywordAutomaton(sorted(scores))
+        self.scores = [scores[keyword] for keyword in self.automaton.keywords]
+
+
+    def add_votes(self, text, votes):
+        '''
+        This method takes as input the text of a note and a dictionary of Date objects mapped to their votes, and adds the votes of the keywords in the note to the dictionary. It returns the number of keyword occurrences found.
+        '''
+        hits = self.automaton.find_all(text.lower())
+        if not hits:
+            return 0
+
+        # Expressions of impossible dates (e.g., Feb. 30) make Dates with no datetime, which can't be event dates
+        dates = [date_and_indices for date_and_indices in extract_dates_and_char_indices(text) if date_and_indices[0].dt is not None]
+        if not dates:
+            return len(hits)
+
+        # Date expressions don't overlap, so their start and end indices are in the same order
+        starts = [date_start for date_val, date_start, date_end in dates]
+        ends = [date_end for date_val, date_start, date_end in dates]
+        window = self.window
+        scores = self.scores
+
+        for hit_start, hit_end, keyword_index in hits:
+            pre_score, post_score = scores[keyword_index]
+
+            # Dates that start at most 'window' characters after the keyword ends
+            if pre_score:
+                for i in xrange(bisect_left(starts, hit_end), bisect_right(starts, hit_end + window)):
+                    date_val = dates[i][0]
+                    votes[date_val] = votes.get(date_val, 0.0) + pre_score
+
+            # Dates that end at most 'window' characters before the keyword starts
+            if post_score:
+                for i in xrange(bisect_left(ends, hit_start - window), bisect_right(ends, hit_start)):
+                    date_val = dates[i][0]
+                    votes[date_val] = votes.get(date_val, 0.0) + post_score
+
+        return len(hits)
+
+
+    def infer_event_date(self, blobs):
+        '''
+        This method takes as input a list of text blobs (corresponding to clinic notes for one patient) and returns the Date with the most votes in them (see add_votes()), or None if no date got a vote.
+        NB: Ties are broken in favor of the earliest date, and then of the most precise one, so that the result doesn't depend on the order of the notes.
+        '''
+        votes = {}
+        for blob in blobs:
+            self.add_votes(blob, votes)
+        if not votes:
+            return None
+        return min(votes, key=lambda date_val: (-votes[date_val], date_val.dt, not date_val.month_known, not date_val.day_known))
+
+
+    def infer_event_dates(self, blobs_dict):
+        '''
+        This method takes as input a dictionary of MRNs mapped to lists of text blobs (corresponding to clinic notes for that patient), and returns a dictionary of the MRNs mapped to their event dates (see infer_event_date()).
+        '''
+        return dict((MRN, self.infer_event_date(blobs)) for MRN, blobs in blobs_dict.iteritems())
+
+
+def get_num_correct(event_dates, gold_dates_dict):
+    '''
+    This method takes as input a dictionary of MRNs mapped to event dates (see DateInferrer.infer_event_dates()) and a dictionary of MRNs mapped to lists of gold Date objects, and returns the number of patients in the gold dates dictionary whose event date is a fuzzy match for one of their gold dates.
+    '''
+    num_correct = 0
+    for MRN, gold_dates in gold_dates_dict.iteritems():
+        event_date = event_dates.get(MRN)
+        if event_date is not None and DateIndex(gold_dates).has_fuzzy_match(event_date):
+            num_correct += 1
+    return num_correct
+
+
+# Globals: Window
+# The default window is about 15 words on either side of each keyword
+DEFAULT_WINDOW = 100
+
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,376 @@
+#!/usr/bin/python
+
+'''
+This script runs a long-running local HTTP service that scores patients' notes and infers their event dates on demand, so that each request doesn't pay for starting the interpreter, importing and compiling the date grammar, and loading a keyword model. The compiled date grammar, the date expression cache (see date.set_date_cache_size()), the keyword model (if one is given) and the keyword automaton for inferring dates (see infer_dates.py) are all kept in memory between requests.
+
+It takes as input (all optional):
+1) a path to a keyword model saved by extract_keywords.py --model, whose patients' contributions are returned without scoring them again when their notes and gold dates haven't changed, and whose keywords are used to infer dates if no keyword file is given, and
+2) a path to a keyword file, in the format extract_keywords.py prints (keyword[tab]position[tab]score), whose keywords are used to infer dates.
+
+It then serves the following requests, which take and return JSON objects:
+POST /contribution: {"patients": [{"mrn": MRN, "notes": [text blob, ...], "gold_dates": [date expression, ...]}, ...], "top": K}
+    Returns {"patients": [{"mrn": MRN, "keywords": [[keyword, position, score], ...], "from_model": true|false}, ...]}, where 'keywords' is the ranking of the keywords by each patient's contribution to the scores alone (only the top K, if K is given).
+POST /predict: {"patients": [{"mrn": MRN, "notes": [text blob, ...]}, ...]}
+    Returns {"patients": [{"mrn": MRN, "date": event date or null}, ...]}, where each event date takes the format YYYY, MM-YYYY, or YYYY-MM-DD (see infer_dates.DateInferrer).
+GET /metrics
+    Returns the number of requests, errors and patients, and the mean, median, 90th and 99th percentile and largest latencies (in milliseconds, over the most recent requests) of each kind of request, as well as the uptime, the number of patients in the model, and the date expression cache's counts.
+
+Each request can carry any number of patients. Requests are read, parsed, scored and answered concurrently, each in its own thread: the keyword model and the keyword automaton are never changed while requests use them (new keywords replace the DateInferrer as a whole), and the date expression cache the threads share has its own lock (see date.DateCache). With --workers N, the patients of /contribution requests are scored in batches in a pool of N worker processes, forked when the service starts (so they share its compiled date grammar), so that the scoring isn't limited to one CPU by the GIL.
+
+Command line usage: ./keyword_server.py [options]
+'''
+
+import argparse
+import json
+import logging
+import multiprocessing
+import threading
+import time
+# datetime.strptime() imports _strptime the first time it is called, which isn't thread-safe in python 2, so import it before any request thread calls it
+import _strptime
+from BaseHTTPServer import BaseHTTPRequestHandler
+from BaseHTTPServer import HTTPServer
+from collections import deque
+from SocketServer import ThreadingMixIn
+from date import *
+from extract_keywords import *
+from infer_dates import DateInferrer, read_keywords, DEFAULT_WINDOW
+
+LOG = logging.getLogger(__name__)
+LOG.setLevel(logging.WARNING)
+
+
+def main():
+    logging.basicConfig()
+
+    parser = argparse.ArgumentParser(description="Serve keyword contributions and event date predictions for patients' notes over HTTP on this machine.")
+    parser.add_argument('--host', default=DEFAULT_HOST, help="address to listen on (default: %s)" % DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help="port to listen on (default: %s)" % DEFAULT_PORT)
+    parser.add_argument('--model', metavar='FILE', help="keyword model saved by extract_keywords.py --model, to keep in memory")
+    parser.add_argument('--keywords', metavar='FILE', help="keyword file (keyword[tab]position[tab]score) to infer event dates from (default: the keywords of the model)")
+    parser.add_argument('--top', type=int, metavar='K', help="only infer event dates from the K highest-scored keywords")
+    parser.add_argument('--window', type=int, default=DEFAULT_WINDOW, metavar='C', help="largest number of characters between a keyword and a date it votes for (default: %s)" % DEFAULT_WINDOW)
+    parser.add_argument('--workers', type=int, default=1, help="number of processes to score patients in (default: 1)")
+    parser.add_argument('--ngrams', type=int, default=1, metavar='N', help="without --model, score keywords of 1 to N words (default: 1)")
+    parser.add_argument('--distance-window', type=int, metavar='W', help="without --model, only score keywords at most W tokens away from the closest date (default: score every token)")
+    args = parser.parse_args()
+
+    if args.window < 0:
+        parser.error("--window can't be negative")
+    if args.top is not None and args.top < 0:
+        parser.error("--top can't be negative")
+
+    model = None
+    if args.model:
+        try:
+            model = load_keyword_model(args.model)
+        except (IOError, ValueError) as e:
+            parser.error(str(e))
+
+    try:
+        service = KeywordService(model, args.ngrams, args.distance_window, args.workers)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.keywords:
+        keywords_file = open_input(args.keywords)
+        keywords = read_keywords(keywords_file, args.top)
+        keywords_file.close()
+    elif model is not None:
+        keywords = [(keyword, position, score) for keyword, position, score in rank_keywords(model.accumulator, args.top) if score > 0]
+    else:
+        keywords = None
+    if keywords is not None:
+        service.set_keywords(keywords, args.window)
+
+    server = KeywordServer((args.host, args.port), service)
+    LOG.warning("Serving on http://%s:%s/" % server.server_address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+class KeywordService(object):
+    '''
+    A KeywordService object answers the requests of the keyword server (see KeywordRequestHandler): it keeps the keyword model (or None), the DateInferrer of the keywords to infer dates from (or None), the pool of worker processes (or None), and the latency metrics of the requests.
+    NB: The scoring options of a model (see extract_keywords.set_max_ngram_length() and set_distance_window()) are those it was built with, so that the contributions the service scores can be compared with the ones in the model.
+    '''
+    def __init__(self, model=None, ngrams=1, window=None, workers=1):
+        self.model = model
+        if model is not None:
+            ngrams = getattr(model, 'max_ngram_length', 1)
+            window = getattr(model, 'distance_window', None)
+        set_max_ngram_length(ngrams)
+        set_distance_window(window)
+
+        self.inferrer = None
+        self.metrics = LatencyMetrics()
+        self.started = time.time()
+
+        # Held only while the service's state (the keywords to infer dates from) is replaced, never while requests are scored
+        self.lock = threading.Lock()
+
+        # Forked now, so that the workers have the scoring options set above
+        self.pool = None
+        if workers > 1:
+            self.pool = multiprocessing.Pool(workers)
+
+
+    def set_keywords(self, keywords, window=None):
+        '''
+        This method takes as input a list of (keyword, position, score) 3-tuples (see infer_dates.read_keywords()) and (optionally) a window in characters, and infers event dates from those keywords from then on.
+        '''
+        inferrer = DateInferrer(keywords, window)
+        with self.lock:
+            self.inferrer = inferrer
+
+
+    def get_contributions(self, patients, top=None):
+        '''
+        This method takes as input a list of (MRN, list of text blobs, list of gold date expressions) 3-tuples and (optionally) a number K, and returns a list of (MRN, keyword list, whether the contribution was the model's) 3-tuples in the same order, where each keyword list is the list of (keyword, position, score) 3-tuples of the ranking of the keywords by that patient's contribution alone (only the top K, if K is given).
+        NB: The contributions of patients in the model whose notes and gold dates haven't changed are taken from the model rather than scored again.
+        '''
+        patients = [(MRN, blobs, make_gold_dates(expressions)) for MRN, blobs, expressions in patients]
+
+        accumulators = [None] * len(patients)
+        if self.model is not None:
+            for i, (MRN, blobs, gold_dates) in enumerate(patients):
+                contribution = self.model.contributions.get(MRN)
+                if contribution is not None and contribution[0] == get_patient_fingerprint(blobs, gold_dates):
+                    accumulators[i] = contribution[1]
+
+        unscored = [i for i, accumulator in enumerate(accumulators) if accumulator is None]
+        if unscored:
+            unscored_patients = [patients[i][1:] for i in unscored]
+            if self.pool is not None:
+                scored = []
+                for batch_accumulators in self.pool.map(get_patient_ngram_accumulators_for_batch, list(get_batches(unscored_patients, PATIENTS_PER_BATCH))):
+                    scored.extend(batch_accumulators)
+            else:
+                scored = list(get_patient_ngram_accumulators(unscored_patients))
+            for i, accumulator in izip(unscored, scored):
+                accumulators[i] = accumulator
+
+        unscored = set(unscored)
+        return [(MRN, rank_keywords(accumulator, top), i not in unscored) for i, ((MRN, blobs, gold_dates), accumulator) in enumerate(izip(patients, accumulators))]
+
+
+    def get_event_dates(self, patients):
+        '''
+        This method takes as input a list of (MRN, list of text blobs) 2-tuples, and returns a list of (MRN, event Date or None) 2-tuples in the same order (see infer_dates.DateInferrer.infer_event_date()).
+        '''
+        # The whole request uses the same keywords, even if they are replaced while it is answered
+        inferrer = self.inferrer
+        if inferrer is None:
+            raise ValueError("No keywords to infer event dates from (start the server with --keywords or --model)")
+        return [(MRN, inferrer.infer_event_date(blobs)) for MRN, blobs in patients]
+
+
+    def get_report(self):
+        '''
+        This method returns a dictionary of the latency metrics of the requests (see LatencyMetrics.get_report()), the uptime in seconds, the number of patients in the model (or None), and the date expression cache's counts.
+        '''
+        return {'requests': self.metrics.get_report(), 'uptime_seconds': time.time() - self.started, 'model_patients': len(self.model) if self.model is not None else None, 'date_cache': get_date_cache_stats()}
+
+
+    def close(self):
+        '''
+        This method stops the pool of worker processes, if there is one.
+        '''
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+
+class LatencyMetrics(object):
+    '''
+    A LatencyMetrics object counts the requests, errors and patients of each kind of request, and keeps the latencies of the most recent requests of each kind (at most 'max_latencies' of them) to report percentiles of.
+    '''
+    def __init__(self, max_latencies=None):
+        if max_latencies is None:
+            max_latencies = MAX_LATENCIES
+        self.max_latencies = max_latencies
+        self.counts = {}
+        self.latencies = {}
+        self.lock = threading.Lock()
+
+
+    def add(self, name, seconds, num_patients=0, error=False):
+        '''
+        This method takes as input the name of a kind of request, the seconds a request of that kind took, (optionally) the number of patients in it, and (optionally) whether it failed, and counts it.
+        '''
+        with self.lock:
+            counts = self.counts.setdefault(name, {'requests': 0, 'errors': 0, 'patients': 0})
+            counts['requests'] += 1
+            counts['patients'] += num_patients
+            if error:
+                counts['errors'] += 1
+            self.latencies.setdefault(name, deque(maxlen=self.max_latencies)).append(seconds)
+
+
+    def get_report(self):
+        '''
+        This method returns a dictionary of the names of the kinds of requests mapped to dictionaries of their counts and of the mean, median, 90th and 99th percentile and largest of their recent latencies, in milliseconds.
+        '''
+        with self.lock:
+            report = {}
+            for name, counts in self.counts.iteritems():
+                latencies = sorted(self.latencies[name])
+                report[name] = dict(counts)
+                report[name]['mean_ms'] = 1000 * sum(latencies) / len(latencies)
+                for label, fraction in (('p50_ms', 0.5), ('p90_ms', 0.9), ('p99_ms', 0.99)):
+                    report[name][label] = 1000 * latencies[min(int(fraction * len(latencies)), len(latencies) - 1)]
+                report[name]['max_ms'] = 1000 * latencies[-1]
+            return report
+
+
+class KeywordServer(ThreadingMixIn, HTTPServer):
+    '''
+    A KeywordServer object is an HTTP server that handles each request in its own thread, with a KeywordService ('service') to answer them.
+    '''
+    daemon_threads = True
+
+    def __init__(self, server_address, service):
+        HTTPServer.__init__(self, server_address, KeywordRequestHandler)
+        self.service = service
+
+
+class KeywordRequestHandler(BaseHTTPRequestHandler):
+    '''
+    A KeywordRequestHandler object handles one HTTP request to the keyword server (see the module documentation for the requests).
+    '''
+    def do_GET(self):
+        if self.path == '/metrics':
+            self.send_json(200, self.server.service.get_report())
+        else:
+            self.send_json(404, {'error': "Unknown path: %s" % self.path})
+
+
+    def do_POST(self):
+        start = time.time()
+        service = self.server.service
+        patients = []
+        try:
+            request = self.read_json()
+            patients = request.get('patients')
+            if not isinstance(patients, list):
+                raise ValueError("The request must have a list of patients")
+
+            if self.path == '/contribution':
+                top = request.get('top')
+                if top is not None and (not isinstance(top, int) or top < 0):
+                    raise ValueError("'top' must be a non-negative integer")
+                contributions = service.get_contributions([(get_MRN(patient), get_notes(patient), get_gold_date_expressions(patient)) for patient in patients], top)
+                response = {'patients': [{'mrn': MRN, 'keywords': keywords, 'from_model': from_model} for MRN, keywords, from_model in contributions]}
+            elif self.path == '/predict':
+                event_dates = service.get_event_dates([(get_MRN(patient), get_notes(patient)) for patient in patients])
+                response = {'patients': [{'mrn': MRN, 'date': event_date.make_date_expression() if event_date is not None else None} for MRN, event_date in event_dates]}
+            else:
+                self.send_json(404, {'error': "Unknown path: %s" % self.path})
+                return
+
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+            service.metrics.add(self.path, time.time() - start, 0, True)
+            return
+
+        # Any other failure is the service's, not the request's, but the request still gets an answer
+        except Exception as e:
+            LOG.error("Failed to answer request to %s" % self.path, exc_info=True)
+            self.send_json(500, {'error': "%s: %s" % (type(e).__name__, e)})
+            service.metrics.add(self.path, time.time() - start, 0, True)
+            return
+
+        self.send_json(200, response)
+        service.metrics.add(self.path, time.time() - start, len(patients))
+
+
+    def read_json(self):
+        '''
+        This method reads the body of the request and returns it as a JSON object (a dictionary), raising ValueError if it isn't one.
+        '''
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            raise ValueError("Bad Content-Length")
+        request = json.loads(self.rfile.read(length) or '{}')
+        if not isinstance(request, dict):
+            raise ValueError("The request must be a JSON object")
+        return request
+
+
+    def send_json(self, status, response):
+        '''
+        This method takes as input an HTTP status code and a JSON-serializable response, and sends them.
+        '''
+        body = json.dumps(response)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, format, *args):
+        LOG.info("%s - %s" % (self.address_string(), format % args))
+
+
+def get_MRN(patient):
+    '''
+    This method takes as input a patient of a request and returns the patient's MRN, raising ValueError if it has none.
+    '''
+    if not isinstance(patient, dict) or not isinstance(patient.get('mrn'), basestring):
+        raise ValueError("Each patient must have an MRN ('mrn')")
+    return patient['mrn'].encode('utf-8')
+
+
+def get_notes(patient):
+    '''
+    This method takes as input a patient of a request and returns the list of the patient's text blobs, raising ValueError if they aren't a list of strings.
+    '''
+    notes = patient.get('notes', [])
+    if not isinstance(notes, list) or not all(isinstance(note, basestring) for note in notes):
+        raise ValueError("The notes of each patient ('notes') must be a list of strings")
+    # The notes are read from files as byte strings everywhere else
+    return [note.encode('utf-8') for note in notes]
+
+
+def get_gold_date_expressions(patient):
+    '''
+    This method takes as input a patient of a request and returns the list of the patient's gold date expressions, raising ValueError if they aren't a list of strings.
+    '''
+    expressions = patient.get('gold_dates')
+    if not isinstance(expressions, list) or not all(isinstance(expression, basestring) for expression in expressions):
+        raise ValueError("The gold dates of each patient ('gold_dates') must be a list of date expressions")
+    return [expression.encode('utf-8') for expression in expressions]
+
+
+def make_gold_dates(expressions):
+    '''
+    This method takes as input a list of gold date expressions and returns the list of Date objects made of them.
+    NB: As in extract_keywords.read_gold_dates(), expressions that can't be interpreted are skipped, so that the patient's gold dates are the same as when the model was built from a gold data file.
+    '''
+    gold_dates = []
+    for expression in expressions:
+        date_vals = make_date(expression)
+        if not date_vals:
+            LOG.warning("Could not interpret date expression; skipping it: %s" % expression)
+        else:
+            gold_dates.extend(date_vals)
+    return gold_dates
+
+
+# Globals: Server
+# Listen only on this machine by default, since the requests carry clinical notes
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+MAX_LATENCIES = 10000
+
+
+if __name__=='__main__':
+    main()
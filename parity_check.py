@@ -0,0 +1,226 @@
+#!/usr/bin/python
+
+'''
+This script checks that the faster ways of computing keyword scores give exactly the same results as the straightforward ones, and exits with status 1 if any of them differ:
+1) get_all_ngram_distances() and get_all_ngram_distances_numpy() against get_ngram_distances() for every token, for random and hand-picked date indices, in both positions, with no window and with several windows,
+2) keyword scoring with the NumPy distance backend against the pure python backend, for single keywords and for n-grams, with no window and with a window,
+3) keyword scoring with a distance window (add_token_window_distances()) against the windowed distances of add_token_ngram_distances(), and
+4) keyword scoring with several worker processes against scoring in one process, for each of the above, and
+5) the tokens and true and false date indices of tokenize_with_dates() and tag_tokenized_dates() against those of the original path, custom_tokenize(tag_dates()).split() and get_date_indices(), for synthetic notes and for random snippets of tricky text (date expressions glued to other text, '/' and '-', and the TRUE_DATE, FALSE_DATE and DATE_MARKER strings themselves).
+Scores are compared as the exact sums and counts of the (keyword, position) 2-tuples (see NgramAccumulator.get_all_sums()) and as the ranking rank_keywords() returns.
+NB: N-grams counted approximately (see set_ngram_min_count()) are not checked, since each worker process counts the n-grams of its own patients.
+
+Command line usage: ./parity_check.py [--patients N] [--max-workers N] [--seed N]
+'''
+
+import argparse
+import logging
+import random
+import sys
+import extract_keywords
+from extract_keywords import *
+from synthetic_data import generate_patients
+
+LOG = logging.getLogger(__name__)
+LOG.setLevel(logging.WARNING)
+
+
+def main():
+    logging.basicConfig()
+
+    parser = argparse.ArgumentParser(description="Check that the faster ways of computing keyword scores give exactly the same results as the straightforward ones.")
+    parser.add_argument('--patients', type=int, default=40, help="number of synthetic patients (default: 40)")
+    parser.add_argument('--max-workers', type=int, default=3, help="largest number of worker processes to check (default: 3)")
+    parser.add_argument('--seed', type=int, default=0, help="random seed (default: 0)")
+    args = parser.parse_args()
+
+    if numpy is None:
+        LOG.warning("NumPy is not installed; only checking the pure python distances")
+
+    failures = check_distances(args.seed)
+    failures += check_scoring(args.patients, args.max_workers, args.seed)
+    failures += check_tokenizing(args.patients, args.seed)
+
+    if failures:
+        for failure in failures:
+            sys.stdout.write(failure + '\n')
+        sys.stdout.write("%s checks failed\n" % len(failures))
+        sys.exit(1)
+    sys.stdout.write("All checks passed\n")
+
+
+def get_windowed_distances(token_indices, date_indices, token_position, window):
+    '''
+    This method takes as input a list of token indices and the same date indices, token position and window as get_all_ngram_distances(), and returns the inverse distances get_all_ngram_distances() returns for those tokens, computed with get_ngram_distances() for each token in turn (from only the dates at most window tokens away, if a window is given).
+    '''
+    if window is None:
+        return [get_ngram_distances(token_index, date_indices, token_position) for token_index in token_indices]
+    return [get_ngram_distances(token_index, [date_index for date_index in date_indices if abs(date_index - token_index) <= window], token_position)
+            for token_index in token_indices]
+
+
+def make_distance_cases(seed):
+    '''
+    This method takes as input a random seed and returns a list of (number of tokens, sorted list of date indices) 2-tuples to compare the inverse distances for: hand-picked edge cases (no dates, dates at the ends, adjacent dates) and random ones.
+    '''
+    cases = [(0, []), (1, []), (1, [0]), (5, []), (5, [0]), (5, [4]), (5, [0, 4]), (6, [2, 3]), (6, [0, 1, 2, 3, 4, 5]), (300, [150]), (300, [0, 1, 298, 299])]
+    rand = random.Random(seed)
+    for i in xrange(50):
+        num_tokens = rand.randint(1, 1000)
+        num_dates = rand.randint(0, min(num_tokens, 40))
+        cases.append((num_tokens, sorted(rand.sample(xrange(num_tokens), num_dates))))
+    return cases
+
+
+def check_distances(seed):
+    '''
+    This method takes as input a random seed, compares get_all_ngram_distances() and get_all_ngram_distances_numpy() (if NumPy is installed) with get_ngram_distances() for each token (see get_windowed_distances()) on the cases make_distance_cases() returns, and returns a list of descriptions of the cases where they differ.
+    '''
+    failures = []
+    for num_tokens, date_indices in make_distance_cases(seed):
+        # Date tokens themselves are never scored
+        date_index_set = set(date_indices)
+        token_indices = [i for i in xrange(num_tokens) if i not in date_index_set]
+        for token_position in ('PRE-DATE', 'POST-DATE'):
+            for window in DISTANCE_WINDOWS:
+                expected = get_windowed_distances(token_indices, date_indices, token_position, window)
+                backends = [('python', get_all_ngram_distances)]
+                if numpy is not None:
+                    backends.append(('numpy', get_all_ngram_distances_numpy))
+                for backend, get_distances in backends:
+                    inv_dists = get_distances(num_tokens, date_indices, token_position, window)
+                    if len(inv_dists) != num_tokens or [inv_dists[i] for i in token_indices] != expected:
+                        failures.append("Distances differ from get_ngram_distances() (backend %s, %s tokens, %s dates, %s, window %s)" % (backend, num_tokens, len(date_indices), token_position, window))
+    return failures
+
+
+def get_results(accumulator):
+    '''
+    This method takes as input an NgramAccumulator and returns a (sorted list of (keyword, position) sums and counts, ranking) 2-tuple to compare it by (see NgramAccumulator.get_all_sums() and rank_keywords()).
+    '''
+    return (sorted(accumulator.get_all_sums()), rank_keywords(accumulator))
+
+
+def get_scoring_results(patients, workers, backend, max_length, window):
+    '''
+    This method takes as input a list of (list of text blobs, list of gold Date objects) 2-tuples, one per patient, the number of processes to score them in, the distance backend (see set_distance_backend()), the largest number of words in a keyword (see set_max_ngram_length()), and the distance window (see set_distance_window()), and returns the results of scoring the patients that way (see get_results()).
+    NB: With the NumPy backend, every note is given to it, however short (see NUMPY_MIN_TOKENS). With more than one process, the patients are sent to the workers in batches of SCORING_BATCH_SIZE (see PATIENTS_PER_BATCH), so that every worker gets several batches and their accumulators are merged.
+    '''
+    numpy_min_tokens = extract_keywords.NUMPY_MIN_TOKENS
+    patients_per_batch = extract_keywords.PATIENTS_PER_BATCH
+    set_distance_backend(backend)
+    set_max_ngram_length(max_length)
+    set_distance_window(window)
+    if backend == 'numpy':
+        extract_keywords.NUMPY_MIN_TOKENS = 0
+    extract_keywords.PATIENTS_PER_BATCH = SCORING_BATCH_SIZE
+    try:
+        return get_results(get_ngram_accumulator(patients, workers))
+    finally:
+        extract_keywords.NUMPY_MIN_TOKENS = numpy_min_tokens
+        extract_keywords.PATIENTS_PER_BATCH = patients_per_batch
+        set_distance_backend(DEFAULT_DISTANCE_BACKEND)
+        set_max_ngram_length(1)
+        set_distance_window(None)
+
+
+def get_ngram_window_results(patients, window):
+    '''
+    This method takes as input a list of (list of text blobs, list of gold Date objects) 2-tuples, one per patient, and a distance window, and returns the results of scoring single keywords with the windowed distances of add_token_ngram_distances() (see get_results()), rather than with add_token_window_distances(), which only visits the tokens near each date.
+    '''
+    set_distance_backend('python')
+    set_distance_window(window)
+    try:
+        accumulator = NgramAccumulator()
+        for blobs, gold_dates in patients:
+            gold_dates_index = DateIndex(gold_dates)
+            for blob in blobs:
+                tokens, date_indices, dates = tokenize_with_dates(blob)
+                true_date_indices, false_date_indices = tag_tokenized_dates(date_indices, dates, gold_dates_index)
+                add_token_ngram_distances(tokens, true_date_indices, false_date_indices, accumulator)
+        return get_results(accumulator)
+    finally:
+        set_distance_backend(DEFAULT_DISTANCE_BACKEND)
+        set_distance_window(None)
+
+
+def check_scoring(num_patients, max_workers, seed):
+    '''
+    This method takes as input a number of synthetic patients (see synthetic_data.generate_patients()), the largest number of worker processes to check, and a random seed. For single keywords and n-grams, with no window and with a window, it scores the patients in one process with the pure python distance backend, and compares the results with those of the NumPy backend (if NumPy is installed), of 2 to max_workers worker processes, and (for single keywords with a window) of add_token_ngram_distances(). It returns a list of descriptions of the results that differ.
+    '''
+    patients = [([blob for note_date, description, blob in notes], make_date(gold_date_expression))
+                for MRN, gold_date_expression, notes in generate_patients(num_patients, 5, 300, 0.02, 0.2, None, seed)]
+
+    failures = []
+    for max_length in SCORING_NGRAM_LENGTHS:
+        for window in SCORING_WINDOWS:
+            setting = "n-grams of up to %s words, window %s" % (max_length, window)
+            expected = get_scoring_results(patients, 1, 'python', max_length, window)
+            if not expected[0]:
+                failures.append("No keywords were scored (%s)" % setting)
+
+            others = []
+            if numpy is not None:
+                others.append(('NumPy backend', get_scoring_results(patients, 1, 'numpy', max_length, window)))
+            for workers in xrange(2, max_workers + 1):
+                others.append(('%s workers' % workers, get_scoring_results(patients, workers, 'python', max_length, window)))
+                if numpy is not None:
+                    others.append(('%s workers, NumPy backend' % workers, get_scoring_results(patients, workers, 'numpy', max_length, window)))
+            if max_length == 1 and window is not None:
+                others.append(('add_token_ngram_distances()', get_ngram_window_results(patients, window)))
+
+            for name, results in others:
+                if results[0] != expected[0]:
+                    failures.append("Sums and counts with %s differ from one process with the python backend (%s)" % (name, setting))
+                if results[1] != expected[1]:
+                    failures.append("Ranking with %s differs from one process with the python backend (%s)" % (name, setting))
+    return failures
+
+
+def get_tagged_tokens(text, gold_dates):
+    '''
+    This method takes as input a text blob and a list of gold Date objects, and returns the (lowercased tokens, true date indices, false date indices) 3-tuple of the original path: custom_tokenize(tag_dates()).split() and get_date_indices(), with the tokens that are (or encompass) TRUE_DATE or FALSE_DATE set to None, as tokenize_with_dates() sets them.
+    '''
+    tokens = custom_tokenize(tag_dates(text, gold_dates)).split()
+    true_date_indices, false_date_indices = get_date_indices(tokens)
+    tokens = [None if ('TRUE_DATE' in token or 'FALSE_DATE' in token) else token.lower() for token in tokens]
+    return (tokens, true_date_indices, false_date_indices)
+
+
+def check_tokenizing(num_patients, seed):
+    '''
+    This method takes as input a number of synthetic patients (see synthetic_data.generate_patients()) and a random seed, compares tokenize_with_dates() and tag_tokenized_dates() with the original path (see get_tagged_tokens()) on the patients' notes and on random snippets of TOKENIZING_PIECES, and returns a list of descriptions of the texts where they differ.
+    '''
+    texts = []
+    for MRN, gold_date_expression, notes in generate_patients(num_patients, 5, 300, 0.02, 0.2, None, seed):
+        texts.extend((blob, make_date(gold_date_expression)) for note_date, description, blob in notes)
+    rand = random.Random(seed)
+    gold_dates_choices = [make_date(expression) for expression in TOKENIZING_GOLD_DATES]
+    for i in xrange(TOKENIZING_SNIPPETS):
+        texts.append((''.join(rand.choice(TOKENIZING_PIECES) for k in xrange(rand.randint(0, 15))), rand.choice(gold_dates_choices)))
+
+    failures = []
+    for text, gold_dates in texts:
+        tokens, date_indices, dates = tokenize_with_dates(text)
+        if (tokens,) + tag_tokenized_dates(date_indices, dates, gold_dates) != get_tagged_tokens(text, gold_dates):
+            failures.append("tokenize_with_dates() differs from custom_tokenize(tag_dates()).split() for %r" % text[:200])
+    return failures
+
+
+# Globals: Checked Settings
+DISTANCE_WINDOWS = (None, 1, 3, 10)
+SCORING_NGRAM_LENGTHS = (1, 3)
+SCORING_WINDOWS = (None, 5)
+SCORING_BATCH_SIZE = 3
+DEFAULT_DISTANCE_BACKEND = extract_keywords.distance_backend
+
+# Pieces of the random snippets of text that tokenizing is checked on, and the gold dates they are tagged for
+TOKENIZING_SNIPPETS = 5000
+TOKENIZING_PIECES = ['March 2012', 'Jan. 5, 2011', '04/05/11', '4-5-2011', '12/2012', '2010 in May', '2012/03/04', '2013', 'Feb and Mar 2012', 'Sept 3 2014', 'may', 'May',
+                     'TRUE_DATE', 'FALSE_DATE', 'true_date', DATE_MARKER, DATE_MARKER.lower(), 'X' + DATE_MARKER + 'X',
+                     'abc', 'X', '5mg', '3', '/', '-', '//', '--', '/-', ' ', '  ', '\t', '\n', '.', ',', ':', '(', ')', "'", '\xe9', '_', 'a/b', '1/2', 'b-2', '2-b', 'Dr.', 'x1999', '1999x', '07/2010/']
+TOKENIZING_GOLD_DATES = ['March 2012', '2011', 'March 4, 2012', 'May 2010']
+
+
+if __name__=='__main__':
+    main()
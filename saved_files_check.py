@@ -0,0 +1,151 @@
+#!/usr/bin/python
+
+'''
+This script checks that the files extract_keywords.py saves (keyword models, see KeywordModel.save(), and notes indexes, see NotesIndex.save()) can be loaded both by extract_keywords.py run as a script and by code that imports it, and exits with status 1 if any check fails:
+1) a model saved by ./extract_keywords.py --model is loaded with load_keyword_model(), and gives the ranking the script printed,
+2) a model saved with KeywordModel.save() is updated by ./extract_keywords.py --model with the same patients, which prints the model's ranking,
+3) an index saved by ./extract_keywords.py --index is loaded with load_notes_index(), and is current, and
+4) an index saved with NotesIndex.save() is used by ./extract_keywords.py --index without being built again.
+The checks are run on synthetic notes (see synthetic_data.py) in a temporary directory.
+NB: This script imports extract_keywords as a module, rather than importing its names into its own, so that its own module (__main__) has none of extract_keywords' classes, as is the case in most code that uses it.
+
+Command line usage: ./saved_files_check.py [--patients N] [--seed N]
+'''
+
+import argparse
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import extract_keywords
+from synthetic_data import generate_patients, write_patients
+
+LOG = logging.getLogger(__name__)
+LOG.setLevel(logging.WARNING)
+
+
+def main():
+    logging.basicConfig()
+
+    parser = argparse.ArgumentParser(description="Check that keyword models and notes indexes saved by extract_keywords.py can be loaded both by the script and by code that imports it.")
+    parser.add_argument('--patients', type=int, default=20, help="number of synthetic patients (default: 20)")
+    parser.add_argument('--seed', type=int, default=0, help="random seed (default: 0)")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        failures = check_saved_files(directory, args.patients, args.seed)
+    finally:
+        shutil.rmtree(directory)
+
+    if failures:
+        for failure in failures:
+            sys.stdout.write(failure + '\n')
+        sys.stdout.write("%s checks failed\n" % len(failures))
+        sys.exit(1)
+    sys.stdout.write("All checks passed\n")
+
+
+def run_script(*args):
+    '''
+    This method takes as input the command line arguments of extract_keywords.py, runs it as a script, and returns a (exit status, standard out, standard error) 3-tuple.
+    '''
+    process = subprocess.Popen([sys.executable, SCRIPT_FILENAME] + list(args), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = process.communicate()
+    return (process.returncode, out, err)
+
+
+def format_keywords(keywords):
+    '''
+    This method takes as input a list of (keyword, position, score) 3-tuples and returns the lines extract_keywords.py prints for them.
+    '''
+    return ''.join(keyword+'\t'+position+'\t'+str(score)+'\n' for keyword, position, score in keywords)
+
+
+def check_saved_files(directory, num_patients, seed):
+    '''
+    This method takes as input a directory to write files in, a number of synthetic patients and a random seed, runs the checks, and returns a list of descriptions of the checks that failed.
+    '''
+    notes_filename = os.path.join(directory, 'notes.txt')
+    data_filename = os.path.join(directory, 'gold.txt')
+    notes_file = open(notes_filename, 'w')
+    data_file = open(data_filename, 'w')
+    write_patients(generate_patients(num_patients, 5, 300, 0.02, 0.2, None, seed), notes_file, data_file)
+    notes_file.close()
+    data_file.close()
+
+    notes_file = open(notes_filename)
+    blobs_dict = {}
+    for MRN, note in extract_keywords.read_notes(notes_file):
+        blobs_dict.setdefault(MRN, []).append(note)
+    notes_file.close()
+    data_file = open(data_filename)
+    gold_dates_dict = extract_keywords.read_gold_dates(data_file)
+    data_file.close()
+
+    failures = []
+
+    # (1) Saved by the script, loaded by an importer
+    script_model_filename = os.path.join(directory, 'script.model')
+    status, out, err = run_script('--model', script_model_filename, notes_filename, data_filename)
+    if status != 0:
+        failures.append("extract_keywords.py --model failed to save a new model:\n%s" % err)
+    else:
+        try:
+            model = extract_keywords.load_keyword_model(script_model_filename)
+        except ValueError as e:
+            failures.append("A model saved by extract_keywords.py --model can't be loaded by an importer: %s" % e)
+        else:
+            if len(model) != len(gold_dates_dict):
+                failures.append("A model saved by extract_keywords.py --model has %s patients, not %s" % (len(model), len(gold_dates_dict)))
+            if format_keywords(extract_keywords.rank_keywords(model.accumulator)) != out:
+                failures.append("A model saved by extract_keywords.py --model gives a different ranking when loaded by an importer")
+
+    # (2) Saved by an importer, loaded by the script
+    model = extract_keywords.KeywordModel()
+    model.update(blobs_dict, gold_dates_dict)
+    module_model_filename = os.path.join(directory, 'module.model')
+    model.save(module_model_filename)
+    status, out, err = run_script('--model', module_model_filename, notes_filename, data_filename)
+    if status != 0:
+        failures.append("A model saved by an importer can't be loaded by extract_keywords.py --model:\n%s" % err)
+    elif out != format_keywords(extract_keywords.rank_keywords(model.accumulator)):
+        failures.append("A model saved by an importer gives a different ranking when loaded by extract_keywords.py --model")
+
+    # (3) Index saved by the script, loaded by an importer
+    index_filename = notes_filename + extract_keywords.NOTES_INDEX_SUFFIX
+    status, out, err = run_script('--index', notes_filename, data_filename)
+    if status != 0:
+        failures.append("extract_keywords.py --index failed:\n%s" % err)
+    else:
+        try:
+            index = extract_keywords.load_notes_index(index_filename)
+        except ValueError as e:
+            failures.append("An index saved by extract_keywords.py --index can't be loaded by an importer: %s" % e)
+        else:
+            if not index.is_current(notes_filename) or sorted(index.spans) != sorted(blobs_dict):
+                failures.append("An index saved by extract_keywords.py --index isn't the index of the notes file when loaded by an importer")
+
+    # (4) Index saved by an importer, used by the script without building it again
+    extract_keywords.build_notes_index(notes_filename).save(index_filename)
+    index_stat = os.stat(index_filename)
+    # The script would save an index built again with a later modification time
+    os.utime(index_filename, (index_stat.st_atime, index_stat.st_mtime - 10))
+    index_mtime = os.stat(index_filename).st_mtime
+    status, out, err = run_script('--index', notes_filename, data_filename)
+    if status != 0:
+        failures.append("An index saved by an importer can't be used by extract_keywords.py --index:\n%s" % err)
+    elif os.stat(index_filename).st_mtime != index_mtime:
+        failures.append("An index saved by an importer was built again by extract_keywords.py --index:\n%s" % err)
+
+    return failures
+
+
+# Globals: Script
+SCRIPT_FILENAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'extract_keywords.py')
+
+
+if __name__=='__main__':
+    main()
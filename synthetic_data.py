@@ -0,0 +1,255 @@
+#!/usr/bin/python
+
+'''
+This script writes a synthetic notes file and a synthetic gold data file, in the formats read by extract_keywords.py, for testing and benchmarking:
+1) the notes file, where each line corresponds with a note and takes the format MRN[tab]date[tab]description[tab]text blob, and
+2) the gold data file, where each line corresponds with a patient and takes the format MRN[tab]gold_date.
+
+The notes are made of filler words and date expressions in all the shapes that date.date_regex recognizes (str1 to str11 in date.py). Some of the date expressions in each patient's notes are that patient's gold date, often next to words describing the event. The same seed always gives the same files.
+
+Command line usage: ./synthetic_data.py [options] <note-file> <gold-data-file>
+'''
+
+import argparse
+import logging
+import random
+from datetime import datetime
+from date import *
+
+LOG = logging.getLogger(__name__)
+LOG.setLevel(logging.WARNING)
+
+
+# Words that make up the text of the notes
+FILLER_WORDS = ['the', 'patient', 'was', 'seen', 'on', 'for', 'follow', 'up', 'and', 'in', 'with', 'no', 'evidence', 'of', 'disease', 'started', 'chemotherapy', 'radiation', 'mg', 'daily', 'pain', 'reports', 'denies', 'history', 'plan', 'labs', 'stable', 'continue', 'C/O', 's/p', '5/10', '1-2-3', 'pt\'s', 'Dr.', '(r)', 'follow-up', '"', ';', ':', '?']
+
+# Words that tend to appear next to mentions of the gold date (before it and after it)
+EVENT_WORDS_BEFORE = ['diagnosed', 'biopsy', 'resection', 'confirmed', 'pathology']
+EVENT_WORDS_AFTER = ['diagnosis', 'biopsy', 'surgery', 'showed', 'carcinoma']
+
+DESCRIPTIONS = ['Progress Note', 'Consult', 'Discharge Summary', 'Pathology Report', 'Telephone Encounter']
+
+# Full month names and abbreviations, by month number
+MONTH_NAMES = dict((int(number), name) for name, number in months.iteritems())
+MONTH_ABBREVIATIONS = dict((int(number), abbreviation) for abbreviation, number in month_abrvs.iteritems())
+
+MIN_YEAR = 1990
+MAX_YEAR = 2015
+
+# Days run up to 28, so that every day is valid in every month
+MAX_DAY = 28
+
+
+def main():
+    logging.basicConfig()
+
+    parser = argparse.ArgumentParser(description="Write a synthetic notes file and gold data file for testing and benchmarking.")
+    parser.add_argument('notes_filename', help="notes file to write")
+    parser.add_argument('data_filename', help="gold data file to write")
+    parser.add_argument('--seed', type=int, default=0, help="random seed (default: 0)")
+    parser.add_argument('--patients', type=int, default=100, help="number of patients (default: 100)")
+    parser.add_argument('--notes-per-patient', type=int, default=10, help="average number of notes per patient (default: 10)")
+    parser.add_argument('--tokens-per-note', type=int, default=300, help="average number of words per note (default: 300)")
+    parser.add_argument('--date-density', type=float, default=0.02, help="fraction of the words in a note that are date expressions (default: 0.02)")
+    parser.add_argument('--gold-fraction', type=float, default=0.2, help="fraction of the date expressions that are the patient's gold date (default: 0.2)")
+    parser.add_argument('--shapes', default=','.join(DATE_SHAPES), help="comma-separated date shapes to use, each optionally with a weight, e.g. 'str1=3,str3,str9' (default: all of them, equally weighted)")
+    args = parser.parse_args()
+
+    try:
+        shape_weights = parse_shape_weights(args.shapes)
+    except ValueError as e:
+        parser.error(str(e))
+
+    patients = generate_patients(args.patients, args.notes_per_patient, args.tokens_per_note, args.date_density, args.gold_fraction, shape_weights, args.seed)
+
+    notes_file = open(args.notes_filename, 'w')
+    data_file = open(args.data_filename, 'w')
+    write_patients(patients, notes_file, data_file)
+    notes_file.close()
+    data_file.close()
+
+
+def parse_shape_weights(string):
+    '''
+    This method takes as input a comma-separated string of date shapes (see DATE_SHAPES), each optionally followed by '=' and a weight, and returns a dictionary of date shapes mapped to their weights (1 by default).
+    '''
+    shape_weights = {}
+    for item in string.split(','):
+        shape, _, weight = item.strip().partition('=')
+        if shape not in date_expression_makers:
+            raise ValueError("Unknown date shape: %s (should be one of %s)" % (shape, ', '.join(DATE_SHAPES)))
+        shape_weights[shape] = float(weight) if weight else 1.0
+    return shape_weights
+
+
+def generate_patients(num_patients, notes_per_patient=10, tokens_per_note=300, date_density=0.02, gold_fraction=0.2, shape_weights=None, seed=0):
+    '''
+    This method takes as input:
+    (1) a number of patients,
+    (2) (optionally) the average number of notes per patient and of words per note,
+    (3) (optionally) the fraction of words that are date expressions and the fraction of date expressions that are the patient's gold date,
+    (4) (optionally) a dictionary of date shapes mapped to weights (see parse_shape_weights(); all shapes, equally weighted, by default), and
+    (5) (optionally) a random seed.
+    It then yields an (MRN, gold date expression, list of (note date, description, text blob) 3-tuples) 3-tuple for each patient.
+    '''
+    rand = random.Random(seed)
+    if shape_weights is None:
+        shape_weights = dict((shape, 1.0) for shape in DATE_SHAPES)
+    shapes = sorted(shape_weights)
+    total_weight = sum(shape_weights[shape] for shape in shapes)
+
+    def choose_shape():
+        x = rand.random() * total_weight
+        for shape in shapes:
+            x -= shape_weights[shape]
+            if x < 0:
+                return shape
+        return shapes[-1]
+
+    for i in xrange(num_patients):
+        MRN = 'MRN%06d' % i
+
+        # The gold date is known to the year, to the month, or to the day
+        gold_dt = make_random_datetime(rand)
+        precision = rand.choice(('year', 'month', 'day'))
+        gold_date = Date(gold_dt, precision == 'day', precision != 'year')
+
+        notes = []
+        for j in xrange(rand.randint(1, 2 * notes_per_patient - 1)):
+            words = []
+            for k in xrange(rand.randint(tokens_per_note // 2, tokens_per_note * 3 // 2)):
+                if rand.random() < date_density:
+                    if rand.random() < gold_fraction:
+                        if rand.random() < 0.5:
+                            words.append(rand.choice(EVENT_WORDS_BEFORE))
+                        words.append(date_expression_makers[choose_shape()](rand, gold_dt))
+                        if rand.random() < 0.5:
+                            words.append(rand.choice(EVENT_WORDS_AFTER))
+                    else:
+                        words.append(date_expression_makers[choose_shape()](rand, make_random_datetime(rand)))
+                else:
+                    words.append(rand.choice(FILLER_WORDS))
+            note_date = str(make_random_datetime(rand).date())
+            notes.append((note_date, rand.choice(DESCRIPTIONS), ' '.join(words)))
+
+        yield (MRN, gold_date.make_date_expression(), notes)
+
+
+def write_patients(patients, notes_file, data_file):
+    '''
+    This method takes as input an iterable of patients (as yielded by generate_patients()), an open notes file and an open gold data file, and writes the patients' notes and gold dates to them.
+    '''
+    for MRN, gold_date_expression, notes in patients:
+        data_file.write(MRN + '\t' + gold_date_expression + '\n')
+        for note_date, description, blob in notes:
+            notes_file.write(MRN + '\t' + note_date + '\t' + description + '\t' + blob + '\n')
+
+
+def make_random_datetime(rand):
+    '''
+    This method takes as input a random.Random object and returns a random python datetime between MIN_YEAR and MAX_YEAR.
+    '''
+    return datetime(rand.randint(MIN_YEAR, MAX_YEAR), rand.randint(1, 12), rand.randint(1, MAX_DAY))
+
+
+# Methods for writing a datetime as a date expression of each shape
+# NB: Some shapes give up the day or the month (e.g., str9 is a year only)
+
+def make_year(rand, dt, short=False):
+    if short:
+        return "'" + str(dt.year)[2:]
+    return str(dt.year)
+
+
+def make_day(rand, dt):
+    return str(dt.day) + rand.choice(('', '', 'st', 'nd', 'rd', 'th'))
+
+
+def make_expression_str1(rand, dt):
+    # e.g., "March 2012", "March 5, 2012", "March, '12"
+    if rand.random() < 0.5:
+        return MONTH_NAMES[dt.month] + ' ' + make_day(rand, dt) + ', ' + make_year(rand, dt)
+    return MONTH_NAMES[dt.month] + rand.choice((' ', ', ')) + make_year(rand, dt, rand.random() < 0.3)
+
+
+def make_expression_str2(rand, dt):
+    # e.g., "Jan 2011", "Jan. 5, 2011"
+    # NB: May has no abbreviation
+    month = MONTH_ABBREVIATIONS.get(dt.month, 'Jan')
+    if rand.random() < 0.5:
+        return month + rand.choice(('', '.')) + ' ' + make_day(rand, dt) + ', ' + make_year(rand, dt)
+    return month + rand.choice((' ', '. ')) + make_year(rand, dt)
+
+
+def make_expression_str3(rand, dt):
+    # e.g., "04/05/11", "4/5/2011"
+    return rand.choice(('%d', '%02d')) % dt.month + '/' + rand.choice(('%d', '%02d')) % dt.day + '/' + rand.choice((str(dt.year), str(dt.year)[2:]))
+
+
+def make_expression_str4(rand, dt):
+    # e.g., "4-5-2011"
+    return rand.choice(('%d', '%02d')) % dt.month + '-' + rand.choice(('%d', '%02d')) % dt.day + '-' + rand.choice((str(dt.year), str(dt.year)[2:]))
+
+
+def make_expression_str5(rand, dt):
+    # e.g., "12/2012", "3-2012"
+    return rand.choice(('%d', '%02d')) % dt.month + rand.choice(('/', '-')) + str(dt.year)
+
+
+def make_expression_str6(rand, dt):
+    # e.g., "2010 in May", "2010 in Mar", "2010 in March"
+    # NB: Of a full month name, date_regex only matches the abbreviation (e.g., "2010 in Mar" of "2010 in March"). The pattern can't make a date of November, so November dates are written in shape str1 instead.
+    if dt.month == 11:
+        return make_expression_str1(rand, dt)
+    return str(dt.year) + ' in ' + rand.choice((MONTH_NAMES[dt.month], MONTH_ABBREVIATIONS.get(dt.month, 'May')))
+
+
+def make_expression_str7(rand, dt):
+    # e.g., "2012/03/04", "2012/3/4"
+    return str(dt.year) + '/' + rand.choice(('%d', '%02d')) % dt.month + '/' + rand.choice(('%d', '%02d')) % dt.day
+
+
+def make_expression_str8(rand, dt):
+    # e.g., "2012-03-04"
+    return str(dt.year) + '-' + rand.choice(('%d', '%02d')) % dt.month + '-' + rand.choice(('%d', '%02d')) % dt.day
+
+
+def make_expression_str9(rand, dt):
+    # e.g., "2013"
+    return str(dt.year)
+
+
+def make_expression_str10(rand, dt):
+    # e.g., "Feb and Mar 2012", "February, and March '12"
+    other_month = dt.month % 12 + 1
+    if rand.random() < 0.5:
+        return MONTH_ABBREVIATIONS.get(dt.month, 'Apr') + ' and ' + MONTH_ABBREVIATIONS.get(other_month, 'Jun') + ' ' + make_year(rand, dt)
+    return MONTH_NAMES[dt.month] + ', and ' + MONTH_NAMES[other_month] + rand.choice((' ', ', ')) + make_year(rand, dt, rand.random() < 0.3)
+
+
+def make_expression_str11(rand, dt):
+    # e.g., "2011 and 2012"
+    # NB: date_regex matches each of the years on its own (as str9)
+    return str(dt.year) + ' and ' + str(dt.year + 1)
+
+
+# Date shapes, named after the patterns in date.py that recognize them
+DATE_SHAPES = ('str1', 'str2', 'str3', 'str4', 'str5', 'str6', 'str7', 'str8', 'str9', 'str10', 'str11')
+
+date_expression_makers = {
+    'str1': make_expression_str1,
+    'str2': make_expression_str2,
+    'str3': make_expression_str3,
+    'str4': make_expression_str4,
+    'str5': make_expression_str5,
+    'str6': make_expression_str6,
+    'str7': make_expression_str7,
+    'str8': make_expression_str8,
+    'str9': make_expression_str9,
+    'str10': make_expression_str10,
+    'str11': make_expression_str11,
+}
+
+
+if __name__=='__main__':
+    main()